@@ -0,0 +1,288 @@
+# aggregator.py - incremental per-county rolling-window counters
+import os
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class RollingWindow:
+    """
+    Per-minute transaction counters for every county, kept in a ring buffer of
+    `minutes` slots and broken down by payment type and sector.
+
+    Events are added with integer codes (index into the counties, payment_types
+    and sectors lists). Adding one event is O(1): two array increments, plus
+    clearing the slots that fell out of the window when a new minute starts.
+    Reading a county's window never touches the events themselves, so its
+    cost depends on the window length only.
+
+    Timestamps are epoch seconds. Callbacks in `on_minute_close` are called as
+    fn(minute, counts, amounts) with the (counties, payments, sectors) arrays of
+    each minute that closed, oldest first. They run after the window's lock is
+    released (they write rollups, alerts and saved state), so adds and reads
+    never wait on them; closed minutes are queued under the lock and delivered
+    in order by whichever thread closed them. The arrays are copies owned by
+    the callbacks; treat them as read-only, since every callback gets the same ones.
+    """
+
+    def __init__(self, n_counties, n_payments, n_sectors, minutes=60):
+        self.minutes = minutes
+        shape = (n_counties, minutes, n_payments, n_sectors)
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.amounts = np.zeros(shape, dtype=np.int64)
+        self.head = None  # latest epoch minute seen
+        self.version = np.zeros(n_counties, dtype=np.int64)  # bumped on every change to a county
+        self.events = 0
+        self.dropped = 0
+        self.on_minute_close = []
+        self.lock = threading.RLock()
+        self._closed = deque()  # (minute, counts, amounts) waiting for on_minute_close
+        self._deliver_lock = threading.Lock()
+
+    def _advance(self, minute):
+        # caller holds self.lock; start `minute`: clear the slots it reuses and
+        # queue the minutes before it for _deliver()
+        if self.head is None:
+            self.head = minute
+            return
+        if self.on_minute_close:
+            s = self.head % self.minutes
+            self._closed.append((self.head, self.counts[:, s].copy(), self.amounts[:, s].copy()))
+            # minutes without any event close with zeros (at most one window's worth)
+            zeros = np.zeros_like(self.counts[:, 0])
+            for m in range(max(self.head + 1, minute - self.minutes), minute):
+                self._closed.append((m, zeros, zeros))
+        for m in range(max(self.head + 1, minute - self.minutes + 1), minute + 1):
+            s = m % self.minutes
+            self.counts[:, s] = 0
+            self.amounts[:, s] = 0
+        self.head = minute
+        self.version += 1
+
+    def _deliver(self):
+        # called without self.lock; one thread at a time drains the queue, so
+        # the callbacks see minutes in the order they closed
+        while self._closed:
+            with self._deliver_lock:
+                while self._closed:
+                    try:
+                        minute, counts, amounts = self._closed.popleft()
+                    except IndexError:
+                        break
+                    for fn in self.on_minute_close:
+                        fn(minute, counts, amounts)
+
+    def advance(self, ts):
+        """
+        Moves the window to the minute of `ts` even if no event arrived, so quiet
+        minutes close too.
+        """
+        minute = int(ts) // 60
+        with self.lock:
+            if self.head is None or minute > self.head:
+                self._advance(minute)
+        self._deliver()
+
+    def add(self, ts, county, payment, sector, amount=0):
+        """
+        Counts one event. Returns False if it is older than the window.
+        """
+        minute = int(ts) // 60
+        with self.lock:
+            if self.head is None or minute > self.head:
+                self._advance(minute)
+            elif minute <= self.head - self.minutes:
+                self.dropped += 1
+                return False
+            s = minute % self.minutes
+            self.counts[county, s, payment, sector] += 1
+            self.amounts[county, s, payment, sector] += amount
+            self.version[county] += 1
+            self.events += 1
+        self._deliver()
+        return True
+
+    def add_batch(self, ts, county, payment, sector, amount=None):
+        """
+        Counts a batch of events given as equal-length integer arrays.
+        Returns how many were inside the window. Events of minutes newer than
+        the window are applied minute by minute, so `on_minute_close` sees every
+        minute complete even when one batch spans several of them.
+        """
+        ts = np.asarray(ts, dtype=np.int64)
+        if len(ts) == 0:
+            return 0
+        minute = ts // 60
+        county = np.asarray(county, dtype=np.int64)
+        payment = np.asarray(payment, dtype=np.int64)
+        sector = np.asarray(sector, dtype=np.int64)
+        if amount is not None:
+            amount = np.asarray(amount, dtype=np.int64)
+        with self.lock:
+            added = 0
+            if self.head is None:
+                newer = np.ones(len(ts), dtype=bool)
+            else:
+                newer = minute > self.head
+                current = ~newer & (minute > self.head - self.minutes)
+                self.dropped += int((~newer & ~current).sum())
+                added += self._accumulate(current, minute, county, payment, sector, amount)
+            if newer.any():
+                idx = np.flatnonzero(newer)
+                idx = idx[np.argsort(minute[idx], kind='stable')]
+                new_minutes, starts = np.unique(minute[idx], return_index=True)
+                ends = list(starts[1:]) + [len(idx)]
+                for m, a, b in zip(new_minutes, starts, ends):
+                    self._advance(int(m))
+                    added += self._accumulate(idx[a:b], minute, county, payment, sector, amount)
+            self.events += added
+        self._deliver()
+        return added
+
+    def _accumulate(self, sel, minute, county, payment, sector, amount):
+        county = county[sel]
+        if len(county) == 0:
+            return 0
+        _, n_slots, n_pay, n_sec = self.counts.shape
+        flat = ((county * n_slots + minute[sel] % self.minutes) * n_pay + payment[sel]) * n_sec + sector[sel]
+        size = self.counts.size
+        self.counts.reshape(-1)[:] += np.bincount(flat, minlength=size)
+        if amount is not None:
+            self.amounts.reshape(-1)[:] += np.bincount(flat, weights=amount[sel], minlength=size).astype(np.int64)
+        self.version[np.unique(county)] += 1
+        return len(county)
+
+    def dump(self):
+        """
+        The window's state as a dict of arrays (copies), for load().
+        """
+        with self.lock:
+            return {"counts": self.counts.copy(), "amounts": self.amounts.copy(),
+                    "version": self.version.copy(),
+                    "head": np.array(-1 if self.head is None else self.head, dtype=np.int64),
+                    "events": np.array(self.events, dtype=np.int64),
+                    "dropped": np.array(self.dropped, dtype=np.int64)}
+
+    def load(self, state):
+        """
+        Restores a dump() of a window with the same shape. Versions only move
+        forward, so snapshots cached before the restore are not served as current.
+        """
+        if state["counts"].shape != self.counts.shape:
+            raise ValueError(f"window shape {state['counts'].shape} does not match {self.counts.shape}")
+        with self.lock:
+            self.counts[:] = state["counts"]
+            self.amounts[:] = state["amounts"]
+            self.version = np.maximum(self.version, state["version"]) + 1
+            head = int(state["head"])
+            self.head = None if head < 0 else head
+            self.events = int(state["events"])
+            self.dropped = int(state["dropped"])
+
+    def window(self, county, minutes=None):
+        """
+        Returns (epoch_minutes, counts, amounts) for the last `minutes` minutes up
+        to the newest one seen, oldest first. counts and amounts have shape
+        (minutes, payments, sectors). Returns None before the first event.
+        """
+        minutes = min(minutes or self.minutes, self.minutes)
+        with self.lock:
+            if self.head is None:
+                return None
+            epoch_minutes = np.arange(self.head - minutes + 1, self.head + 1, dtype=np.int64)
+            slots = epoch_minutes % self.minutes
+            return epoch_minutes, self.counts[county, slots], self.amounts[county, slots]
+
+    def fingerprint(self, county):
+        """
+        (newest minute, transactions of `county` in the window). Unlike
+        `version`, which counts this process's updates, it is the same in
+        every process that holds the same data.
+        """
+        with self.lock:
+            if self.head is None:
+                return None
+            return self.head, int(self.counts[county].sum())
+
+    def has_data(self, county):
+        with self.lock:
+            return self.head is not None and bool(self.counts[county].any())
+
+    def county_totals(self, minutes=None):
+        """
+        One pass over the window for all counties. Returns (per_minute, by_payment,
+        amounts): transactions per county and minute (oldest first), per county and
+        payment type, and the amount per county. Returns None before the first event.
+        """
+        minutes = min(minutes or self.minutes, self.minutes)
+        with self.lock:
+            if self.head is None:
+                return None
+            slots = np.arange(self.head - minutes + 1, self.head + 1) % self.minutes
+            counts = self.counts[:, slots]
+            by_payment_minute = counts.sum(axis=3)  # (counties, minutes, payments)
+            amounts = self.amounts[:, slots].sum(axis=(1, 2, 3))
+        return by_payment_minute.sum(axis=2), by_payment_minute.sum(axis=1), amounts
+
+
+class Clock:
+    """
+    Moves `window` to the wall-clock minute every `interval` seconds on a
+    daemon thread (RollingWindow.advance), so minutes without events close
+    into the on_minute_close callbacks and a window whose data stopped, or
+    was restored from an old save, does not show its last minute as the
+    current one.
+
+    The thread is started by start() (on the first request, or by gunicorn
+    in each worker), so it runs in the processes that serve the window.
+    """
+
+    def __init__(self, window, interval=1.0):
+        self.window = window
+        self.interval = interval
+        self.ticks = 0
+        self._setup()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._setup)
+
+    def _setup(self):
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="window-clock", daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            self.window.advance(time.time())
+            self.ticks += 1
+            if self._stop.wait(self.interval):
+                return
+
+
+def top_k(values, k):
+    """
+    Indices of the k largest values, largest first, using a partial selection
+    (partition) instead of sorting everything. Equal values rank by index, so
+    a ranking with ties does not reshuffle from one refresh to the next.
+    """
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    kth = np.partition(values, len(values) - k)[len(values) - k]  # the k-th largest
+    idx = np.flatnonzero(values >= kth)
+    return idx[np.lexsort((idx, -values[idx]))[:k]]
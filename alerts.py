@@ -0,0 +1,172 @@
+# alerts.py - streaming spike/drop detection for every county, and a shared alert log
+import os
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+SPIKE, STABLE, DROP = 1, 0, -1
+ALERT_LABELS = {SPIKE: "🚀 Spike!", STABLE: "✅ Stable", DROP: "📉 Drop!"}
+
+
+class AnomalyDetector:
+    """
+    Keeps an exponentially weighted mean and variance of transactions per minute
+    for every county, updated once per closed minute in O(1) per county.
+
+    A minute is a spike (drop) when it is more than `threshold` percent above
+    (below) the county's EWMA, the same rule the dashboard applied to a 10-minute
+    rolling mean. Counties are only judged after `warmup` minutes and while
+    their mean is at least `min_mean`, so near-empty counties do not flap.
+    `on_alert(minute, county_index, kind, value, baseline, change)` is called
+    for every alert.
+    """
+
+    def __init__(self, n_counties, span=10, threshold=50.0, warmup=10, min_mean=5.0, on_alert=None):
+        self.alpha = 2.0 / (span + 1)
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_mean = min_mean
+        self.on_alert = on_alert
+        self.mean = np.zeros(n_counties)
+        self.var = np.zeros(n_counties)
+        self.seen = np.zeros(n_counties, dtype=np.int64)
+        self.last = np.zeros(n_counties)
+        self.change = np.zeros(n_counties)
+        self.status = np.zeros(n_counties, dtype=np.int8)
+        self.minute = None
+        self.lock = threading.Lock()
+
+    def observe(self, minute, tpm):
+        """
+        Feeds the transactions of one closed minute, one value per county.
+        """
+        x = np.asarray(tpm, dtype=float)
+        with self.lock:
+            if self.minute is not None and minute <= self.minute:
+                return  # already seen (e.g. restored state)
+            judged = (self.seen >= self.warmup) & (self.mean >= self.min_mean)
+            change = np.where(judged, (x - self.mean) / np.maximum(self.mean, 1e-9) * 100, 0.0)
+            status = np.where(change > self.threshold, SPIKE,
+                              np.where(change < -self.threshold, DROP, STABLE)).astype(np.int8)
+            baseline = self.mean.copy()
+
+            # a county's first minute starts its mean, rather than pulling
+            # a mean of zero up and judging later minutes against a low baseline
+            first = self.seen == 0
+            delta = np.where(first, 0.0, x - self.mean)
+            self.mean = np.where(first, x, self.mean + self.alpha * delta)
+            self.var = (1 - self.alpha) * (self.var + self.alpha * delta ** 2)
+            self.seen += 1
+            self.last, self.change, self.status = x, change, status
+            self.minute = minute
+
+        if self.on_alert is not None:
+            for c in np.flatnonzero(status):
+                self.on_alert(minute, int(c), int(status[c]), float(x[c]), float(baseline[c]), float(change[c]))
+
+    def dump(self):
+        """
+        The detector's state as a dict of arrays (copies), for load().
+        """
+        with self.lock:
+            return {"mean": self.mean.copy(), "var": self.var.copy(), "seen": self.seen.copy(),
+                    "last": self.last.copy(), "change": self.change.copy(), "status": self.status.copy(),
+                    "minute": np.array(-1 if self.minute is None else self.minute, dtype=np.int64)}
+
+    def load(self, state):
+        if state["mean"].shape != self.mean.shape:
+            raise ValueError(f"detector has {len(self.mean)} counties, state has {len(state['mean'])}")
+        with self.lock:
+            for name in ("mean", "var", "seen", "last", "change", "status"):
+                setattr(self, name, state[name].astype(getattr(self, name).dtype))
+            minute = int(state["minute"])
+            self.minute = None if minute < 0 else minute
+
+    def state(self, county):
+        with self.lock:
+            return {"minute": self.minute, "mean": float(self.mean[county]),
+                    "std": float(np.sqrt(self.var[county])), "last": float(self.last[county]),
+                    "change": float(self.change[county]), "status": int(self.status[county]),
+                    "ready": bool(self.seen[county] >= self.warmup)}
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    minute INTEGER NOT NULL,
+    county TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    value REAL,
+    baseline REAL,
+    change REAL,
+    created_at REAL NOT NULL,
+    UNIQUE (county, minute, kind)
+);
+CREATE INDEX IF NOT EXISTS alerts_minute ON alerts(minute);
+"""
+
+
+class AlertLog:
+    """
+    Alerts in SQLite, shared by all gunicorn workers. Each (county, minute, kind)
+    is stored once even if several workers detect it. The table is trimmed to
+    the newest `max_rows` alerts.
+    """
+
+    def __init__(self, path, max_rows=100000, prune_every=500):
+        self.path = path
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._inserts = 0
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # SQLite connections must not cross a fork (gunicorn --preload)
+        self._local = threading.local()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add(self, minute, county, kind, value=None, baseline=None, change=None):
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO alerts (minute, county, kind, value, baseline, change, created_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (int(minute), county, int(kind), value, baseline, change, time.time()))
+            self._inserts += 1
+            if self._inserts % self.prune_every == 0:
+                db.execute("DELETE FROM alerts WHERE id <= (SELECT MAX(id) FROM alerts) - ?", (self.max_rows,))
+
+    def query(self, county=None, start=None, end=None, limit=50):
+        """
+        Alerts newest first, optionally for one county and for epoch minutes
+        start <= minute < end.
+        """
+        where, args = [], []
+        if county is not None:
+            where.append("county = ?")
+            args.append(county)
+        if start is not None:
+            where.append("minute >= ?")
+            args.append(int(start))
+        if end is not None:
+            where.append("minute < ?")
+            args.append(int(end))
+        sql = "SELECT minute, county, kind, value, baseline, change FROM alerts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY minute DESC, id DESC LIMIT ?"
+        rows = self._connect().execute(sql, (*args, int(limit))).fetchall()
+        return [dict(r) for r in rows]
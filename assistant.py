@@ -0,0 +1,150 @@
+# assistant.py - answers dashboard questions ("average", "total", "Nairobi vs Mombasa this hour") from the stats cube
+import re
+import time
+import datetime
+
+EAT = datetime.timezone(datetime.timedelta(hours=3))
+
+HELP = ("Try asking about average, total, current, median or largest transactions, "
+        "e.g. \"total in Mombasa today\" or \"Nairobi vs Kisumu this hour\".")
+
+# (pattern, label, start(now_eat) -> datetime). "last N ..." is handled separately.
+RANGES = [
+    (r"\bthis hour\b", "this hour", lambda now: now.replace(minute=0, second=0, microsecond=0)),
+    (r"\b(last|past) hour\b", "in the last hour", lambda now: now - datetime.timedelta(hours=1)),
+    (r"\btoday\b", "today", lambda now: now.replace(hour=0, minute=0, second=0, microsecond=0)),
+    (r"\b(this|past|last) week\b|\b7 days\b", "in the last 7 days", lambda now: now - datetime.timedelta(days=7)),
+    (r"\b(this|past|last) month\b|\b30 days\b", "in the last 30 days", lambda now: now - datetime.timedelta(days=30)),
+    (r"\b(last|past) 24 ?h(ours)?\b", "in the last 24 hours", lambda now: now - datetime.timedelta(days=1)),
+]
+LAST_N = re.compile(r"\b(?:last|past) (\d+) ?(minute|min|hour|hr|day)s?\b")
+UNITS = {"minute": ("minute", 60), "min": ("minute", 60), "hour": ("hour", 3600), "hr": ("hour", 3600),
+         "day": ("day", 86400)}
+COMPARE = re.compile(r"\b(?:vs\.?|versus|compare[sd]?|against)\b")
+NATIONAL = re.compile(r"\b(kenya|national(ly)?|nationwide|all counties|(the )?country)\b")
+
+
+class Assistant:
+    """
+    Parses a question into counties (any mentioned, "Kenya" for all of them,
+    else the dashboard's),
+    an optional payment type and sector, a time range and a metric, and
+    answers it with StatsCube.query() lookups: one per county, so a
+    comparison costs the same as two single answers.
+    """
+
+    def __init__(self, cube, counties, payment_types, sectors):
+        self.cube = cube
+        self.counties = list(counties)
+        # longest names first, so "Homa Bay" is not read as something shorter
+        self._names = {kind: sorted(((n.lower(), i) for i, n in enumerate(names)), key=lambda x: -len(x[0]))
+                       for kind, names in (("county", counties), ("payment", payment_types), ("sector", sectors))}
+        self.payment_types, self.sectors = list(payment_types), list(sectors)
+
+    def _find(self, kind, text):
+        found = []
+        for name, i in self._names[kind]:
+            for m in re.finditer(r"\b" + re.escape(name) + r"\b", text):
+                if not any(a < m.end() and m.start() < b for a, b, _ in found):
+                    found.append((m.start(), m.end(), i))
+        return [i for _, _, i in sorted(found)]
+
+    def time_range(self, text, default, now=None):
+        """
+        (start, end, label) in epoch seconds for the range named in `text`,
+        else for `default` (a key of RANGES' labels: "this hour", "today", ...).
+        """
+        now = time.time() if now is None else now
+        local = datetime.datetime.fromtimestamp(now, EAT)
+        m = LAST_N.search(text)
+        if m:
+            n = int(m.group(1))
+            unit, seconds = UNITS[m.group(2)]
+            return now - n * seconds, now, f"in the last {n} {unit}{'s' if n != 1 else ''}"
+        if re.search(r"\byesterday\b", text):
+            end = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            return (end - datetime.timedelta(days=1)).timestamp(), end.timestamp(), "yesterday"
+        for pattern, label, start in RANGES:
+            if re.search(pattern, text):
+                return start(local).timestamp(), now, label
+        for pattern, label, start in RANGES:
+            if label == default:
+                return start(local).timestamp(), now, label
+        raise KeyError(default)
+
+    def answer(self, question, county=None, now=None):
+        text = question.lower()
+        now = time.time() if now is None else now
+        found = self._find("county", text)
+        if NATIONAL.search(text):
+            found = found + [None]  # Kenya as a whole, e.g. "Nairobi vs Kenya"
+        counties = found or ([self.counties.index(county)] if county in self.counties else [None])
+        payments, sectors = self._find("payment", text), self._find("sector", text)
+        payment = payments[0] if payments else None
+        sector = sectors[0] if sectors else None
+        what = " ".join(filter(None, [self.payment_types[payment] if payment is not None else None,
+                                      self.sectors[sector].lower() if sector is not None else None]))
+
+        if re.search(r"\b(current|latest|now|right now)\b", text) and not found[1:]:
+            # the last complete minute
+            minute = int(now) // 60 * 60
+            r = self.cube.query(minute - 60, minute, counties[0], payment, sector)
+            return f"Current {what + ' ' if what else ''}transactions per minute in {self._place(counties[0])}: {r['count']:,}."
+
+        if COMPARE.search(text) and len(counties) < 2:
+            return "Name two counties to compare, e.g. \"Nairobi vs Mombasa this hour\"."
+        metric = self._metric(text)
+        if metric is None and len(counties) < 2:
+            return HELP
+        start, end, label = self.time_range(text, "today" if metric == "total" else "this hour", now)
+        results = [self.cube.query(int(start), int(end) + 1, c, payment, sector) for c in counties]
+        if len(results) > 1:
+            return self._compare(counties, results, label, what)
+        return self._single(metric, counties[0], results[0], label, what)
+
+    @staticmethod
+    def _metric(text):
+        for metric, pattern in (("percentile", r"\bp\d\d\b|\bpercentiles?\b"), ("median", r"\bmedian\b|\btypical\b"),
+                                ("max", r"\b(max(imum)?|largest|biggest|highest)\b"),
+                                ("min", r"\b(min(imum)?|smallest|lowest)\b"),
+                                ("average", r"\b(average|mean|avg)\b"), ("total", r"\b(total|sum|how many|count|volume)\b")):
+            if re.search(pattern, text):
+                return metric
+        return None
+
+    def _place(self, county):
+        return "Kenya" if county is None else self.counties[county]
+
+    def _single(self, metric, county, r, label, what):
+        place = self._place(county)
+        kind = f"{what} transactions" if what else "transactions"
+        if not r["count"]:
+            return f"No {kind} recorded in {place} {label}."
+        minutes = max(1, (r["end"] - r["start"]) // 60)
+        if metric == "total":
+            return f"Total {kind} in {place} {label}: {r['count']:,} worth KES {r['sum']:,}."
+        if metric == "average":
+            return (f"Average in {place} {label}: {r['count'] / minutes:,.0f} {kind} per minute, "
+                    f"KES {r['mean']:,.0f} per transaction.")
+        if metric == "median":
+            return f"Median {kind[:-1] if kind.endswith('s') else kind} amount in {place} {label}: about KES {r['p50']:,.0f}."
+        if metric == "max":
+            return f"Largest {kind[:-1]} in {place} {label}: KES {r['max']:,}."
+        if metric == "min":
+            return f"Smallest {kind[:-1]} in {place} {label}: KES {r['min']:,}."
+        return (f"{kind[0].upper() + kind[1:-1]} amounts in {place} {label}: median about KES {r['p50']:,.0f}, "
+                f"90th percentile KES {r['p90']:,.0f}, 99th KES {r['p99']:,.0f}.")
+
+    def _compare(self, counties, results, label, what):
+        kind = f"{what} transactions" if what else "transactions"
+        parts = []
+        for c, r in zip(counties, results):
+            mean = f", avg KES {r['mean']:,.0f}" if r["count"] else ""
+            parts.append(f"{self._place(c)}: {r['count']:,} {kind}, KES {r['sum']:,}{mean}")
+        line = f"{label[0].upper() + label[1:]} — " + "; ".join(parts) + "."
+        a, b = results[0]["count"], results[1]["count"]
+        if a and b:
+            lead, ratio = (0, a / b) if a >= b else (1, b / a)
+            line += f" {self._place(counties[lead])} has {ratio:,.1f}x the transactions of " \
+                    f"{self._place(counties[1 - lead])}."
+        return line
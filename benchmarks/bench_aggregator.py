@@ -0,0 +1,69 @@
+# bench_aggregator.py - RollingWindow ingest throughput and window read cost
+#
+#   python benchmarks/bench_aggregator.py --events 500000
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregator import RollingWindow
+
+N_COUNTIES, N_PAYMENTS, N_SECTORS = 47, 3, 6
+TARGET_RATE = 50_000  # events/s on one core
+
+
+def make_events(n, seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(rng.integers(0, seconds, n)) + 1_700_000_000
+    return (ts, rng.integers(0, N_COUNTIES, n), rng.integers(0, N_PAYMENTS, n),
+            rng.integers(0, N_SECTORS, n), rng.integers(10, 5000, n))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=500_000)
+    parser.add_argument("--seconds", type=int, default=7200, help="time span the events cover")
+    parser.add_argument("--batch", type=int, default=10_000)
+    args = parser.parse_args()
+    ts, c, p, k, a = make_events(args.events, args.seconds)
+
+    window = RollingWindow(N_COUNTIES, N_PAYMENTS, N_SECTORS)
+    ts_l, c_l, p_l, k_l, a_l = ts.tolist(), c.tolist(), p.tolist(), k.tolist(), a.tolist()
+    start = time.perf_counter()
+    for i in range(len(ts_l)):
+        window.add(ts_l[i], c_l[i], p_l[i], k_l[i], a_l[i])
+    rate = args.events / (time.perf_counter() - start)
+    verdict = "ok" if rate >= TARGET_RATE else f"BELOW {TARGET_RATE:,}/s target"
+    print(f"add() one event at a time   {rate:14,.0f} events/s  ({verdict})")
+
+    window = RollingWindow(N_COUNTIES, N_PAYMENTS, N_SECTORS)
+    start = time.perf_counter()
+    for j in range(0, args.events, args.batch):
+        s = slice(j, j + args.batch)
+        window.add_batch(ts[s], c[s], p[s], k[s], a[s])
+    rate = args.events / (time.perf_counter() - start)
+    print(f"add_batch({args.batch:,})          {rate:14,.0f} events/s")
+
+    reps = 1000
+    start = time.perf_counter()
+    for i in range(reps):
+        minutes, counts, amounts = window.window(i % N_COUNTIES)
+        counts.sum(axis=(1, 2)), counts.sum(axis=2), counts.sum(axis=1)
+    print(f"window read + breakdowns     {(time.perf_counter() - start) / reps * 1e6:14,.1f} us/county")
+
+    # the old path: a DataFrame over every transaction received, on every refresh
+    for n in (10_000, 100_000, min(args.events, 1_000_000)):
+        records = [{"timestamp": pd.Timestamp(int(t), unit="s")} for t in ts[:n]]
+        start = time.perf_counter()
+        df = pd.DataFrame(records)
+        df["datetime"] = pd.to_datetime(df["timestamp"])
+        df.groupby(pd.Grouper(key="datetime", freq="min")).size()
+        print(f"legacy DataFrame groupby     {(time.perf_counter() - start) * 1e3:14,.1f} ms  for {n:,} events")
+
+
+if __name__ == '__main__':
+    main()
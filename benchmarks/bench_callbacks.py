@@ -0,0 +1,83 @@
+# bench_callbacks.py - micro-benchmarks of the dashboard hot paths
+#
+#   python benchmarks/bench_callbacks.py [--repeat 30] [--out results.json]
+#
+# Times process_transactions (simulated and live), snapshot/figure building,
+# update_dashboard (full redraw and delta tick), the user store and STK-push
+# request construction. M-Pesa is served by fake_daraja on a local port and the
+# app's databases go to a scratch directory. Results are printed and saved as
+# JSON (benchmarks/results/<commit>-callbacks.json); compare two runs with
+# benchmarks/compare.py.
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+import fake_daraja
+
+fake = fake_daraja.serve()
+os.environ["MPESA_BASE_URL"] = fake.base_url
+import denis
+
+
+def feed_live(minutes=60, rate=2000, seed=0):
+    # one hour of traffic for all counties, so the live paths have data
+    rng = np.random.default_rng(seed)
+    now = int(time.time())
+    n = minutes * rate
+    ts = np.sort(rng.integers(now - minutes * 60, now, n))
+    batch = denis.TransactionBatch(ts, rng.integers(0, len(denis.counties), n),
+                                   rng.integers(0, len(denis.payment_types), n),
+                                   rng.integers(0, len(denis.sectors), n), rng.integers(10, 5000, n))
+    denis.ingest_batch(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the dashboard hot paths")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--out", help="JSON file to write (default benchmarks/results/<commit>-callbacks.json)")
+    args = parser.parse_args()
+    r = args.repeat
+    results = {}
+
+    def run(name, fn, repeat=r):
+        results[name] = stats = benchlib.time_calls(fn, repeat=repeat)
+        print(f"{name:40s} p50 {stats['p50_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms")
+
+    run("process_transactions.simulated", lambda: denis.process_transactions([], "Kisumu"))
+    run("process_transactions.simulated_24h", lambda: denis.process_transactions([], "Kisumu", window=1440))
+    run("build_snapshot.simulated", lambda: denis.build_snapshot("Kisumu"))
+
+    feed_live()
+    run("process_transactions.live", lambda: denis.process_transactions([], "Nairobi"))
+    run("build_snapshot.live", lambda: denis.build_snapshot("Nairobi"))
+
+    def full_redraw():
+        denis.snapshot_cache.invalidate("Nairobi")
+        denis.update_dashboard("Nairobi", 0, None)
+    run("update_dashboard.full_uncached", full_redraw)
+    run("update_dashboard.full_cached", lambda: denis.update_dashboard("Nairobi", 0, None))
+    sync = denis.update_dashboard("Nairobi", 0, None)[-1]
+    run("update_dashboard.delta_cached", lambda: denis.update_dashboard("Nairobi", 1, sync))
+    run("update_top_counties", lambda: denis.update_top_counties("transactions", 1))
+
+    emails = iter(range(10**9))
+    run("user_store.add_user", lambda: denis.add_user("Bench User", f"user{next(emails)}@example.com",
+                                                     "secret", "Basic"), repeat=r * 10)
+    run("user_store.email_exists.hit", lambda: denis.email_exists("user1@example.com"), repeat=r * 10)
+    run("user_store.email_exists.miss", lambda: denis.email_exists("nobody@example.com"), repeat=r * 10)
+    run("build_stk_push_payload", lambda: denis.build_stk_push_payload("254708374149", 10), repeat=r * 10)
+
+    path = benchlib.save_results("callbacks", results, args.out)
+    print(f"saved {path}")
+    fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# bench_columnar.py - memory of list-of-dicts vs DataFrame vs TransactionBatch
+#
+#   python benchmarks/bench_columnar.py --n 1000000 --per-day 30000000
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from columnar import TransactionBatch
+
+COUNTIES = [f"County {i}" for i in range(47)]
+PAYMENTS = ['Mpesa', 'Airtel Money', 'Bank Transfer']
+SECTORS = ['Transport', 'Communication', 'Retail', 'Banking', 'Government', 'Utilities']
+
+
+def make_records(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(rng.integers(0, 86400, n)) + 1_800_000_000
+    c, p, k = rng.integers(0, 47, n), rng.integers(0, 3, n), rng.integers(0, 6, n)
+    amounts = rng.integers(10, 5000, n)
+    stamps = pd.to_datetime(ts, unit='s').strftime('%Y-%m-%dT%H:%M:%S')
+    return [{'timestamp': stamps[i], 'county': COUNTIES[c[i]], 'payment_type': PAYMENTS[p[i]],
+             'sector': SECTORS[k[i]], 'amount': int(amounts[i])} for i in range(n)]
+
+
+def measured(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = fn()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--per-day", type=int, default=30_000_000, help="transactions per day to extrapolate to")
+    args = parser.parse_args()
+    idx = ({c: i for i, c in enumerate(COUNTIES)}, {p: i for i, p in enumerate(PAYMENTS)},
+           {s: i for i, s in enumerate(SECTORS)})
+
+    records, rec_bytes, _ = measured(lambda: make_records(args.n))
+    frame = pd.DataFrame(records)
+    frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+    df_bytes = int(frame.memory_usage(deep=True).sum())
+    del frame
+    batch, _, build_s = measured(lambda: TransactionBatch.from_records(records, *idx))
+    del records
+    batch_bytes = batch.nbytes
+
+    day = args.per_day / args.n
+    print(f"{args.n:,} transactions ({args.per_day:,}/day extrapolation)")
+    for label, size in (("list of dicts", rec_bytes), ("pandas, object columns", df_bytes),
+                        ("TransactionBatch", batch_bytes)):
+        print(f"  {label:<24} {size / args.n:8.1f} B/txn  {size * day / 2**30:9.2f} GiB/day"
+              f"  ({size / batch_bytes:5.1f}x batch)")
+    print(f"  from_records            {args.n / build_s:12,.0f} records/s")
+
+    start = time.perf_counter()
+    mid = int(batch.ts[0]) + 43200
+    for _ in range(1000):
+        batch.between(mid, mid + 3600)
+    print(f"  between() 1h slice      {(time.perf_counter() - start) * 1000:12.1f} us (zero-copy)")
+    start = time.perf_counter()
+    batch.to_pandas(COUNTIES, PAYMENTS, SECTORS)
+    print(f"  to_pandas (categorical) {(time.perf_counter() - start) * 1000:12.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# bench_cube.py - stats cube: ingest overhead, question latency vs a DataFrame scan, accuracy
+#
+#   python benchmarks/bench_cube.py --hours 1 4 24 --rate 200
+#
+# For each history length, firehose data (--rate tx/s) is folded into a
+# StatsCube and kept as a DataFrame. The same questions ("total today",
+# "Nairobi this hour", "Nairobi vs Mombasa this hour", median/p90/p99) are
+# answered both ways; cube latency should not grow with the history, the scan
+# does. Counts, sums, min and max must match exactly; percentiles are
+# reported as relative error. Ingest cost is RollingWindow.add_batch alone vs
+# with StatsCube.add_batch, in one-second batches.
+#
+# Saves benchmarks/results/<commit>-cube.json.
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+from aggregator import RollingWindow
+from cube import StatsCube
+from firehose import COUNTY_POPULATION, Firehose
+
+COUNTIES = list(COUNTY_POPULATION)
+PAYMENTS = ["Mpesa", "Airtel Money", "Bank Transfer"]
+SECTORS = ["Transport", "Communication", "Retail", "Banking", "Government", "Utilities"]
+NAIROBI, MOMBASA = COUNTIES.index("Nairobi"), COUNTIES.index("Mombasa")
+
+
+def ingest_cost(rate, seconds):
+    hose = Firehose(COUNTIES, PAYMENTS, SECTORS, rate=rate, seed=5)
+    start = int(time.time()) - seconds
+    batches = [hose.batch(t, t + 1) for t in range(start, start + seconds)]
+    n = sum(len(b) for b in batches)
+    live = RollingWindow(len(COUNTIES), len(PAYMENTS), len(SECTORS))
+    t = time.perf_counter()
+    for b in batches:
+        live.add_batch(b.ts, b.county, b.payment, b.sector, b.amount)
+    live_s = time.perf_counter() - t
+    cube = StatsCube(len(COUNTIES), len(PAYMENTS), len(SECTORS))
+    t = time.perf_counter()
+    for b in batches:
+        cube.add_batch(b)
+    cube_s = time.perf_counter() - t
+    return {"rows": n, "live_per_s": n / live_s, "cube_per_s": n / cube_s,
+            "both_per_s": n / (live_s + cube_s)}
+
+
+def scan(df, start, end, county=None):
+    sel = (df["ts"] >= start) & (df["ts"] < end)
+    if county is not None:
+        sel &= df["county"] == county
+    a = df.loc[sel, "amount"]
+    return {"count": int(len(a)), "sum": int(a.sum()), "min": int(a.min()), "max": int(a.max()),
+            "p50": float(a.quantile(0.5)), "p90": float(a.quantile(0.9)), "p99": float(a.quantile(0.99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stats cube vs DataFrame scan")
+    parser.add_argument("--hours", type=int, nargs="+", default=[1, 4, 24])
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--reps", type=int, default=50)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    import pandas as pd
+
+    results = {"ingest": ingest_cost(20_000, 60), "history": []}
+    r = results["ingest"]
+    print(f"ingest 1 s batches: live {r['live_per_s']:,.0f}/s, cube {r['cube_per_s']:,.0f}/s, "
+          f"live + cube {r['both_per_s']:,.0f}/s")
+
+    now = int(time.time())
+    hour = now // 3600 * 3600
+    for hours in args.hours:
+        hose = Firehose(COUNTIES, PAYMENTS, SECTORS, rate=args.rate, seed=6)
+        cube = StatsCube(len(COUNTIES), len(PAYMENTS), len(SECTORS))
+        batches = list(hose.batches(now - hours * 3600, now, step=60))
+        for b in batches:
+            cube.add_batch(b)
+        df = pd.DataFrame({"ts": np.concatenate([b.ts for b in batches]),
+                           "county": np.concatenate([b.county for b in batches]),
+                           "amount": np.concatenate([b.amount for b in batches])})
+        questions = {"all, whole history": (now - hours * 3600, now + 1, None),
+                     "Nairobi this hour": (hour, now + 1, NAIROBI),
+                     "Nairobi vs Mombasa this hour": None}
+        row = {"hours": hours, "transactions": len(df), "questions": {}}
+        for name, q in questions.items():
+            if q is None:
+                cube_fn = lambda: [cube.query(hour, now + 1, c) for c in (NAIROBI, MOMBASA)]
+                scan_fn = lambda: [scan(df, hour, now + 1, c) for c in (NAIROBI, MOMBASA)]
+                exact, approx = scan_fn()[0], cube_fn()[0]
+            else:
+                cube_fn = lambda q=q: cube.query(*q[:2], county=q[2])
+                scan_fn = lambda q=q: scan(df, *q)
+                exact, approx = scan_fn(), cube_fn()
+            c = benchlib.time_calls(cube_fn, repeat=args.reps)
+            s = benchlib.time_calls(scan_fn, repeat=max(3, args.reps // 10))
+            ok = all(exact[k] == approx[k] for k in ("count", "sum", "min", "max"))
+            err = {p: abs(approx[p] - exact[p]) / exact[p] for p in ("p50", "p90", "p99")}
+            row["questions"][name] = {"cube": c, "scan": s, "exact_stats_match": ok, "percentile_rel_error": err}
+            print(f"{hours:3d} h {len(df):>11,} tx  {name:30s} cube p50 {c['p50_ms']:7.3f} ms  "
+                  f"scan p50 {s['p50_ms']:9.2f} ms  count/sum/min/max {'match' if ok else 'DIFFER'}  "
+                  f"percentile error {max(err.values()) * 100:4.1f}% max")
+        results["history"].append(row)
+    print(f"saved {benchlib.save_results('cube', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_daraja.py - per-call requests vs pooled DarajaClient, against fake_daraja
+#
+#   python benchmarks/bench_daraja.py --calls 500 --threads 8 --latency 20
+import os
+import sys
+import time
+import base64
+import argparse
+import threading
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fake_daraja
+from daraja import DarajaClient
+
+KEY, SECRET = "key", "secret"
+
+
+def legacy_token(base_url):
+    # what get_mpesa_oauth_token used to do: module-level requests, new connection each time
+    b64 = base64.b64encode(f"{KEY}:{SECRET}".encode()).decode()
+    resp = requests.get(f"{base_url}/oauth/v1/generate?grant_type=client_credentials",
+                        headers={"Authorization": f"Basic {b64}"}, timeout=10)
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+def legacy_push(base_url, token, payload):
+    resp = requests.post(f"{base_url}/mpesa/stkpush/v1/processrequest", json=payload,
+                         headers={"Authorization": f"Bearer {token}"}, timeout=15)
+    resp.raise_for_status()
+
+
+def run(label, calls, threads, one_call):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = calls // threads
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            t0 = time.perf_counter()
+            one_call()
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    n = len(latencies)
+    print(f"{label:<28} {n / elapsed:10.1f} calls/s   p50 {latencies[n // 2] * 1000:7.2f} ms"
+          f"   p95 {latencies[int(n * 0.95)] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0, help="fake server latency in ms")
+    args = parser.parse_args()
+
+    server = fake_daraja.serve(latency_ms=args.latency, callback_delay=3600)
+    base_url = server.base_url
+    payload = {"PhoneNumber": "254700000000", "Amount": 10, "BusinessShortCode": "174379"}
+    print(f"fake Daraja at {base_url}, {args.calls} calls, {args.threads} threads, "
+          f"{args.latency} ms server latency (plain HTTP, so TLS savings are not included)")
+
+    token = legacy_token(base_url)
+    run("legacy oauth", args.calls, args.threads, lambda: legacy_token(base_url))
+    run("legacy stk push", args.calls, args.threads, lambda: legacy_push(base_url, token, payload))
+
+    client = DarajaClient(base_url, KEY, SECRET, pool_maxsize=args.threads)
+    run("pooled oauth", args.calls, args.threads, client.fetch_token)
+    run("pooled stk push", args.calls, args.threads,
+        lambda: client.stk_push(token, payload).raise_for_status())
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# bench_executor.py - dashboard latency with and without slow donations in flight
+#
+#   python benchmarks/bench_executor.py --sessions 40 --donors 20 --daraja-latency 3000
+#
+# Runs bench_load once per DASHBOARD_EXECUTOR kind without donations, and once
+# with --donors sessions donating while fake_daraja takes --daraja-latency ms
+# per call. The dashboard p99 should stay flat when donations are added.
+# Saves benchmarks/results/<commit>-executor.json.
+import os
+import sys
+import copy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+import bench_load
+
+
+def main():
+    p = bench_load.parser()
+    p.set_defaults(sessions=40, duration=30, donors=20, daraja_latency=3000)
+    p.add_argument("--kinds", default="inline,thread,process")
+    args = p.parse_args()
+
+    results = {}
+    for kind in args.kinds.split(","):
+        for donors in (0, args.donors):
+            run_args = copy.copy(args)
+            run_args.executor, run_args.donors = kind, donors
+            del run_args.kinds
+            name = f"{kind}.donors_{donors}"
+            print(f"--- {name}")
+            results[name] = r = bench_load.run(run_args)
+            bench_load.report(r)
+
+    print()
+    print(f"{'executor':10s} {'donors':>6s} {'dashboard p50':>14s} {'p95':>9s} {'p99':>9s} {'req/s':>7s}")
+    for name, r in results.items():
+        kind, donors = name.split(".donors_")
+        d = r.get("dashboard", {})
+        if d.get("n"):
+            print(f"{kind:10s} {donors:>6s} {d['p50_ms']:11.1f} ms {d['p95_ms']:6.1f} ms "
+                  f"{d['p99_ms']:6.1f} ms {r['requests_per_s']:7.1f}")
+    print(f"saved {benchlib.save_results('executor', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# bench_firehose.py - synthetic transaction throughput and the ceiling of the live pipeline
+#
+#   python benchmarks/bench_firehose.py --seconds 60 --budget 0.5
+#
+# generate  Firehose.batch() alone, one-second batches, as fast as it goes
+# pipeline  generate + denis.ingest_batch (live window, minute rollups to disk,
+#           spike/drop detection) in one-second batches of simulated time, at
+#           doubling rates until one second of traffic costs more than --budget
+#           seconds of CPU; the last rate under budget is the ceiling, leaving
+#           the rest of the core to serve dashboards
+# replay    writes --replay-minutes of traffic to a .txb file, reads it back
+#           and checks the same seed reproduces it
+#
+# Saves benchmarks/results/<commit>-firehose.json.
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+os.environ.setdefault("MPESA_BASE_URL", "http://127.0.0.1:9")
+os.environ["DASHBOARD_STATE_FILE"] = ""
+from columnar import read_batches
+from firehose import Firehose
+
+
+def generate(denis, rate, seconds):
+    hose = Firehose(denis.counties, denis.payment_types, denis.sectors, rate=rate, seed=1)
+    start = time.perf_counter()
+    n = sum(len(hose.batch(t, t + 1)) for t in range(1_700_000_000, 1_700_000_000 + seconds))
+    return n / (time.perf_counter() - start)
+
+
+def pipeline(denis, rate, seconds, clock):
+    """
+    Feeds `seconds` of traffic starting at simulated time `clock`; returns
+    the CPU seconds one second of traffic cost, split into generate and ingest.
+    """
+    hose = Firehose(denis.counties, denis.payment_types, denis.sectors, rate=rate, seed=2)
+    gen = ingest = 0.0
+    n = 0
+    for t in range(clock, clock + seconds):
+        t0 = time.perf_counter()
+        batch = hose.batch(t, t + 1)
+        t1 = time.perf_counter()
+        n += denis.ingest_batch(batch)
+        ingest += time.perf_counter() - t1
+        gen += t1 - t0
+    return {"rate": rate, "accepted": n, "generate_s_per_s": gen / seconds,
+            "ingest_s_per_s": ingest / seconds, "cpu_s_per_s": (gen + ingest) / seconds}
+
+
+def replay(denis, rate, minutes):
+    start = int(time.time()) - minutes * 60
+    path = os.path.abspath("replay.txb")
+    hose = Firehose(denis.counties, denis.payment_types, denis.sectors, rate=rate, seed=3)
+    hose.random_events(start, start + minutes * 60, per_day=500, seed=3)
+    t = time.perf_counter()
+    n = hose.write(path, start, start + minutes * 60)
+    write_s = time.perf_counter() - t
+    t = time.perf_counter()
+    batches = list(read_batches(path))
+    read_s = time.perf_counter() - t
+
+    again = Firehose(denis.counties, denis.payment_types, denis.sectors, rate=rate, seed=3)
+    again.random_events(start, start + minutes * 60, per_day=500, seed=3)
+    same = all(np.array_equal(a.amount, b.amount) and np.array_equal(a.ts, b.ts)
+               for a, b in zip(batches, again.batches(start, start + minutes * 60)))
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {"transactions": n, "bytes": size, "events": len(hose.events),
+            "write_per_s": n / write_s, "read_per_s": n / read_s, "deterministic": same}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Firehose generation rate and live pipeline ceiling")
+    parser.add_argument("--seconds", type=int, default=60, help="simulated seconds per rate")
+    parser.add_argument("--budget", type=float, default=0.5, help="CPU seconds per second of traffic")
+    parser.add_argument("--start-rate", type=float, default=25_000)
+    parser.add_argument("--max-rate", type=float, default=16_000_000)
+    parser.add_argument("--replay-minutes", type=int, default=10)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    import denis
+
+    results = {"generate": {}, "pipeline": []}
+    for rate in (100_000, 1_000_000, 4_000_000):
+        r = results["generate"][int(rate)] = generate(denis, rate, max(2, args.seconds // 10))
+        print(f"generate at {rate:>12,.0f}/s   {r:14,.0f} tx/s")
+
+    # simulated time runs forward from a day ago, so minutes close (and roll up) as in production
+    clock = int(time.time()) - 86400
+    rate, ceiling = args.start_rate, None
+    while rate <= args.max_rate:
+        r = pipeline(denis, rate, args.seconds, clock)
+        clock += args.seconds
+        results["pipeline"].append(r)
+        ok = r["cpu_s_per_s"] <= args.budget
+        print(f"pipeline at {rate:>12,.0f}/s   {r['cpu_s_per_s']:6.3f} CPU s per s "
+              f"(generate {r['generate_s_per_s']:.3f}, ingest {r['ingest_s_per_s']:.3f})"
+              f"{'' if ok else '  over budget'}")
+        if not ok:
+            break
+        ceiling = rate
+        rate *= 2
+    results["ceiling_per_s"] = ceiling
+    last = results["pipeline"][-1]
+    results["ingest_only_per_s"] = last["rate"] / last["ingest_s_per_s"]
+    print(f"ceiling          {ceiling or 0:14,.0f} tx/s within {args.budget} CPU s per second "
+          f"(ingest alone {results['ingest_only_per_s']:,.0f} tx/s)")
+
+    r = results["replay"] = replay(denis, 10_000, args.replay_minutes)
+    print(f"replay file      {r['transactions']:,} tx, {r['bytes'] / 1e6:.0f} MB, {r['events']} spikes/drops; "
+          f"write {r['write_per_s']:,.0f}/s, read {r['read_per_s']:,.0f}/s, "
+          f"{'deterministic' if r['deterministic'] else 'NOT deterministic'}")
+    print(f"saved {benchlib.save_results('firehose', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench_ingest.py - backfill rate and peak memory of ingest.py against file size
+#
+#   python benchmarks/bench_ingest.py --rows 1000000 4000000 --memory-mb 64
+#
+# Writes a time-ordered CSV export of each size (firehose data over the last
+# --days days, as text: ISO timestamps and names), then runs
+# `python ingest.py FILE --memory-mb M` on it in a fresh process and reports
+# rows/s, the longest time one batch held the window, and the peak RSS. With
+# a bounded memory budget the peak should not grow with the file. Importing
+# the CLI's modules (pandas included) alone is measured as the baseline.
+#
+# Saves benchmarks/results/<commit>-ingest.json.
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+import time
+
+from constants import counties, payment_types, sectors
+from firehose import Firehose
+
+BASELINE = ("import resource, sys; sys.path.insert(0, sys.argv[1]); "
+            "import pandas, ingest, rollups, aggregator, constants; "
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)")
+
+
+def write_export(path, rows, days):
+    seconds = days * 86400
+    hose = Firehose(counties, payment_types, sectors, rate=rows / seconds, seed=4)
+    end = int(time.time()) // 60 * 60
+    written = 0
+    with open(path, "w") as f:
+        for i, batch in enumerate(hose.batches(end - seconds, end, step=3600)):
+            df = batch.to_pandas(counties, payment_types, sectors)
+            df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+            df.to_csv(f, index=False, header=i == 0)
+            written += len(df)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill rate and memory of ingest.py")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 4_000_000])
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--memory-mb", type=int, default=64)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    env = dict(os.environ, MPESA_BASE_URL="http://127.0.0.1:9", DASHBOARD_STATE_FILE="")
+    out = subprocess.run([sys.executable, "-c", BASELINE, benchlib.REPO], env=env,
+                         capture_output=True, text=True, check=True)
+    results = {"baseline_rss_mb": float(out.stdout.strip().splitlines()[-1]), "runs": []}
+    print(f"import CLI modules          peak RSS {results['baseline_rss_mb']:6.0f} MB")
+    for rows in args.rows:
+        path = os.path.abspath(f"export-{rows}.csv")
+        written = write_export(path, rows, args.days)
+        size = os.path.getsize(path)
+        out = subprocess.run([sys.executable, os.path.join(benchlib.REPO, "ingest.py"), path,
+                              "--memory-mb", str(args.memory_mb)],
+                             env=dict(env, ROLLUP_DIR=f"rollups-{rows}"), capture_output=True, text=True, check=True)
+        os.remove(path)
+        r = json.loads(out.stdout)
+        r.update(file_rows=written, file_mb=size / 1e6)
+        results["runs"].append(r)
+        print(f"{written:>10,} rows {size / 1e6:6.0f} MB  {r['rows_per_s']:9,.0f} rows/s  "
+              f"peak RSS {r['peak_rss_mb']:6.0f} MB  longest batch {r['max_sink_ms']:5.0f} ms  "
+              f"rejected {sum(r['rejected'].values())}, dropped {r['dropped_out_of_order']}")
+    print(f"saved {benchlib.save_results('ingest', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# bench_load.py - concurrent dashboard sessions against the app under gunicorn
+#
+#   python benchmarks/bench_load.py --sessions 100 --duration 60 --workers 4
+#
+# Starts fake_daraja and `gunicorn denis:server` in a scratch directory, then
+# runs N sessions that each load the page and send the two interval callbacks
+# (county dashboard with its delta state, and top counties) to
+# /_dash-update-component every --interval seconds, as an open tab does.
+# --interval 0 sends back to back, to find the throughput ceiling.
+#
+# --donors N adds N sessions that keep donating (perform_donation, then polling
+# show_donation_status every 2 s like the donation page) while fake_daraja
+# answers after --daraja-latency ms. --executor picks DASHBOARD_EXECUTOR.
+#
+# Reports p50/p95/p99 latency per callback, requests/s, errors and the RSS of
+# every gunicorn worker, and saves them to benchmarks/results/<commit>-load.json.
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+import fake_daraja
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port, workers, threads, env):
+    cmd = [sys.executable, "-m", "gunicorn", "denis:server", "--pythonpath", benchlib.REPO,
+           "-b", f"127.0.0.1:{port}", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+           "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {proc.returncode}")
+        try:
+            if requests.get(url + "/_dash-layout", timeout=2).ok:
+                return proc, url
+        except requests.RequestException:
+            time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit("gunicorn did not start within 120 s")
+
+
+class Session(threading.Thread):
+    """
+    One dashboard tab: page load, then one interval tick every `interval` seconds.
+    """
+
+    def __init__(self, url, county, interval, stop):
+        super().__init__(daemon=True)
+        self.url, self.county, self.interval, self.stop = url, county, interval, stop
+        self.tab = f"bench-{random.getrandbits(64):x}"
+        self.latency = {"dashboard": [], "top_counties": []}
+        self.errors = 0
+        self.bytes = 0
+
+    def post(self, http, name, body):
+        start = time.perf_counter()
+        try:
+            r = http.post(self.url + "/_dash-update-component", json=body, timeout=60)
+            r.raise_for_status()
+        except requests.RequestException:
+            self.errors += 1
+            return None
+        self.latency[name].append(time.perf_counter() - start)
+        self.bytes += len(r.content)
+        return r.json()
+
+    def run(self):
+        http = requests.Session()
+        try:
+            for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+                http.get(self.url + path, timeout=60)
+        except requests.RequestException:
+            self.errors += 1
+        sync, tick = None, 0
+        # tabs are not opened in lockstep
+        if self.stop.wait(random.uniform(0, self.interval)):
+            return
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            out = self.post(http, "dashboard", benchlib.dashboard_body(self.county, tick, sync, self.tab))
+            if out is not None:
+                sync = out["response"]["dashboard-sync"]["data"]
+            self.post(http, "top_counties", benchlib.top_counties_body("transactions", tick))
+            tick += 1
+            self.stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+
+class Donor(Session):
+    """
+    A donation page: submits a donation, polls its status every 2 s until it
+    leaves queued/sending, then starts over.
+    """
+
+    def __init__(self, url, interval, stop):
+        super().__init__(url, None, interval, stop)
+        self.latency = {"perform_donation": [], "donation_status": []}
+
+    def run(self):
+        http = requests.Session()
+        clicks = 0
+        while not self.stop.wait(random.uniform(0, self.interval)):
+            clicks += 1
+            job = self.post(http, "perform_donation", benchlib.donation_body(clicks))
+            if job is None:
+                continue
+            job = job["response"]["donation-job"]["data"]
+            for n in range(30):
+                if self.stop.wait(2.0):
+                    return
+                out = self.post(http, "donation_status", benchlib.donation_status_body(job, n + 1))
+                if out is None or out["response"]["donation-poll"]["disabled"]:
+                    break
+                if "Sending" not in json.dumps(out["response"]["donation-message"]["children"]):
+                    break
+
+
+def run(args):
+    """
+    Runs one load test; returns the results dict.
+    """
+    fake = fake_daraja.serve(latency_ms=args.daraja_latency)
+    env = dict(os.environ, MPESA_BASE_URL=fake.base_url, DASHBOARD_EXECUTOR=args.executor)
+    if args.shared_snapshots:
+        env["SNAPSHOT_CACHE_DIR"] = os.path.join(os.getcwd(), "snapshots")
+    proc, url = start_gunicorn(free_port(), args.workers, args.threads, env)
+    counties = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Thika", "Malindi", "Meru",
+                "Machakos", "Kakamega", "Nyeri", "Embu"][:max(1, args.counties)]
+    stop = threading.Event()
+    sessions = [Session(url, counties[i % len(counties)], args.interval, stop) for i in range(args.sessions)]
+    sessions += [Donor(url, args.interval, stop) for _ in range(args.donors)]
+    try:
+        for s in sessions:
+            s.start()
+        time.sleep(args.duration)
+        stop.set()
+        for s in sessions:
+            s.join(60)
+        workers = {pid: benchlib.rss_kb(pid) for pid in benchlib.child_pids(proc.pid)}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(60)  # gunicorn's graceful timeout is 30 s
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        fake.shutdown()
+
+    results = {"config": vars(args), "errors": sum(s.errors for s in sessions)}
+    total = 0
+    for name in ("dashboard", "top_counties", "perform_donation", "donation_status"):
+        samples = [x for s in sessions for x in s.latency.get(name, ())]
+        total += len(samples)
+        if samples:
+            results[name] = benchlib.percentiles(samples)
+    results["requests_per_s"] = total / args.duration
+    results["bytes_per_s"] = sum(s.bytes for s in sessions) / args.duration
+    results["worker_rss_kb"] = workers
+    return results
+
+
+def report(results):
+    for name in ("dashboard", "top_counties", "perform_donation", "donation_status"):
+        p = results.get(name)
+        if p:
+            print(f"{name:16s} n={p['n']:6d}  p50 {p['p50_ms']:8.1f} ms  p95 {p['p95_ms']:8.1f} ms  "
+                  f"p99 {p['p99_ms']:8.1f} ms")
+    print(f"{results['requests_per_s']:.1f} req/s, {results['bytes_per_s'] / 1e6:.2f} MB/s, "
+          f"{results['errors']} errors")
+    workers = results["worker_rss_kb"]
+    print("worker RSS: " + ", ".join(f"{pid}: {kb / 1024:.0f} MB" for pid, kb in workers.items() if kb))
+
+
+def parser():
+    p = argparse.ArgumentParser(description="Load test of the dashboard callbacks under gunicorn")
+    p.add_argument("--sessions", type=int, default=100)
+    p.add_argument("--duration", type=float, default=60, help="seconds of measured load")
+    p.add_argument("--interval", type=float, default=5.0, help="seconds between ticks per session")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--threads", type=int, default=8, help="gthread threads per worker")
+    p.add_argument("--counties", type=int, default=10, help="sessions are spread over this many counties")
+    p.add_argument("--shared-snapshots", action="store_true",
+                   help="share snapshots between workers (SNAPSHOT_CACHE_DIR)")
+    p.add_argument("--executor", default="inline", help="DASHBOARD_EXECUTOR: inline, thread or process")
+    p.add_argument("--donors", type=int, default=0, help="sessions donating at the same time")
+    p.add_argument("--daraja-latency", type=float, default=0, help="fake Daraja response time, in ms")
+    p.add_argument("--out", help="JSON file to write (default benchmarks/results/<commit>-load.json)")
+    return p
+
+
+def main():
+    args = parser().parse_args()
+    results = run(args)
+    report(results)
+    print(f"saved {benchlib.save_results('load', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench_payload.py - bytes sent and server CPU per dashboard tick, full figures vs delta patches
+#
+#   python benchmarks/bench_payload.py --ticks 60
+#
+# Feeds simulated live traffic into the dashboard, calls update_dashboard as a
+# 5-second interval would, and measures the JSON each tick sends with and without
+# delta updates. Server CPU is the process time of the full call, which builds
+# the tick's snapshot, and of the delta call, which reuses it. That the patches
+# rebuild the full figures is checked by tests/test_dashboard_delta.py.
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+os.environ.setdefault("MPESA_BASE_URL", "http://127.0.0.1:9")  # no network needed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import denis
+from dash import Patch
+from plotly.io.json import to_json_plotly
+
+
+def payload_bytes(outputs):
+    return len(to_json_plotly(list(outputs)).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=48)
+    parser.add_argument("--county", default="Nairobi")
+    parser.add_argument("--tpm", type=int, default=600, help="simulated transactions per minute")
+    args = parser.parse_args()
+
+    # one snapshot per data version: rebuilt on every simulated tick, shared by both calls
+    denis.snapshot_cache.min_age = 0
+    denis.SNAPSHOT_TICK_SECONDS = 10**9
+    ci = denis.COUNTY_INDEX[args.county]
+    rng = np.random.default_rng(0)
+    clock = 1_800_000_000 - 3600
+    per_tick = args.tpm // 12
+
+    def feed(seconds):
+        n = per_tick * seconds // 5
+        ts = clock + rng.integers(0, seconds, n)
+        denis.live.add_batch(np.sort(ts), np.full(n, ci), rng.integers(0, 3, n),
+                             rng.integers(0, 6, n), rng.integers(10, 2000, n))
+
+    feed(3600)  # an hour of history
+    clock += 3600
+    sync, full_total, delta_total, fulls = None, 0, 0, 0
+    full_cpu = delta_cpu = 0.0
+    for tick in range(args.ticks):
+        feed(5)
+        clock += 5
+        denis.DELTA_UPDATES = False
+        t = time.process_time()
+        full = denis.update_dashboard(args.county, tick, sync=sync)
+        full_cpu += time.process_time() - t
+        denis.DELTA_UPDATES = True
+        t = time.process_time()
+        delta = denis.update_dashboard(args.county, tick, sync=sync)
+        delta_cpu += time.process_time() - t
+        full_total += payload_bytes(full)
+        delta_total += payload_bytes(delta)
+        if not isinstance(delta[0], Patch):
+            fulls += 1
+        sync = delta[-1]
+
+    print(f"{args.ticks} ticks, {args.tpm} tpm simulated, {fulls} full redraw(s)")
+    print(f"full figures   {full_total / args.ticks:10,.0f} bytes/tick  "
+          f"{full_cpu / args.ticks * 1000:6.1f} ms CPU/tick (snapshot build included)")
+    print(f"delta patches  {delta_total / args.ticks:10,.0f} bytes/tick  "
+          f"{delta_cpu / args.ticks * 1000:6.1f} ms CPU/tick ({delta_total / full_total:.1%} of full bytes)")
+
+
+if __name__ == '__main__':
+    main()
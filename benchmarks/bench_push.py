@@ -0,0 +1,123 @@
+# bench_push.py - server cost of many open dashboards: interval polling vs push
+#
+#   python benchmarks/bench_push.py --tabs N --idle 10
+#
+# Polling: every tab sends the two interval callbacks (county dashboard and top
+# counties) to /_dash-update-component once per 5-second tick; one tick is
+# replayed through the Flask app and its CPU time and response bytes measured.
+#
+# Push: the same number of tabs subscribe to /stream (one thread each, as under
+# gunicorn gthread) and get the current dashboard on connect. Measures the CPU
+# used while they sit idle, then the cost and latency of one published update
+# reaching all of them.
+#
+# Exits with an error if idle push costs more than --max-ratio of polling's
+# CPU per tick, or if a subscriber gets no data on connect.
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+
+benchlib.use_scratch_dir()
+import fake_daraja
+
+fake = fake_daraja.serve()
+os.environ["MPESA_BASE_URL"] = fake.base_url
+import denis
+
+
+def poll_tick(client, tabs, tick):
+    """
+    One interval tick of every tab. Returns (cpu seconds, wall seconds, bytes).
+    """
+    cpu, wall, sent = time.process_time(), time.perf_counter(), 0
+    for tab in tabs:
+        r = client.post("/_dash-update-component", json=benchlib.dashboard_body(tab["county"], tick, tab["sync"]))
+        sent += len(r.data)
+        tab["sync"] = r.get_json()["response"]["dashboard-sync"]["data"]
+        body = benchlib.top_counties_body("transactions", tick)
+        sent += len(client.post("/_dash-update-component", json=body).data)
+    return time.process_time() - cpu, time.perf_counter() - wall, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interval polling vs push for many open dashboards")
+    parser.add_argument("--tabs", type=int, default=1000)
+    parser.add_argument("--idle", type=float, default=10.0, help="seconds to watch idle subscribers")
+    parser.add_argument("--max-ratio", type=float, default=0.01,
+                        help="fail if idle push CPU per 5 s exceeds this fraction of polling CPU per tick")
+    args = parser.parse_args()
+
+    counties = [denis.counties[i % 10] for i in range(args.tabs)]  # tabs spread over 10 counties
+    client = denis.server.test_client()
+
+    # polling: the first tick after page load draws everything, later ticks are deltas
+    tabs = [{"county": c, "sync": None} for c in counties]
+    poll_tick(client, tabs, 1)
+    time.sleep(denis.SNAPSHOT_TICK_SECONDS)
+    cpu, wall, sent = poll_tick(client, tabs, 2)
+    poll_cpu = cpu
+    print(f"polling  {args.tabs} tabs: {cpu:.2f} s CPU and {sent / 1e6:.1f} MB per 5 s tick "
+          f"({cpu / 5 * 100:.0f}% of a core), {wall / args.tabs * 1000:.1f} ms per tab")
+
+    # push: idle subscribers
+    received = []
+    connected = []  # subscribers whose first frame after the header carried data
+    lock = threading.Lock()
+    ready = threading.Barrier(args.tabs + 1)
+
+    def subscriber(county):
+        frames = denis.push_hub.subscribe((county, "transactions", 60))
+        next(frames)  # retry: header, sent on connect
+        if next(frames).startswith("id:"):  # the current dashboard, also sent on connect
+            with lock:
+                connected.append(county)
+        ready.wait()
+        for frame in frames:
+            if frame.startswith("id:"):
+                with lock:
+                    received.append(time.perf_counter())
+                break
+        frames.close()
+
+    threads = [threading.Thread(target=subscriber, args=(c,), daemon=True) for c in counties]
+    for t in threads:
+        t.start()
+    ready.wait()
+    cpu = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu
+    idle_per_tick = idle_cpu / args.idle * 5
+    print(f"push     {args.tabs} idle subscribers: {idle_cpu * 1000:.1f} ms CPU in {args.idle:.0f} s "
+          f"({idle_per_tick * 1000:.2f} ms per 5 s), {denis.push_hub.stats()['channels']} channels, "
+          f"{len(connected)} got data on connect")
+
+    cpu, start = time.process_time(), time.perf_counter()
+    denis.push_hub.publish_all()
+    for t in threads:
+        t.join(30)
+    publish_cpu = time.process_time() - cpu
+    # a channel whose dashboard did not change since connect publishes nothing
+    print(f"push     one update to {len(received)} tabs: {publish_cpu * 1000:.0f} ms CPU"
+          + (f", last tab {(max(received) - start) * 1000:.0f} ms after publish" if received else ""))
+    print(json.dumps(denis.push_hub.stats()))
+
+    failures = []
+    if idle_per_tick > args.max_ratio * poll_cpu:
+        failures.append(f"idle push uses {idle_per_tick * 1000:.2f} ms CPU per 5 s, more than "
+                        f"{args.max_ratio:.0%} of polling's {poll_cpu * 1000:.0f} ms per tick")
+    if len(connected) != args.tabs:
+        failures.append(f"{args.tabs - len(connected)} subscribers got no data on connect")
+    if failures:
+        raise SystemExit("FAIL: " + "; ".join(failures))
+    print("OK: idle push CPU is below "
+          f"{args.max_ratio:.0%} of polling CPU and every subscriber got data on connect")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench_restart.py - boot time and first dashboard after a restart, cold vs warm
+#
+#   python benchmarks/bench_restart.py --workers 2
+#
+# Feeds an hour of transactions for every county into the app in this
+# process and saves its state (the previous run), then starts gunicorn on the
+# same directory twice:
+#
+#   cold  plain `gunicorn denis:server`, no saved state (the old behaviour)
+#   warm  `gunicorn -c gunicorn.conf.py`: preload, restore, warm-up render
+#
+# and reports the seconds until the server answers, the latency of the first
+# dashboard request, and whether that first dashboard shows the previous run's
+# numbers or simulated ones. Saves benchmarks/results/<commit>-restart.json.
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+import bench_load
+
+benchlib.use_scratch_dir()
+import fake_daraja
+from columnar import TransactionBatch
+
+COUNTY = "Kisumu"
+
+
+def previous_run(denis, rate):
+    """
+    An hour of `rate` transactions per minute per county, ending now; returns
+    the total transactions the first dashboard of `COUNTY` should show.
+    """
+    rng = np.random.default_rng(0)
+    n = rate * 60 * len(denis.counties)
+    now = int(time.time())
+    batch = TransactionBatch(np.sort(rng.integers(now - 3600, now, n)), rng.integers(0, len(denis.counties), n),
+                             rng.integers(0, 3, n), rng.integers(0, 6, n), rng.integers(10, 5000, n))
+    denis.ingest_batch(batch)
+    denis.state_file.save()
+    denis.rollups.close()
+    _, counts, _ = denis.live.window(denis.COUNTY_INDEX[COUNTY])
+    return int(counts.sum())
+
+
+def boot(mode, port, workers, env):
+    cmd = [sys.executable, "-m", "gunicorn", "denis:server", "--pythonpath", benchlib.REPO,
+           "-b", f"127.0.0.1:{port}", "-w", str(workers), "--log-level", "warning"]
+    if mode == "warm":
+        cmd += ["-c", os.path.join(benchlib.REPO, "gunicorn.conf.py")]
+    else:
+        cmd += ["-k", "gthread", "--threads", "8"]
+        env = dict(env, DASHBOARD_STATE_FILE="", ROLLUP_DIR="rollups-cold")
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f"gunicorn exited with {proc.returncode}")
+            try:
+                if requests.get(url + "/_dash-layout", timeout=2).ok:
+                    break
+            except requests.RequestException:
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+        t = time.perf_counter()
+        r = requests.post(url + "/_dash-update-component", json=benchlib.dashboard_body(COUNTY, 0), timeout=60)
+        first = time.perf_counter() - t
+        card = r.json()["response"]["kpi-data"]["data"]["total_txn"]
+        rss = sum(benchlib.rss_kb(pid) or 0 for pid in benchlib.child_pids(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(60)
+    return {"ready_s": ready, "first_dashboard_ms": first * 1000, "card": card, "workers_rss_kb": rss}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold vs warm restart of the dashboard under gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rate", type=int, default=100, help="transactions per minute per county")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    fake = fake_daraja.serve()
+    os.environ["MPESA_BASE_URL"] = fake.base_url
+    import denis
+    expected = previous_run(denis, args.rate)
+    print(f"state file {os.path.getsize(denis.STATE_FILE) / 1024:.0f} kB, saved in "
+          f"{denis.state_file.last_save_ms:.0f} ms; expected total: {expected:,}")
+
+    results = {}
+    try:
+        for mode in ("cold", "warm"):
+            r = results[mode] = boot(mode, bench_load.free_port(), args.workers, dict(os.environ))
+            r["live_data"] = r["card"] == expected
+            print(f"{mode}  ready after {r['ready_s']:5.2f} s, first dashboard {r['first_dashboard_ms']:6.0f} ms, "
+                  f"{'previous data' if r['live_data'] else 'simulated/empty data'} ({r['card']}), "
+                  f"workers RSS {r['workers_rss_kb'] / 1024:.0f} MB")
+    finally:
+        fake.shutdown()
+    print(f"saved {benchlib.save_results('restart', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# bench_rollups.py - range reads from the minute/hour/day rollups vs rescanning minutes
+#
+#   python benchmarks/bench_rollups.py --days 90
+#
+# Fills a scratch RollupStore with --days days of closed minutes, then times one
+# county's chart series for each dashboard range: read from the resolution the
+# dashboard uses, and from the minute files alone (what a single-resolution
+# store would rescan). Minute files are kept for the whole run here so the
+# comparison has something to scan.
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rollups import RollupStore
+
+N_COUNTIES, N_PAYMENTS, N_SECTORS = 47, 3, 6
+RANGES = [("1h", 60, 60), ("24h", 1440, 900), ("7d", 10080, 10800), ("90d", 129600, 86400)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--reps", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="rollups-")
+    try:
+        store = RollupStore(directory, N_COUNTIES, N_PAYMENTS, N_SECTORS, retention={"minute": None})
+        rng = np.random.default_rng(0)
+        block = rng.poisson(3, (1440, N_COUNTIES, N_PAYMENTS, N_SECTORS))
+        first = (int(time.time()) // 86400 - args.days) * 1440
+        start = time.perf_counter()
+        for m in range(first, first + args.days * 1440):
+            c = block[m % 1440]
+            store.add_minute(m, c, c * 150)
+        elapsed = time.perf_counter() - start
+        print(f"append {args.days * 1440:,} minutes       {args.days * 1440 / elapsed:12,.0f} minutes/s")
+        for name, s in store.stats().items():
+            if isinstance(s, dict):
+                print(f"  {name:6s} {s['segments']:4d} segments {s['bytes'] / 1e6:10.1f} MB")
+
+        end = (first + args.days * 1440) * 60
+        for label, window, step in RANGES:
+            if window > args.days * 1440:
+                continue
+            lo = end - window * 60
+            t = time.perf_counter()
+            for i in range(args.reps):
+                _, counts, _ = store.series(lo, end, step, county=i % N_COUNTIES)
+            rollup_ms = (time.perf_counter() - t) / args.reps * 1e3
+            t = time.perf_counter()
+            for i in range(args.reps):
+                _, minutes, _ = store.series(lo, end, 60, county=i % N_COUNTIES)
+                minutes.reshape((-1, step // 60, N_PAYMENTS, N_SECTORS)).sum(axis=1)
+            scan_ms = (time.perf_counter() - t) / args.reps * 1e3
+            res = store.resolution_for(step).name
+            print(f"{label:4s} {len(counts):4d} points from {res:6s} {rollup_ms:9.2f} ms   "
+                  f"minute rescan {scan_ms:9.2f} ms  ({scan_ms / rollup_ms:6.1f}x)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# bench_startup.py - import time of denis and time to the first responses under gunicorn
+#
+#   python benchmarks/bench_startup.py --runs 5
+#   python benchmarks/bench_startup.py --repo /tmp/old-checkout   # e.g. a git worktree
+#
+# import   `import denis` in a fresh interpreter, median of --runs, and which of
+#          pandas / plotly.express it loaded
+# plain    `gunicorn denis:server`, 1 worker: seconds until /_dash-layout
+#          answers, then the first page navigation (registration page) and the
+#          first dashboard
+# preload  the same with `-c gunicorn.conf.py` (import and warm-up in the master)
+#
+# Saves benchmarks/results/<commit>-startup.json.
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchlib
+import bench_load
+
+benchlib.use_scratch_dir()
+import fake_daraja
+
+IMPORT_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import denis
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "loaded": [m for m in ("pandas", "plotly.express") if m in sys.modules]}))
+"""
+
+
+def import_time(repo, runs, env):
+    samples, loaded = [], None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, repo], env=env,
+                             capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(r["seconds"])
+        loaded = r["loaded"]
+    return {"median_s": statistics.median(samples), "min_s": min(samples), "loaded": loaded}
+
+
+def first_responses(repo, mode, env):
+    port = bench_load.free_port()
+    cmd = [sys.executable, "-m", "gunicorn", "denis:server", "--pythonpath", repo,
+           "-b", f"127.0.0.1:{port}", "-w", "1", "--log-level", "warning"]
+    conf = os.path.join(repo, "gunicorn.conf.py")
+    if mode == "preload":
+        if not os.path.exists(conf):
+            return None
+        cmd += ["-c", conf]
+    else:
+        cmd += ["-k", "gthread", "--threads", "8"]
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit(f"gunicorn exited with {proc.returncode}")
+            try:
+                if requests.get(url + "/_dash-layout", timeout=2).ok:
+                    break
+            except requests.RequestException:
+                time.sleep(0.05)
+        result = {"ready_s": time.perf_counter() - start}
+        page = benchlib.callback_body([("page-content", "children")], [("url", "pathname", "/register")],
+                                      [("registered-user", "data", {"email": None, "name": None})],
+                                      changed="url.pathname")
+        for name, body in (("first_page_ms", page), ("first_dashboard_ms", benchlib.dashboard_body("Kisumu", 0))):
+            t = time.perf_counter()
+            requests.post(url + "/_dash-update-component", json=body, timeout=60).raise_for_status()
+            result[name] = (time.perf_counter() - t) * 1000
+    finally:
+        proc.terminate()
+        proc.wait(60)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and first responses of the dashboard")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--repo", default=benchlib.REPO, help="checkout to measure")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    repo = os.path.abspath(args.repo)
+
+    fake = fake_daraja.serve()
+    env = dict(os.environ, MPESA_BASE_URL=fake.base_url)
+    try:
+        results = {"repo": repo, "import": import_time(repo, args.runs, env)}
+        r = results["import"]
+        print(f"import denis     {r['median_s'] * 1000:7.0f} ms median ({r['min_s'] * 1000:.0f} ms min), "
+              f"loads {', '.join(r['loaded']) or 'neither pandas nor plotly.express'}")
+        for mode in ("plain", "preload"):
+            r = results[mode] = first_responses(repo, mode, env)
+            if r is None:
+                print(f"{mode:8s}         no gunicorn.conf.py in {repo}")
+                continue
+            print(f"{mode:8s}         ready after {r['ready_s']:5.2f} s, first page {r['first_page_ms']:6.0f} ms, "
+                  f"first dashboard {r['first_dashboard_ms']:6.0f} ms")
+    finally:
+        fake.shutdown()
+    print(f"saved {benchlib.save_results('startup', results, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
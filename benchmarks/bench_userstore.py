@@ -0,0 +1,87 @@
+# bench_userstore.py - registration and lookup cost, users.json vs UserStore
+#
+#   python benchmarks/bench_userstore.py --sizes 100000 1000000
+#   python benchmarks/bench_userstore.py --sizes 100000 --legacy   # also time the old JSON path
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from userstore import UserStore
+
+
+def fake_users(n, prefix="user"):
+    for i in range(n):
+        yield {"full_name": f"User {i}", "email": f"{prefix}{i}@example.com",
+               "password_hash": "0" * 64, "subscription": "5/month",
+               "registered_at": "2026-01-01T00:00:00Z"}
+
+
+def per_op(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def bench_store(n, tmp, lookups, registrations):
+    path = os.path.join(tmp, f"users_{n}.db")
+    store = UserStore(path)
+    start = time.perf_counter()
+    store.bulk_import(fake_users(n))
+    import_s = time.perf_counter() - start
+    emails = [f"USER{random.randrange(n)}@example.com" for _ in range(lookups)]
+    lookup_us = per_op(store.email_exists, emails)
+    new_users = list(fake_users(registrations, prefix="new"))
+    register_us = per_op(lambda u: (store.email_exists(u["email"]), store.add(u)), new_users)
+    size_mb = os.path.getsize(path) / 1e6
+    print(f"sqlite  n={n:>9,}  import {import_s:7.2f} s  lookup {lookup_us:9.1f} us  "
+          f"register {register_us:9.1f} us  file {size_mb:7.1f} MB")
+
+
+def bench_legacy(n, tmp, lookups, registrations):
+    # the old load_users/save_users/email_exists/add_user behaviour
+    path = os.path.join(tmp, f"users_{n}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(list(fake_users(n)), f, indent=2)
+
+    def load():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def exists(email):
+        return any(u.get("email", "").lower() == email.lower() for u in load())
+
+    def add(user):
+        users = load()
+        users.append(user)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(users, f, indent=2, ensure_ascii=False)
+
+    emails = [f"USER{random.randrange(n)}@example.com" for _ in range(lookups)]
+    lookup_us = per_op(exists, emails)
+    new_users = list(fake_users(registrations, prefix="new"))
+    register_us = per_op(lambda u: (exists(u["email"]), add(u)), new_users)
+    print(f"json    n={n:>9,}  {'':18}  lookup {lookup_us:9.1f} us  register {register_us:9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--registrations", type=int, default=1_000)
+    parser.add_argument("--legacy", action="store_true", help="also time users.json (slow)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            bench_store(n, tmp, args.lookups, args.registrations)
+            if args.legacy:
+                bench_legacy(n, tmp, max(1, args.lookups // 1000), max(1, args.registrations // 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# benchlib.py - helpers shared by the benchmark scripts
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO, "benchmarks", "results")
+
+DASHBOARD_OUTPUTS = [("tpm-chart", "figure"), ("payment-chart", "figure"), ("sector-chart", "figure"),
+                     ("top-sectors-chart", "figure"), ("peak-hour-heatmap", "figure"),
+                     ("kpi-data", "data"), ("alert-log", "children"), ("dashboard-sync", "data")]
+
+
+def callback_body(outputs, inputs, state=(), changed=None):
+    """
+    The /_dash-update-component request dash-renderer sends for one callback.
+    outputs are (id, property); inputs and state are (id, property, value).
+    """
+    if len(outputs) == 1:
+        output = "%s.%s" % outputs[0]
+    else:
+        output = ".." + "...".join("%s.%s" % o for o in outputs) + ".."
+    return {
+        "output": output,
+        "outputs": [{"id": i, "property": p} for i, p in outputs] if len(outputs) > 1
+                   else {"id": outputs[0][0], "property": outputs[0][1]},
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "state": [{"id": i, "property": p, "value": v} for i, p, v in state],
+        "changedPropIds": [changed] if changed else [],
+    }
+
+
+def dashboard_body(county, tick, sync=None, tab=None, window=60):
+    return callback_body(DASHBOARD_OUTPUTS,
+                         [("region-dropdown", "value", county), ("interval-update", "n_intervals", tick),
+                          ("time-range", "value", window)],
+                         [("dashboard-sync", "data", sync), ("tab-id", "data", tab)],
+                         changed="interval-update.n_intervals" if tick else "region-dropdown.value")
+
+
+def top_counties_body(metric, tick):
+    return callback_body([("top-counties-chart", "figure")],
+                         [("rank-metric", "value", metric), ("interval-update", "n_intervals", tick)],
+                         changed="interval-update.n_intervals" if tick else "rank-metric.value")
+
+
+def donation_body(clicks, phone="254708374149", amount=10):
+    return callback_body([("donation-job", "data")], [("donate-btn", "n_clicks", clicks)],
+                         [("donate-phone", "value", phone), ("donate-amount", "value", amount)],
+                         changed="donate-btn.n_clicks")
+
+
+def donation_status_body(job, polls):
+    return callback_body([("donation-message", "children"), ("donation-poll", "disabled")],
+                         [("donation-job", "data", job), ("donation-poll", "n_intervals", polls)],
+                         changed="donation-poll.n_intervals")
+
+
+def percentiles(samples):
+    """
+    Summary of latencies in seconds, reported in milliseconds.
+    """
+    a = np.asarray(samples, dtype=float) * 1000
+    if len(a) == 0:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {"n": int(len(a)), "mean_ms": float(a.mean()), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(a.max())}
+
+
+def time_calls(fn, repeat=20, warmup=2):
+    """
+    Calls fn() warmup + repeat times; returns percentiles of the timed calls.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                             capture_output=True, text=True, timeout=10)
+        commit = out.stdout.strip() or "unknown"
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO,
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def save_results(name, results, path=None):
+    """
+    Writes results to benchmarks/results/<commit>-<name>.json (or `path`),
+    with the commit, time and host they were measured on. Returns the path.
+    """
+    commit = git_commit()
+    doc = {"benchmark": name, "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+           "python": platform.python_version(), "host": platform.node(),
+           "cpus": os.cpu_count(), "results": results}
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{commit}-{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+    return path
+
+
+def rss_kb(pid):
+    """
+    Resident set size of a process in kB (Linux), or None.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    """
+    Direct children of a process (Linux /proc), e.g. the workers of a gunicorn master.
+    """
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name may contain spaces; fields after it are space-separated
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def use_scratch_dir(prefix="dentech-bench-"):
+    """
+    Moves to a temporary directory so the databases and token cache the app
+    creates at import do not land in the repository. Returns the directory.
+    """
+    path = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(path)
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    return path
@@ -0,0 +1,57 @@
+# compare.py - compare two saved benchmark results
+#
+#   python benchmarks/compare.py results/abc123-callbacks.json results/def456-callbacks.json
+#
+# Prints every latency and throughput figure found in both files with the
+# relative change, and exits 1 if any got worse by more than --threshold percent.
+import sys
+import json
+import argparse
+
+# higher is better for these; every *_ms value is a latency (lower is better)
+HIGHER_IS_BETTER = ("requests_per_s",)
+
+
+def metrics(doc, prefix=""):
+    """
+    Flattens nested results into {"dashboard.p95_ms": value, ...}.
+    """
+    out = {}
+    for key, value in doc.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(metrics(value, name + "."))
+        elif isinstance(value, (int, float)) and (key.endswith("_ms") or key in HIGHER_IS_BETTER):
+            out[name] = float(value)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{base.get('commit')} -> {new.get('commit')} ({base.get('benchmark')})")
+
+    a, b = metrics(base["results"]), metrics(new["results"])
+    regressions = 0
+    for name in sorted(a.keys() & b.keys()):
+        if a[name] == 0:
+            continue
+        change = (b[name] - a[name]) / a[name] * 100
+        worse = -change if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:50s} {a[name]:12.3f} {b[name]:12.3f} {change:+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# columnar.py - compact column-oriented batches of transactions
+import numpy as np
+
+# Per-transaction footprint: 8 (ts) + 1 + 1 + 1 (codes) + 4 (amount) = 15 bytes
+TS_DTYPE = np.int64      # epoch seconds
+CODE_DTYPE = np.uint8    # index into counties / payment_types / sectors
+AMOUNT_DTYPE = np.int32  # whole KES
+
+
+class TransactionBatch:
+    """
+    Transactions as parallel numpy arrays: epoch-second timestamps, small-int
+    codes for county, payment type and sector, and integer amounts.
+
+    Slicing (by position, or by time range on a time-sorted batch) returns a
+    batch of views into the same arrays, so it copies nothing.
+    `rejected` counts records dropped by `from_records`.
+    """
+
+    __slots__ = ("ts", "county", "payment", "sector", "amount", "rejected")
+
+    def __init__(self, ts, county, payment, sector, amount, rejected=0):
+        self.ts = np.asarray(ts, dtype=TS_DTYPE)
+        self.county = np.asarray(county, dtype=CODE_DTYPE)
+        self.payment = np.asarray(payment, dtype=CODE_DTYPE)
+        self.sector = np.asarray(sector, dtype=CODE_DTYPE)
+        self.amount = np.asarray(amount, dtype=AMOUNT_DTYPE)
+        self.rejected = rejected
+        n = len(self.ts)
+        if not all(len(a) == n for a in (self.county, self.payment, self.sector, self.amount)):
+            raise ValueError("TransactionBatch columns must have the same length")
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+    @classmethod
+    def from_records(cls, records, county_index, payment_index, sector_index, default_county=None):
+        """
+        Builds a batch from transaction dicts (timestamp, county, payment_type,
+        sector, amount). Records with a missing or unknown field are skipped.
+        """
+        ts, county, payment, sector, amount = [], [], [], [], []
+        rejected = 0
+        for r in records:
+            c = county_index.get(r.get('county', default_county))
+            p = payment_index.get(r.get('payment_type'))
+            k = sector_index.get(r.get('sector'))
+            t = r.get('timestamp')
+            if c is None or p is None or k is None or t is None:
+                rejected += 1
+                continue
+            try:
+                t = to_epoch(t)
+                a = int(r.get('amount') or 0)
+            except (TypeError, ValueError):
+                rejected += 1
+                continue
+            ts.append(t)
+            county.append(c)
+            payment.append(p)
+            sector.append(k)
+            amount.append(a)
+        return cls(ts, county, payment, sector, amount, rejected=rejected)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(b, f) for b in batches])
+                     for f in ("ts", "county", "payment", "sector", "amount")),
+                   rejected=sum(b.rejected for b in batches))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("TransactionBatch only supports slicing")
+        return TransactionBatch(self.ts[key], self.county[key], self.payment[key],
+                                self.sector[key], self.amount[key])
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ts, self.county, self.payment, self.sector, self.amount))
+
+    def is_sorted(self):
+        return len(self.ts) < 2 or bool((self.ts[1:] >= self.ts[:-1]).all())
+
+    def sorted(self):
+        """
+        Returns the batch in time order (a copy; self if already sorted).
+        """
+        if self.is_sorted():
+            return self
+        order = np.argsort(self.ts, kind='stable')
+        return TransactionBatch(self.ts[order], self.county[order], self.payment[order],
+                                self.sector[order], self.amount[order], rejected=self.rejected)
+
+    def between(self, start, end):
+        """
+        Transactions with start <= ts < end (epoch seconds), as views.
+        The batch must be time-sorted.
+        """
+        i, j = np.searchsorted(self.ts, [start, end], side='left')
+        return self[int(i):int(j)]
+
+    def to_pandas(self, counties, payment_types, sectors):
+        """
+        DataFrame with a datetime64 'timestamp' column (a view of `ts`) and
+        categorical county, payment_type and sector columns built from the codes.
+        """
+        import pandas as pd
+        return pd.DataFrame({
+            'timestamp': self.ts.view('datetime64[s]'),
+            'county': pd.Categorical.from_codes(self.county, categories=counties),
+            'payment_type': pd.Categorical.from_codes(self.payment, categories=payment_types),
+            'sector': pd.Categorical.from_codes(self.sector, categories=sectors),
+            'amount': self.amount,
+        }, copy=False)
+
+
+def to_epoch(ts):
+    """
+    Epoch seconds from a number, string or datetime. Naive timestamps are read as UTC.
+    """
+    if isinstance(ts, (int, float, np.integer, np.floating)):
+        return int(ts)
+    import pandas as pd
+    return pd.Timestamp(ts).value // 10**9
+
+
+# ----------------------------
+# Batch files (.txb): a header, then per batch its length as int64 and each
+# column's raw bytes in COLUMNS order. Written and read without any per-row work,
+# for replaying recorded or generated traffic.
+# ----------------------------
+BATCH_FILE_MAGIC = b"TXB1"
+COLUMNS = (("ts", TS_DTYPE), ("county", CODE_DTYPE), ("payment", CODE_DTYPE),
+           ("sector", CODE_DTYPE), ("amount", AMOUNT_DTYPE))
+
+
+def write_batches(path, batches):
+    """
+    Writes TransactionBatches to `path`, keeping batch boundaries. Returns the
+    number of transactions written.
+    """
+    total = 0
+    with open(path, "wb") as f:
+        f.write(BATCH_FILE_MAGIC)
+        for b in batches:
+            np.array([len(b)], dtype=np.int64).tofile(f)
+            for name, dtype in COLUMNS:
+                np.ascontiguousarray(getattr(b, name), dtype=dtype).tofile(f)
+            total += len(b)
+    return total
+
+
+def read_batches(path):
+    """
+    Yields the TransactionBatches written by write_batches, one at a time.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(BATCH_FILE_MAGIC)) != BATCH_FILE_MAGIC:
+            raise ValueError(f"{path} is not a transaction batch file")
+        while True:
+            header = np.fromfile(f, dtype=np.int64, count=1)
+            if len(header) == 0:
+                return
+            n = int(header[0])
+            columns = [np.fromfile(f, dtype=dtype, count=n) for _, dtype in COLUMNS]
+            if any(len(c) != n for c in columns):
+                raise ValueError(f"{path} ends inside a batch")
+            yield TransactionBatch(*columns)
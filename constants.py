@@ -0,0 +1,11 @@
+# constants.py - counties, payment types and sectors, importable without starting the app
+counties = [
+    "Nairobi","Mombasa","Kisumu","Nakuru","Eldoret","Thika","Malindi","Meru","Machakos","Kakamega",
+    "Nyeri","Murang'a","Embu","Kericho","Bomet","Narok","Baringo","Laikipia","Bungoma",
+    "Busia","Siaya","Homa Bay","Migori","Kisii","Nyamira","Garissa","Wajir","Mandera","Marsabit",
+    "Isiolo","Kitui","Makueni","Taita Taveta","Kilifi","Kwale","Tana River","Samburu","Turkana",
+    "West Pokot","Elgeyo Marakwet","Trans Nzoia","Nandi","Vihiga","Tharaka Nithi","Lamu","Kajiado","Kiambu"
+]
+
+payment_types = ['Mpesa','Airtel Money','Bank Transfer']
+sectors = ['Transport','Communication','Retail','Banking','Government','Utilities']
@@ -0,0 +1,266 @@
+# cube.py - incrementally maintained transaction statistics by county, payment type, sector and time
+import threading
+
+import numpy as np
+
+# Amount histogram for percentiles: bin 0 holds amounts below 1 KES, then
+# BINS_PER_DECADE log-spaced bins per decade up to 10**DECADES, then one overflow
+# bin. Percentiles are interpolated inside a bin, so they are accurate to a
+# fraction of a bin width (a bin spans +47% at 6 per decade).
+BINS_PER_DECADE = 6
+DECADES = 6
+N_BINS = BINS_PER_DECADE * DECADES + 2
+BIN_EDGES = np.concatenate([[0.0], 10 ** (np.arange(BINS_PER_DECADE * DECADES + 1) / BINS_PER_DECADE)])
+
+# Levels: (name, bucket seconds, buckets kept). Day buckets start at midnight
+# East Africa Time, so "today" is the Kenyan day.
+LEVELS = (("minute", 60, 60), ("hour", 3600, 48), ("day", 86400, 35))
+DAY_OFFSET = 3 * 3600
+
+
+class _Level:
+    __slots__ = ("name", "seconds", "slots", "offset", "ids", "count", "total", "low", "high", "hist")
+
+    def __init__(self, name, seconds, slots, cells, offset):
+        self.name, self.seconds, self.slots, self.offset = name, seconds, slots, offset
+        self.ids = np.full(slots, -1, dtype=np.int64)  # bucket number held by each slot
+        self.count = np.zeros((slots, cells), dtype=np.int64)
+        self.total = np.zeros((slots, cells), dtype=np.int64)
+        self.low = np.full((slots, cells), np.iinfo(np.int64).max, dtype=np.int64)
+        self.high = np.full((slots, cells), -1, dtype=np.int64)
+        self.hist = np.zeros((slots, cells, N_BINS), dtype=np.uint32)
+
+    def bucket(self, ts):
+        return (ts + self.offset) // self.seconds
+
+    def start(self, bucket):
+        return bucket * self.seconds - self.offset
+
+    def slot(self, bucket):
+        # caller holds the cube's lock; reuses the slot of a bucket that fell out of the ring
+        s = bucket % self.slots
+        if self.ids[s] != bucket:
+            self.ids[s] = bucket
+            self.count[s] = 0
+            self.total[s] = 0
+            self.low[s] = np.iinfo(np.int64).max
+            self.high[s] = -1
+            self.hist[s] = 0
+        return s
+
+
+class StatsCube:
+    """
+    Count, sum, min, max and an amount histogram for every county x payment
+    type x sector cell, per minute (last hour), hour (last two days) and EAT
+    day (last five weeks).
+
+    add_batch() folds a TransactionBatch in: one vectorized pass over the
+    rows per batch, then each touched minute is added to its minute, hour and
+    day bucket. Buckets older than their ring are reused, and rows too old
+    for every ring are counted in `late`.
+
+    query(start, end) covers the range with the fewest buckets: days in the
+    middle, hours and minutes at the edges, and the bucket still filling up
+    whole when the range reaches the newest data (an edge too old for the
+    finer levels is moved out to the bucket that holds it). So a question
+    reads at most 59 + 23 + 35 + 23 + 59 bucket rows however many
+    transactions they summarize, and a percentile is a search over N_BINS
+    cumulative counts.
+    """
+
+    def __init__(self, n_counties, n_payments, n_sectors, levels=LEVELS):
+        self.shape = (n_counties, n_payments, n_sectors)
+        self.cells = n_counties * n_payments * n_sectors
+        self.levels = [_Level(name, seconds, slots, self.cells, DAY_OFFSET if seconds == 86400 else 0)
+                       for name, seconds, slots in levels]
+        self.added = 0
+        self.late = 0
+        self.newest_ts = -1
+        self.lock = threading.Lock()
+
+    # ----------------------------
+    # Writing
+    # ----------------------------
+    def add_batch(self, batch):
+        n = len(batch)
+        if n == 0:
+            return 0
+        P, S = self.shape[1:]
+        cell = (batch.county.astype(np.int64) * P + batch.payment) * S + batch.sector
+        amount = batch.amount.astype(np.int64)
+        with np.errstate(divide="ignore"):
+            bins = np.floor(np.log10(np.maximum(amount, 0)) * BINS_PER_DECADE).astype(np.int64) + 1
+        bins = np.clip(np.where(amount < 1, 0, bins), 0, N_BINS - 1)
+
+        minutes, inverse = np.unique(batch.ts // 60, return_inverse=True)
+        m = len(minutes)
+        key = inverse * self.cells + cell
+        size = m * self.cells
+        count = np.bincount(key, minlength=size).reshape(m, self.cells)
+        total = np.bincount(key, weights=amount, minlength=size).astype(np.int64).reshape(m, self.cells)
+        hist = np.bincount(key * N_BINS + bins, minlength=size * N_BINS).reshape(m, self.cells, N_BINS)
+        low = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+        high = np.full(size, -1, dtype=np.int64)
+        np.minimum.at(low, key, amount)
+        np.maximum.at(high, key, amount)
+        low, high = low.reshape(m, self.cells), high.reshape(m, self.cells)
+
+        with self.lock:
+            self.newest_ts = max(self.newest_ts, int(batch.ts.max()))
+            for i, minute in enumerate(minutes.tolist()):
+                ts = minute * 60
+                kept = False
+                for level in self.levels:
+                    bucket = level.bucket(ts)
+                    newest = level.ids.max()
+                    if newest >= 0 and bucket <= newest - level.slots:
+                        continue  # older than this ring
+                    s = level.slot(bucket)
+                    level.count[s] += count[i]
+                    level.total[s] += total[i]
+                    np.minimum(level.low[s], low[i], out=level.low[s])
+                    np.maximum(level.high[s], high[i], out=level.high[s])
+                    level.hist[s] += hist[i].astype(np.uint32)
+                    kept = True
+                if not kept:
+                    self.late += int(count[i].sum())
+            self.added += n
+        return n
+
+    # ----------------------------
+    # Reading
+    # ----------------------------
+    def cover(self, start, end):
+        """
+        Buckets that together cover [start, end) (epoch seconds, end exclusive),
+        as {level: [bucket, ...]}, and the (start, end) actually covered.
+        """
+        start = start // 60 * 60
+        end = -(-end // 60) * 60
+        # move a start the finer levels no longer hold back to a bucket that holds it
+        for fine, coarse in zip(self.levels, self.levels[1:]):
+            if not _holds(fine, start):
+                start = coarse.start(coarse.bucket(start))
+        last = self.levels[-1]
+        if last.ids.max() >= 0:
+            start = max(start, last.start(last.ids.max() - last.slots + 1))
+        # nothing was added after `newest_ts`, so a bucket still filling up counts as whole
+        open_end = end > self.newest_ts
+        parts = {level: [] for level in self.levels}
+        t = start
+        while t < end:
+            for i in range(len(self.levels) - 1, -1, -1):
+                level = self.levels[i]
+                b = level.bucket(t)
+                if level.start(b) != t:
+                    continue
+                # an end older than the finer ring is moved out to this bucket's end
+                if level.start(b + 1) <= end or open_end or (i and not _holds(self.levels[i - 1], t)):
+                    parts[level].append(b)
+                    t = level.start(b + 1)
+                    break
+            else:
+                raise ValueError("range start is not minute-aligned")
+        return parts, (start, end if open_end else t)
+
+    def query(self, start, end, county=None, payment=None, sector=None, percentiles=(50, 90, 99)):
+        """
+        Statistics of the transactions with start <= ts < end for a county
+        (index, or None for all), optionally one payment type and/or sector:
+        count, sum, min, max, mean and the requested amount percentiles, plus
+        the 'start' and 'end' actually covered (minute-aligned, see cover()).
+        """
+        index = [slice(None)] * 3
+        for axis, value in enumerate((county, payment, sector)):
+            if value is not None:
+                index[axis] = value
+        count = total = 0
+        low, high = np.iinfo(np.int64).max, -1
+        hist = np.zeros(N_BINS, dtype=np.int64)
+        with self.lock:
+            parts, (start, end) = self.cover(start, end)
+            for level, buckets in parts.items():
+                if not buckets:
+                    continue
+                buckets = np.asarray(buckets, dtype=np.int64)
+                slots = buckets % level.slots
+                slots = slots[level.ids[slots] == buckets]  # buckets that saw no data are skipped
+                if len(slots) == 0:
+                    continue
+                shape = (len(slots),) + self.shape
+                sel = (slice(None), *index)
+                c = level.count[slots].reshape(shape)[sel]
+                count += int(c.sum())
+                total += int(level.total[slots].reshape(shape)[sel].sum())
+                if c.any():
+                    low = min(low, int(level.low[slots].reshape(shape)[sel].min()))
+                    high = max(high, int(level.high[slots].reshape(shape)[sel].max()))
+                h = level.hist[slots].reshape(shape + (N_BINS,))[sel]
+                hist += h.reshape(-1, N_BINS).sum(axis=0, dtype=np.int64)
+        result = {"start": start, "end": end, "count": count, "sum": total,
+                  "min": low if count else None, "max": high if count else None,
+                  "mean": total / count if count else None}
+        for p in percentiles:
+            result[f"p{p}"] = _percentile(hist, p, low, high) if count else None
+        return result
+
+    def stats(self):
+        return {"added": self.added, "late": self.late,
+                "bytes": sum(a.nbytes for level in self.levels
+                             for a in (level.count, level.total, level.low, level.high, level.hist)),
+                "levels": {level.name: int((level.ids >= 0).sum()) for level in self.levels}}
+
+    # ----------------------------
+    # Saved state (warmstate.StateFile part)
+    # ----------------------------
+    def dump(self):
+        with self.lock:
+            state = {}
+            for level in self.levels:
+                for key in _Level.__slots__[4:]:
+                    state[f"{level.name}.{key}"] = getattr(level, key).copy()
+            # without newest_ts, cover() would take every range as open-ended
+            for key in ("newest_ts", "added", "late"):
+                state[key] = np.array(getattr(self, key), dtype=np.int64)
+            return state
+
+    def load(self, state):
+        with self.lock:
+            for level in self.levels:
+                for key in _Level.__slots__[4:]:
+                    value = state[f"{level.name}.{key}"]
+                    current = getattr(level, key)
+                    if value.shape != current.shape:
+                        raise ValueError(f"saved cube {level.name}.{key} has shape {value.shape}")
+                    current[...] = value
+            if "newest_ts" in state:
+                self.newest_ts = int(state["newest_ts"])
+                self.added, self.late = int(state["added"]), int(state["late"])
+            else:
+                # saved before these were: the newest minute held is as close as it gets
+                finest = self.levels[0]
+                newest = int(finest.ids.max())
+                self.newest_ts = finest.start(newest + 1) - 1 if newest >= 0 else -1
+
+
+def _holds(level, ts):
+    # whether the ring of `level` still holds the bucket of `ts`
+    newest = level.ids.max()
+    return newest >= 0 and level.bucket(ts) > newest - level.slots
+
+
+def _percentile(hist, p, low, high):
+    """
+    The p-th percentile from a histogram over BIN_EDGES, interpolated
+    geometrically inside its bin and kept within the exact [low, high].
+    """
+    cumulative = np.cumsum(hist)
+    rank = p / 100 * cumulative[-1]
+    b = int(np.searchsorted(cumulative, rank, side="left"))
+    lo = BIN_EDGES[b] if b < len(BIN_EDGES) else BIN_EDGES[-1]
+    hi = BIN_EDGES[b + 1] if b + 1 < len(BIN_EDGES) else max(high, lo)
+    before = cumulative[b - 1] if b else 0
+    fraction = (rank - before) / hist[b] if hist[b] else 0.0
+    value = lo * (hi / lo) ** fraction if lo > 0 else hi * fraction
+    return float(min(max(value, low), high))
@@ -0,0 +1,259 @@
+# daraja.py - helpers for the Safaricom Daraja (M-Pesa) API
+import os
+import json
+import time
+import fcntl
+import base64
+import hashlib
+import threading
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ----------------------------
+# OAuth token cache (shared by all gunicorn workers through a file)
+# ----------------------------
+class TokenCache:
+    """
+    Caches the Daraja OAuth token until shortly before it expires.
+
+    `fetch` is called with no arguments and must return (access_token, expires_in)
+    or raise. The token is kept in memory and in `path`, so every worker on the
+    host reuses the same token. An exclusive lock on `path + ".lock"` makes sure
+    only one caller refreshes at a time; the others block and then read the
+    fresh token from the file. After a failed refresh, callers get None for
+    `retry_after` seconds instead of piling more requests onto a broken API.
+
+    `owner` names what the token is valid for (e.g. base URL and consumer
+    key). Its hash is stored with the token, and a file written for another
+    owner is ignored, so switching from the sandbox to fake_daraja does not
+    reuse the sandbox's token.
+    """
+
+    def __init__(self, fetch, path, owner="", refresh_margin=60, default_ttl=3599, retry_after=5):
+        self.fetch = fetch
+        self.path = path
+        self.owner = hashlib.sha256(owner.encode()).hexdigest()[:16]
+        self.lock_path = path + ".lock"
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self.retry_after = retry_after
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._token = None
+        self._expires_at = 0.0
+        self._failed_until = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self, expires_at, now):
+        return now < expires_at - self.refresh_margin
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("owner") != self.owner:
+                return None, 0.0
+            return data.get("access_token"), float(data.get("expires_at", 0))
+        except Exception:
+            return None, 0.0
+
+    def _write_file(self, token, expires_at):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"access_token": token, "expires_at": expires_at, "owner": self.owner}, f)
+        os.replace(tmp, self.path)
+
+    def get(self):
+        """
+        Returns a valid access token, or None if it could not be obtained.
+        """
+        with self._lock:
+            now = time.time()
+            if self._token and self._fresh(self._expires_at, now):
+                self.hits += 1
+                return self._token
+            if now < self._failed_until:
+                return None
+
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # another worker may have refreshed while we waited
+                    token, expires_at = self._read_file()
+                    now = time.time()
+                    if token and self._fresh(expires_at, now):
+                        self._token, self._expires_at = token, expires_at
+                        self.hits += 1
+                        return token
+
+                    self.misses += 1
+                    try:
+                        token, expires_in = self.fetch()
+                    except Exception:
+                        token, expires_in = None, None
+                    if not token:
+                        self.errors += 1
+                        self._failed_until = time.time() + self.retry_after
+                        return None
+                    try:
+                        ttl = float(expires_in)
+                    except (TypeError, ValueError):
+                        ttl = self.default_ttl
+                    expires_at = time.time() + ttl
+                    self._token, self._expires_at = token, expires_at
+                    try:
+                        self._write_file(token, expires_at)
+                    except OSError:
+                        pass
+                    return token
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def invalidate(self):
+        """
+        Drops the cached token, e.g. after the API answered 401 with it.
+        """
+        with self._lock:
+            rejected, self._token, self._expires_at = self._token, None, 0.0
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # a worker that got the same 401 may have refreshed already;
+                    # its new token stays
+                    token, _ = self._read_file()
+                    if token is not None and token == rejected:
+                        os.remove(self.path)
+                except OSError:
+                    pass
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "expires_in": max(0.0, self._expires_at - time.time()),
+        }
+
+
+# ----------------------------
+# Pooled HTTP client
+# ----------------------------
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POST_RETRY_STATUSES = (429, 503)  # with Retry-After: the server turned the request away
+
+class _Retry(Retry):
+    # A POST (an STK push) answered 5xx may already have prompted the donor, so
+    # it is only retried when the server said it did nothing and when to come back
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST" and not (has_retry_after and status_code in POST_RETRY_STATUSES):
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+def make_retry(retries, backoff, jitter):
+    """
+    Bounded retry policy with exponential backoff plus jitter, honoring
+    Retry-After. Connection errors are retried for every method, since the
+    request never left. GETs are also retried on 429/5xx answers; POSTs only
+    on 429/503 with Retry-After. Read timeouts and other errors after sending
+    are not retried, since the request may already have reached Safaricom.
+    """
+    kwargs = dict(
+        total=retries,
+        connect=retries,
+        read=0,
+        other=0,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        backoff_factor=backoff,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return _Retry(backoff_jitter=jitter, **kwargs)
+    except TypeError:
+        # urllib3 < 2 has no jitter support
+        return _Retry(**kwargs)
+
+class DarajaClient:
+    """
+    Keep-alive client for the Daraja API. One instance holds a `requests.Session`
+    whose connection pool is reused by every call in the process, so only the
+    first request to a host pays for the TCP and TLS handshake.
+
+    Calls, errors (exceptions and 4xx/5xx answers) and retries are counted per
+    endpoint; see stats().
+    """
+
+    def __init__(self, base_url, consumer_key, consumer_secret,
+                 pool_connections=2, pool_maxsize=10,
+                 connect_timeout=3.05, read_timeout=10,
+                 retries=3, backoff=0.5, jitter=0.5):
+        self.base_url = base_url.rstrip("/")
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=make_retry(retries, backoff, jitter))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.retries = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _request(self, endpoint, method, url, **kwargs):
+        try:
+            resp = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            with self._stats_lock:
+                self.calls[endpoint] += 1
+                self.errors[endpoint] += 1
+            raise
+        history = getattr(getattr(resp.raw, "retries", None), "history", None) or ()
+        with self._stats_lock:
+            self.calls[endpoint] += 1
+            self.retries[endpoint] += len(history)
+            if resp.status_code >= 400:
+                self.errors[endpoint] += 1
+        return resp
+
+    def fetch_token(self):
+        """
+        Requests a new OAuth token. Returns (access_token, expires_in); raises on failure.
+        """
+        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+        auth_str = f"{self.consumer_key}:{self.consumer_secret}"
+        b64 = base64.b64encode(auth_str.encode()).decode()
+        resp = self._request("oauth", "GET", url, headers={"Authorization": f"Basic {b64}"})
+        resp.raise_for_status()
+        data = resp.json()
+        return data.get("access_token"), data.get("expires_in")
+
+    def stk_push(self, token, payload):
+        """
+        Sends an STK push request and returns the raw response (status not checked).
+        """
+        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        return self._request("stkpush", "POST", url, json=payload, headers=headers)
+
+    def stats(self):
+        with self._stats_lock:
+            return {endpoint: {"calls": self.calls[endpoint], "errors": self.errors[endpoint],
+                               "retries": self.retries[endpoint]}
+                    for endpoint in self.calls}
+
+    def close(self):
+        self.session.close()
@@ -1,45 +1,88 @@
 # mood_sync_dashboard_with_stk.py
 import os
 import json
+import atexit
+import functools
 import time
 import hashlib
+import hmac
+import secrets
+import threading
 import base64
 import datetime
+import uuid
 import requests
 
-import pandas as pd
 import numpy as np
-from dash import Dash, dcc, html, Input, Output, State
-import plotly.graph_objects as go
-import plotly.express as px
+from constants import counties, payment_types, sectors
+from daraja import TokenCache, DarajaClient
+from donations import DonationQueue, FINAL_STATUSES
+from userstore import UserStore, DuplicateEmail
+from aggregator import RollingWindow, Clock, top_k
+from columnar import TransactionBatch
+from cube import StatsCube
+from assistant import Assistant
+from firehose import Firehose, Feed
+from ingest import Ingestor, Normalizer
+from journal import Journal
+from snapshots import SnapshotCache
+from rollups import RollupStore
+from warmstate import StateFile
+from alerts import AnomalyDetector, AlertLog, ALERT_LABELS, SPIKE, DROP, STABLE
+from push import PushHub
+from metrics import Metrics, SlowRequestProfiler
+from executor import CallbackPool, Superseded
+from figures import render_snapshot
+from flask import request as flask_request, jsonify, Response
+from dash import Dash, dcc, html, Input, Output, State, Patch
+from dash.exceptions import PreventUpdate
+from plotly.io.json import to_json_plotly
+# pandas and plotly.express (a third of the import time) are imported by the
+# functions that build dashboards, so pages that never draw one do not pay for
+# them; gunicorn.conf.py loads them in the master through warm_up()
 
 # ----------------------------
 # Setup & constants
 # ----------------------------
 np.random.seed(42)
-
-counties = [
-    "Nairobi","Mombasa","Kisumu","Nakuru","Eldoret","Thika","Malindi","Meru","Machakos","Kakamega",
-    "Nyeri","Murang'a","Embu","Kericho","Bomet","Narok","Baringo","Laikipia","Bungoma",
-    "Busia","Siaya","Homa Bay","Migori","Kisii","Nyamira","Garissa","Wajir","Mandera","Marsabit",
-    "Isiolo","Kitui","Makueni","Taita Taveta","Kilifi","Kwale","Tana River","Samburu","Turkana",
-    "West Pokot","Elgeyo Marakwet","Trans Nzoia","Nandi","Vihiga","Tharaka Nithi","Lamu","Kajiado","Kiambu"
-]
-
-payment_types = ['Mpesa','Airtel Money','Bank Transfer']
-sectors = ['Transport','Communication','Retail','Banking','Government','Utilities']
+# counties, payment_types and sectors live in constants.py, so the firehose
+# and ingest CLIs can use them without importing (and starting) the app
 
 app = Dash(__name__)
 app.title = "MoodSync Kenya Dashboard - Live M-Pesa"
+server = app.server  # for gunicorn: denis:server
+
+# Callback and stage timings, served on /metrics. Set METRICS_DIR to a directory
+# shared by the gunicorn workers so any of them reports the totals of all.
+metrics = Metrics(directory=os.environ.get("METRICS_DIR"))
+metrics.describe("dash_callback_seconds", "histogram", "Time spent in each Dash callback.")
+metrics.describe("dashboard_stage_seconds", "histogram", "Time spent in each stage of a dashboard update.")
+metrics.describe("daraja_request_seconds", "histogram", "Daraja API calls, including retries.")
+metrics.describe("userstore_seconds", "histogram", "User store queries.")
 
-alert_log = []
+# PROFILE_SLOW_MS=500 writes a sampled stack profile of every request slower than 500 ms
+if os.environ.get("PROFILE_SLOW_MS"):
+    slow_profiler = SlowRequestProfiler(float(os.environ["PROFILE_SLOW_MS"]) / 1000,
+                                        os.environ.get("PROFILE_DIR", "profiles"))
+    slow_profiler.install(server)
 
-USERS_FILE = "users.json"
+USERS_FILE = "users.json"  # legacy store, imported into USERS_DB once
+USERS_DB = "users.db"
+DONATIONS_DB = "donations.db"
+ALERTS_DB = "alerts.db"
+ROLLUP_DIR = os.environ.get("ROLLUP_DIR", "rollups")  # minute/hour/day history
+STATE_FILE = os.environ.get("DASHBOARD_STATE_FILE", "dashboard_state.npz")  # "" disables warm restarts
+INGEST_MEMORY_MB = int(os.environ.get("INGEST_MEMORY_MB", "256"))  # per ingest stage, however large the file
+INGEST_JOURNAL_DIR = os.environ.get("INGEST_JOURNAL_DIR", "ingest-journal")  # "" applies POST /ingest in one worker only
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")  # if set, POST /ingest needs "Authorization: Bearer <token>"
+FIREHOSE_RATE = float(os.environ.get("FIREHOSE_RATE", "0"))  # synthetic tx/s for load tests; 0 is off
+FIREHOSE_EVENTS_PER_DAY = float(os.environ.get("FIREHOSE_EVENTS_PER_DAY", "6"))  # random spikes and drops
 
 # ----------------------------
 # Safaricom Sandbox credentials (official test credentials you accepted)
 # ----------------------------
-MPESA_BASE_URL = "https://sandbox.safaricom.co.ke"
+# Point MPESA_BASE_URL at fake_daraja.py to run without network access
+MPESA_BASE_URL = os.environ.get("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
 CONSUMER_KEY = "bwrYETJX1vaWbOXFTrf7A55oTgfC9YQNq1zoe6bScn6pnkmI"
 CONSUMER_SECRET = "y1Njn0Aiq18khzQ5eGJneSG1Ju5dXICMv6ZXGatzEiymyhcGFfdCy1B0ode3MYCS"
 SHORTCODE = "174379"  # sandbox test shortcode
@@ -50,34 +93,58 @@ PASSKEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"  #
 # For now it's a placeholder; replace before running STK-push if you need callbacks.
 CALLBACK_URL = "https://your-public-callback-url.example.com/mpesa_callback"
 
+# OAuth tokens are cached here and shared by every worker on the host
+TOKEN_CACHE_FILE = "mpesa_token.json"
+
+# Safaricom posts results to CALLBACK_URL/<token>, and /mpesa_callback rejects
+# any other token, so a made-up callback cannot mark a donation paid. The token
+# is MPESA_CALLBACK_TOKEN, or one generated on first start and kept in this
+# file, so every worker and every restart accepts callbacks for earlier pushes.
+CALLBACK_TOKEN_FILE = "mpesa_callback_token"
+
+def load_callback_token(path):
+    token = os.environ.get("MPESA_CALLBACK_TOKEN")
+    if token:
+        return token
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    token = secrets.token_urlsafe(24)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+CALLBACK_TOKEN = load_callback_token(CALLBACK_TOKEN_FILE)
+
 # ----------------------------
-# Helpers: users file read/write
+# Helpers: user store (SQLite, migrated from users.json on first start)
 # ----------------------------
+# users.json entries whose email is already taken are not imported; their
+# count is in /cache_stats ("users": {"migration": ...})
+user_store = UserStore(USERS_DB)
+user_store.migrate_json(USERS_FILE)
+
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        return []
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+    with metrics.timer("userstore_seconds", op="all"):
+        return user_store.all()
 
 def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2, ensure_ascii=False)
+    with metrics.timer("userstore_seconds", op="replace_all"):
+        user_store.replace_all(users)
 
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
 def email_exists(email):
-    users = load_users()
-    for u in users:
-        if u.get("email", "").lower() == (email or "").lower():
-            return True
-    return False
+    with metrics.timer("userstore_seconds", op="email_exists"):
+        return user_store.email_exists(email)
 
 def add_user(full_name, email, password, subscription):
-    users = load_users()
+    """
+    Raises DuplicateEmail if another registration took the email first.
+    """
     timestamp = datetime.datetime.utcnow().isoformat() + "Z"
     user = {
         "full_name": full_name,
@@ -86,48 +153,39 @@ def add_user(full_name, email, password, subscription):
         "subscription": subscription,
         "registered_at": timestamp
     }
-    users.append(user)
-    save_users(users)
+    with metrics.timer("userstore_seconds", op="add"):
+        user_store.add(user)
 
 # ----------------------------
 # M-Pesa STK Push (Sandbox)
 # ----------------------------
-def get_mpesa_oauth_token():
+daraja_client = DarajaClient(MPESA_BASE_URL, CONSUMER_KEY, CONSUMER_SECRET)
+
+def fetch_mpesa_oauth_token():
     """
-    Retrieves OAuth token from the sandbox.
+    Requests a new OAuth token from the sandbox.
+    Returns (access_token, expires_in); raises on failure.
     """
-    url = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-    auth_str = f"{CONSUMER_KEY}:{CONSUMER_SECRET}"
-    b64 = base64.b64encode(auth_str.encode()).decode()
-    headers = {"Authorization": f"Basic {b64}"}
-    try:
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("access_token")
-    except Exception as e:
-        # Return None on failure
-        return None
+    with metrics.timer("daraja_request_seconds", endpoint="oauth"):
+        return daraja_client.fetch_token()
 
-def lipa_na_mpesa_stk_push(phone_number, amount, account_reference="Donation", transaction_desc="Donation"):
+token_cache = TokenCache(fetch_mpesa_oauth_token, TOKEN_CACHE_FILE, owner=f"{MPESA_BASE_URL} {CONSUMER_KEY}")
+
+def get_mpesa_oauth_token():
     """
-    Initiates STK push via Safaricom sandbox.
-    phone_number should be in format 2547XXXXXXXX (no +).
-    amount is integer (KES).
-    Returns dict with the API response or error info.
+    Returns a cached OAuth token, refreshing it shortly before it expires.
+    Returns None on failure.
     """
-    token = get_mpesa_oauth_token()
-    if not token:
-        return {"success": False, "error": "Failed to obtain MPESA OAuth token."}
+    return token_cache.get()
 
-    # Timestamp and password
+def build_stk_push_payload(phone_number, amount, account_reference="Donation", transaction_desc="Donation"):
+    """
+    Builds the STK push request body, including the timestamped password.
+    """
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     password_str = SHORTCODE + PASSKEY + timestamp
     password = base64.b64encode(password_str.encode()).decode()
-
-    url = f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
+    return {
         "BusinessShortCode": SHORTCODE,
         "Password": password,
         "Timestamp": timestamp,
@@ -136,13 +194,37 @@ def lipa_na_mpesa_stk_push(phone_number, amount, account_reference="Donation", t
         "PartyA": phone_number,
         "PartyB": SHORTCODE,
         "PhoneNumber": phone_number,
-        "CallBackURL": CALLBACK_URL,
+        "CallBackURL": f"{CALLBACK_URL}/{CALLBACK_TOKEN}",
         "AccountReference": account_reference,
         "TransactionDesc": transaction_desc
     }
 
+def lipa_na_mpesa_stk_push(phone_number, amount, account_reference="Donation", transaction_desc="Donation"):
+    """
+    Initiates STK push via Safaricom sandbox.
+    phone_number should be in format 2547XXXXXXXX (no +).
+    amount is integer (KES).
+    Returns dict with the API response or error info.
+    """
+    token = get_mpesa_oauth_token()
+    if not token:
+        return {"success": False, "error": "Failed to obtain MPESA OAuth token."}
+
+    payload = build_stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=15)
+        with metrics.timer("daraja_request_seconds", endpoint="stkpush"):
+            resp = daraja_client.stk_push(token, payload)
+        if resp.status_code == 401:
+            # token was revoked or expired early: fetch a new one and retry once
+            token_cache.invalidate()
+            token = get_mpesa_oauth_token()
+            if not token:
+                return {"success": False, "error": "Failed to obtain MPESA OAuth token."}
+            with metrics.timer("daraja_request_seconds", endpoint="stkpush"):
+                resp = daraja_client.stk_push(token, payload)
+            if resp.status_code == 401:
+                token_cache.invalidate()
         resp.raise_for_status()
         return {"success": True, "response": resp.json()}
     except requests.HTTPError as he:
@@ -153,6 +235,19 @@ def lipa_na_mpesa_stk_push(phone_number, amount, account_reference="Donation", t
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# STK pushes run in the background; results arrive on /mpesa_callback
+donation_queue = DonationQueue(DONATIONS_DB, lipa_na_mpesa_stk_push)
+donation_queue.recover()
+
+@server.route('/mpesa_callback/<token>', methods=['POST'])
+def mpesa_callback(token):
+    if not hmac.compare_digest(token, CALLBACK_TOKEN):
+        return jsonify({"error": "forbidden"}), 403
+    body = flask_request.get_json(force=True, silent=True)
+    donation_queue.record_callback(body)
+    # Safaricom only needs an acknowledgement; unknown callbacks are accepted too
+    return jsonify({"ResultCode": 0, "ResultDesc": "Accepted"})
+
 # ----------------------------
 # Styles & App layout (original preserved)
 # ----------------------------
@@ -179,6 +274,16 @@ app.layout = html.Div([
 # ----------------------------
 # Dashboard layout (preserved)
 # ----------------------------
+# KPI cards: texts and sparklines are drawn in the browser from kpi-data (see the
+# clientside callback after update_dashboard)
+KPI_CARDS = {'total-txn': '#58ff6f', 'total-amt': '#ff6f58', 'current-tpm': '#ff58ff', 'trend-alert': '#ffd658'}
+
+def kpi_card(card_id, color):
+    return html.Div([
+        html.Div(id=card_id),
+        dcc.Graph(id=f'{card_id}-spark', config={'staticPlot': True, 'displayModeBar': False}, style={'height':'50px'})
+    ], style={**CARD_STYLE,'display':'inline-block','width':'23%','color':color,'textAlign':'center'})
+
 def dashboard_layout():
     return html.Div([
         html.Div([
@@ -193,18 +298,19 @@ def dashboard_layout():
             )
         ], style={'width':'50%', 'margin':'0 auto','marginBottom':'20px'}),
 
-        html.Div([
-            html.Div(id='total-txn', style={**CARD_STYLE,'display':'inline-block','width':'23%','color':'#58ff6f','textAlign':'center'}),
-            html.Div(id='total-amt', style={**CARD_STYLE,'display':'inline-block','width':'23%','color':'#ff6f58','textAlign':'center'}),
-            html.Div(id='current-tpm', style={**CARD_STYLE,'display':'inline-block','width':'23%','color':'#ff58ff','textAlign':'center'}),
-            html.Div(id='trend-alert', style={**CARD_STYLE,'display':'inline-block','width':'23%','color':'#ffd658','textAlign':'center'})
-        ], style={'textAlign':'center','marginBottom':'20px'}),
+        dcc.RadioItems(id='time-range', options=TIME_RANGES, value=60, inline=True,
+                       style={'color':'#58a6ff','textAlign':'center','marginBottom':'20px'}),
+
+        html.Div([kpi_card(card_id, color) for card_id, color in KPI_CARDS.items()] + [dcc.Store(id='kpi-data')],
+                 style={'textAlign':'center','marginBottom':'20px'}),
 
         html.Div([
             html.Div([
                 dcc.Graph(id='tpm-chart', style={'height':'300px'}),
                 dcc.Graph(id='payment-chart', style={'height':'450px'}),
                 dcc.Graph(id='sector-chart', style={'height':'400px'}),
+                dcc.RadioItems(id='rank-metric', options=RANK_METRICS, value='transactions', inline=True,
+                               style={'color':'#58a6ff','marginTop':'10px'}),
                 dcc.Graph(id='top-counties-chart', style={'height':'400px'}),
                 dcc.Graph(id='top-sectors-chart', style={'height':'350px'}),
                 dcc.Graph(id='peak-hour-heatmap', style={'height':'300px'})
@@ -212,7 +318,7 @@ def dashboard_layout():
 
             html.Div([
                 html.H3("💬 AI Assistant", style={'color':'#58a6ff'}),
-                dcc.Textarea(id='user-question', placeholder='Ask about averages, totals, or current TPM...',
+                dcc.Textarea(id='user-question', placeholder='Ask about averages, totals, current TPM, or e.g. "Nairobi vs Mombasa this hour"...',
                              style={'width':'100%','height':100,'backgroundColor':'#0d1117','color':'white','marginBottom':'10px'}),
                 html.Button("Ask", id='ask-btn', n_clicks=0, style={'width':'100%','padding':'10px','backgroundColor':'#1f6feb','color':'white','border':'none','borderRadius':'8px'}),
                 html.Div(id='ai-answer', style={**CARD_STYLE,'backgroundColor':'#21262d','marginTop':'10px'}),
@@ -229,11 +335,14 @@ def dashboard_layout():
             ], style={'width':'28%','display':'inline-block','verticalAlign':'top'})
         ]),
 
-        dcc.Interval(id='interval-update', interval=5000, n_intervals=0)
+        dcc.Store(id='dashboard-sync'),
+        dcc.Store(id='push-config', data={'url': '/stream'} if PUSH_MODE else None),
+        dcc.Store(id='push-status'),
+        dcc.Interval(id='interval-update', interval=5000, n_intervals=0, disabled=PUSH_MODE)
     ])
 
 # ----------------------------
-# Registration layout (stores to users.json)
+# Registration layout (stores to the user store)
 # ----------------------------
 def registration_layout():
     return html.Div([
@@ -287,7 +396,9 @@ def donation_layout():
             html.Label("Amount (KES)"), dcc.Input(id='donate-amount', type='number', placeholder='100', style={'width':'20%'}),
             html.Br(), html.Br(),
             html.Button("Donate (STK Push)", id='donate-btn', n_clicks=0, style={'backgroundColor':'#1f6feb','color':'white','padding':'10px','border':'none','borderRadius':'8px'}),
-            html.Div(id='donation-message', style={'marginTop':'12px','maxWidth':'700px','wordBreak':'break-word'})
+            html.Div(id='donation-message', style={'marginTop':'12px','maxWidth':'700px','wordBreak':'break-word'}),
+            dcc.Store(id='donation-job'),
+            dcc.Interval(id='donation-poll', interval=2000, disabled=True)
         ], style={'maxWidth':'900px'})
     ])
 
@@ -309,24 +420,37 @@ def partnership_layout():
 # ----------------------------
 # Page router
 # ----------------------------
+PAGES = {'/register': registration_layout, '/donation': donation_layout,
+         '/partnership': partnership_layout}
+
+@functools.lru_cache(maxsize=None)
+def static_page(pathname, registered=False):
+    """
+    The layout of a page, built once per (page, login state) and kept in its
+    serialized form (plain dicts), so navigating neither rebuilds the
+    component tree nor walks it again to encode the response.
+    """
+    if pathname == '/ai':
+        layout = ai_layout(registered)
+    else:
+        layout = PAGES.get(pathname, dashboard_layout)()
+    return json.loads(to_json_plotly(layout))
+
 @app.callback(Output('page-content','children'),
               Input('url','pathname'),
               State('registered-user','data'))
+@metrics.timed("dash_callback_seconds", callback="display_page")
 def display_page(pathname, user_data):
     registered = user_data.get('email') is not None
-    if pathname == '/register':
-        return registration_layout()
-    elif pathname == '/ai':
-        return ai_layout(registered)
-    elif pathname == '/donation':
-        return donation_layout()
-    elif pathname == '/partnership':
-        return partnership_layout()
-    else:
-        return dashboard_layout()
+    if pathname == '/ai':
+        return static_page('/ai', registered)
+    if pathname in PAGES:
+        return static_page(pathname)
+    # every dashboard page load gets its own tab id (see callback_pool.run)
+    return [static_page('/'), dcc.Store(id='tab-id', data=uuid.uuid4().hex)]
 
 # ----------------------------
-# Registration callback (now writes to users.json)
+# Registration callback (writes to the user store)
 # ----------------------------
 @app.callback(
     Output('register-message','children'),
@@ -338,6 +462,7 @@ def display_page(pathname, user_data):
     State('reg-subscription','value'),
     State('registered-user','data')
 )
+@metrics.timed("dash_callback_seconds", callback="register_user")
 def register_user(n, name, email, password, subscription, stored):
     if n and n > 0:
         # basic validation
@@ -352,48 +477,89 @@ def register_user(n, name, email, password, subscription, stored):
             stored['email'] = email
             stored['name'] = name
             return f"Registration successful! Welcome {name}.", stored
+        except DuplicateEmail as e:
+            return str(e), stored
         except Exception as e:
             return f"Failed to register: {str(e)}", stored
     return "", stored
 
 # ----------------------------
-# Donation callback - performs STK push (sandbox)
+# Donation callbacks - queue the STK push (sandbox), then poll its status
 # ----------------------------
+DONATION_POLL_TIMEOUT = 180  # seconds to keep polling for the M-Pesa callback
+
 @app.callback(
-    Output('donation-message','children'),
+    Output('donation-job','data'),
     Input('donate-btn','n_clicks'),
     State('donate-phone','value'),
     State('donate-amount','value')
 )
+@metrics.timed("dash_callback_seconds", callback="perform_donation")
 def perform_donation(n, phone, amount):
     if not n or n == 0:
-        return ""
+        return None
     if not phone or not amount:
-        return "Please provide phone number and amount."
+        return {'error': "Please provide phone number and amount."}
     phone_str = str(phone).strip()
     # basic validation for Kenyan mobile format
     if not (phone_str.startswith("254") and len(phone_str) >= 12):
-        return "Phone number must be in format 2547XXXXXXXX."
+        return {'error': "Phone number must be in format 2547XXXXXXXX."}
     try:
         amount_int = int(amount)
         if amount_int <= 0:
-            return "Amount must be a positive number."
+            return {'error': "Amount must be a positive number."}
     except Exception:
-        return "Invalid amount."
+        return {'error': "Invalid amount."}
+
+    return {'job_id': donation_queue.submit(phone_str, amount_int)}
+
+@app.callback(
+    Output('donation-message','children'),
+    Output('donation-poll','disabled'),
+    Input('donation-job','data'),
+    Input('donation-poll','n_intervals')
+)
+@metrics.timed("dash_callback_seconds", callback="show_donation_status")
+def show_donation_status(job, n):
+    if not job:
+        return "", True
+    if job.get('error'):
+        return job['error'], True
+    status = donation_queue.status(job.get('job_id'))
+    if status is None:
+        return "Donation not found.", True
 
-    # Initiate STK push
-    res = lipa_na_mpesa_stk_push(phone_str, amount_int, account_reference="Donation", transaction_desc="Donation")
-    if not res.get("success"):
+    state = status['status']
+    waited = time.time() - status['created_at']
+    if state in ('queued', 'sending'):
+        if waited > DONATION_POLL_TIMEOUT:
+            return "The STK push request is taking too long to send. Please try again later.", True
+        return "Sending STK push request (sandbox)...", False
+    if state == 'failed':
         return html.Div([
             html.Div("Failed to send STK push (sandbox)."),
-            html.Pre(str(res.get("error")))
-        ])
-    # Success - show message and raw response for debugging
-    resp = res.get("response", {})
+            html.Pre(str(status.get('error')))
+        ]), True
+    resp = json.loads(status.get('response') or '{}')
+    if state == 'pending':
+        return html.Div([
+            html.Div("STK Push request sent (sandbox). Check your phone for prompt."),
+            html.Pre(json.dumps(resp, indent=2))
+        ]), waited > DONATION_POLL_TIMEOUT
+    if state == 'unknown':
+        # the worker stopped while sending: its checkout id, which a callback
+        # would be matched on, was never stored
+        return html.Div("We could not confirm that the STK push was sent. If a prompt reached your phone, "
+                        "check your M-Pesa messages before donating again."), True
+    if state == 'completed':
+        return html.Div([
+            html.Div(f"Donation received. Thank you! M-Pesa receipt: {status.get('receipt')}"),
+            html.Pre(json.dumps(resp, indent=2))
+        ]), True
     return html.Div([
-        html.Div("STK Push request sent (sandbox). Check your phone for prompt."),
-        html.Pre(json.dumps(resp, indent=2))
-    ])
+        html.Div("Donation was not completed."),
+        html.Pre(str(status.get('result_desc')))
+    ]), state in FINAL_STATUSES
 
 # ----------------------------
 # Partnership callback (unchanged simulated send)
@@ -403,6 +569,7 @@ def perform_donation(n, phone, amount):
     Input('partner-send','n_clicks'),
     State('partner-desc','value')
 )
+@metrics.timed("dash_callback_seconds", callback="send_partner")
 def send_partner(n, desc):
     if n and n > 0:
         if desc and desc.strip():
@@ -414,103 +581,725 @@ def send_partner(n, desc):
 # ----------------------------
 # Process transactions and original dashboard callbacks (preserved)
 # ----------------------------
-def process_transactions(transactions, county):
-    if not transactions:
-        minutes = pd.date_range(end=datetime.datetime.now(), periods=60, freq='T')
-        tpm = np.random.randint(200,1200, size=len(minutes))
-        df_tpm = pd.DataFrame({'datetime': minutes, 'tpm': tpm})
+PAYMENT_SHARES = np.array([0.7, 0.2, 0.1])  # Mpesa, Airtel Money, Bank Transfer
+AVG_TXN_AMOUNT = 150  # KES, used when only counts are known
+BUCKET_MINUTES = [1, 5, 15, 30, 60, 180, 360, 720, 1440]
+MAX_POINTS = 120  # chart points per window, whatever its length
+# Chart windows in minutes; bucket_minutes() picks the bucket size and the
+# rollup store reads the matching resolution (minutes, hours or days)
+TIME_RANGES = [{'label':'1h','value':60}, {'label':'24h','value':1440},
+               {'label':'7d','value':10080}, {'label':'90d','value':129600}]
+RANGE_LABELS = {60: 'Last Hour', 1440: 'Last 24h', 10080: 'Last 7 Days', 129600: 'Last 90 Days'}
+HEATMAP_DAYS = 7
+EAT_OFFSET_HOURS = 3  # peak hours are shown in East Africa Time
+
+COUNTY_INDEX = {c: i for i, c in enumerate(counties)}
+PAYMENT_INDEX = {p: i for i, p in enumerate(payment_types)}
+SECTOR_INDEX = {s: i for i, s in enumerate(sectors)}
+
+# Live per-minute counters for all counties (last LIVE_WINDOW_MINUTES minutes)
+LIVE_WINDOW_MINUTES = 60
+live = RollingWindow(len(counties), len(payment_types), len(sectors), minutes=LIVE_WINDOW_MINUTES)
+
+# Count/sum/min/max/percentiles per county, payment type, sector and
+# minute/hour/day, kept up to date by ingest_batch, for the AI assistant
+cube = StatsCube(len(counties), len(payment_types), len(sectors))
+assistant = Assistant(cube, counties, payment_types, sectors)
+
+# Every closed minute is rolled up to disk, for windows longer than the live one
+rollups = RollupStore(ROLLUP_DIR, len(counties), len(payment_types), len(sectors))
+live.on_minute_close.append(rollups.add_minute)
+
+# Spike/drop detection for every county as minutes close, whoever is watching
+alert_log = AlertLog(ALERTS_DB)
+ALERT_DISPLAY_LIMIT = 10
+
+def record_alert(minute, county_idx, kind, value, baseline, change):
+    alert_log.add(minute, counties[county_idx], kind, value, baseline, change)
+
+detector = AnomalyDetector(len(counties), span=10, threshold=50.0, on_alert=record_alert)
+live.on_minute_close.append(lambda minute, counts, amounts: detector.observe(minute, counts.sum(axis=(1, 2))))
+
+# The live window and detector survive restarts: saved every STATE_SAVE_SECONDS
+# once data flows, restored here at import (in the gunicorn master with
+# --preload, so forked workers share the restored arrays copy-on-write)
+state_file = StateFile(STATE_FILE, {'live': live, 'detector': detector, 'cube': cube},
+                       every=float(os.environ.get("STATE_SAVE_SECONDS", "30")))
+if STATE_FILE:
+    state_file.restore()
+    live.on_minute_close.append(state_file.notify)
+    atexit.register(state_file.flush)
+
+# Minutes close on the wall clock too, not only when a later event arrives: a
+# quiet or restored window moves on to the current minute, and its closed
+# minutes still reach the rollups and the detector
+live_clock = Clock(live)
+
+@server.before_request
+def start_live_clock():
+    live_clock.start()
+
+def recent_alerts(county=None, limit=ALERT_DISPLAY_LIMIT):
+    lines = []
+    for a in alert_log.query(county=county, limit=limit):
+        stamp = datetime.datetime.fromtimestamp(a['minute'] * 60, datetime.timezone.utc).strftime("%H:%M")
+        lines.append(f"{stamp} - {a['county']}: {ALERT_LABELS[a['kind']]} ({a['change']:+.0f}%)")
+    return lines
+
+@server.route('/alerts')
+def alerts_api():
+    # /alerts?county=Nairobi&start=<epoch s>&end=<epoch s>&limit=50
+    args = flask_request.args
+    try:
+        start = int(args['start']) // 60 if args.get('start') else None
+        end = int(args['end']) // 60 if args.get('end') else None
+        limit = min(int(args.get('limit', 50)), 1000)
+    except ValueError:
+        return jsonify({"error": "start, end and limit must be integers"}), 400
+    return jsonify(alert_log.query(county=args.get('county'), start=start, end=end, limit=limit))
+
+def ingest_batch(batch):
+    """
+    Adds a TransactionBatch to the live counters and the stats cube. Returns
+    the number accepted by the live counters.
+    """
+    cube.add_batch(batch)
+    return live.add_batch(batch.ts, batch.county, batch.payment, batch.sector, batch.amount)
+
+def ingest_transactions(transactions, default_county=None):
+    """
+    Adds transactions to the live counters: a TransactionBatch, or dicts
+    (timestamp, county, payment_type, sector, amount). Returns the number
+    accepted; records with an unknown county, payment type or sector are skipped.
+    """
+    if not isinstance(transactions, TransactionBatch):
+        transactions = TransactionBatch.from_records(transactions, COUNTY_INDEX, PAYMENT_INDEX,
+                                                     SECTOR_INDEX, default_county=default_county)
+    return ingest_batch(transactions)
+
+# Synthetic load (FIREHOSE_RATE > 0): a seeded firehose feeding ingest_batch
+# once a second, with FIREHOSE_EVENTS_PER_DAY random spikes and drops. It runs
+# in each worker (started on the first request, or by gunicorn.conf.py), not
+# the master. Every second is drawn from a generator seeded with the second
+# and the stream starts when the master imported this module, so under
+# gunicorn --preload all workers apply the same transactions.
+firehose_feed = None
+if FIREHOSE_RATE > 0:
+    firehose_feed = Feed(Firehose(counties, payment_types, sectors, rate=FIREHOSE_RATE,
+                                  seed=int(os.environ.get("FIREHOSE_SEED", "0")), payment_shares=PAYMENT_SHARES),
+                         ingest_batch, events_per_day=FIREHOSE_EVENTS_PER_DAY)
+
+    @server.before_request
+    def start_firehose():
+        firehose_feed.start()
+
+# Rows posted to /ingest reach one worker; it appends them to a journal on disk
+# that every worker follows into ingest_batch, so all of them count them (and
+# the rollup writer, whichever worker it is, writes them). The firehose needs
+# no journal: every worker generates the same transactions (see above).
+journal = None
+if INGEST_JOURNAL_DIR:
+    journal = Journal(INGEST_JOURNAL_DIR, ingest_batch)
+
+    @server.before_request
+    def follow_journal():
+        journal.follow()
+
+# Transaction exports and streams: parsed in bounded chunks, validated and
+# passed to the journal by one background thread (ingest.Ingestor).
+# `python ingest.py FILE...` backfills history; POST /ingest takes a stream.
+ingestor = Ingestor(journal.append if journal else ingest_batch, Normalizer(counties, payment_types, sectors),
+                    memory_budget=INGEST_MEMORY_MB << 20)
+
+@server.route('/ingest', methods=['POST'])
+def ingest_api():
+    # curl --data-binary @day.jsonl -H 'Content-Type: application/x-ndjson' .../ingest
+    # curl --data-binary @day.csv -H 'Content-Type: text/csv' .../ingest
+    if INGEST_TOKEN and flask_request.headers.get('Authorization') != f"Bearer {INGEST_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    fmt = 'csv' if flask_request.mimetype == 'text/csv' else 'jsonl'
+    try:
+        rows, rejected = ingestor.ingest_stream(flask_request.stream, fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"rows": rows, "rejected": rejected, "ingest": ingestor.stats()})
+
+# ----------------------------
+# National county ranking: one aggregation over all counties per tick, shared
+# by every session and every ranking metric
+# ----------------------------
+RANKING_TICK_SECONDS = 5
+GROWTH_MINUTES = 15  # TPM growth compares the last 15 minutes with the 15 before
+TOP_COUNTIES = 5
+RANK_METRICS = [{'label':'Transactions','value':'transactions'},
+                {'label':'Amount (KES)','value':'amount'},
+                {'label':'TPM growth (%)','value':'growth'}] + \
+               [{'label':f'{p} transactions','value':f'payment:{p}'} for p in payment_types]
+RANK_LABELS = {m['value']: m['label'] for m in RANK_METRICS}
+
+_ranking = {'key': None, 'values': None, 'figures': {}}
+_ranking_lock = threading.Lock()
+
+def compute_ranking_values():
+    """
+    Every ranking metric for all counties, from a single pass over the live
+    window. Without live data the transaction counts are simulated.
+    """
+    totals = live.county_totals()
+    if totals is None or not totals[0].any():
+        simulated = np.random.randint(1000,5000,len(counties))
+        return {'transactions': simulated}
+    per_minute, by_payment, amounts = totals
+    recent = per_minute[:, -GROWTH_MINUTES:].sum(axis=1)
+    before = per_minute[:, -2 * GROWTH_MINUTES:-GROWTH_MINUTES].sum(axis=1)
+    growth = np.where(before > 0, (recent - before) / np.maximum(before, 1) * 100, 0.0)
+    values = {'transactions': per_minute.sum(axis=1), 'amount': amounts, 'growth': growth}
+    for i, p in enumerate(payment_types):
+        values[f'payment:{p}'] = by_payment[:, i]
+    return values
+
+def ranking_values():
+    key = (int(time.time() // RANKING_TICK_SECONDS), live.head)
+    with _ranking_lock:
+        if _ranking['key'] != key:
+            _ranking['values'] = compute_ranking_values()
+            _ranking['figures'] = {}
+            _ranking['key'] = key
+        return _ranking['values']
+
+def top_counties_frame(metric='transactions', k=TOP_COUNTIES):
+    import pandas as pd
+    values = ranking_values()
+    column = values.get(metric)
+    if column is None:
+        metric, column = 'transactions', values['transactions']
+    idx = top_k(column, k)
+    return pd.DataFrame({'County': [counties[i] for i in idx],
+                         'Transactions' if metric == 'transactions' else RANK_LABELS[metric]: column[idx]})
+
+def top_counties_figure(metric='transactions'):
+    """
+    Top-counties bar chart for `metric`, built at most once per tick. The
+    cached figure is a plain dict: plotly Figure objects are not safe to
+    serialize from several request threads at once.
+    """
+    values = ranking_values()
+    with _ranking_lock:
+        fig = _ranking['figures'].get(metric)
+    if fig is None:
+        import plotly.express as px
+        df = top_counties_frame(metric)
+        title = "Top Counties" if metric == 'transactions' or metric not in values else f"Top Counties by {RANK_LABELS[metric]}"
+        fig = px.bar(df, x='County', y=df.columns[1], template='plotly_dark', title=title).to_plotly_json()
+        with _ranking_lock:
+            if _ranking['values'] is values:
+                _ranking['figures'][metric] = fig
+    return fig
+
+def bucket_minutes(window):
+    """
+    Smallest bucket size (in minutes) that keeps a window of `window` minutes
+    within MAX_POINTS points, so long windows cost about the same as an hour.
+    """
+    for b in BUCKET_MINUTES:
+        if window / b <= MAX_POINTS:
+            return b
+    return BUCKET_MINUTES[-1]
+
+def long_frame(times, names, values, var_name):
+    import pandas as pd
+    # long format, one block of rows per series: the layout px expects
+    return pd.DataFrame({
+        'datetime': np.tile(times, len(names)),
+        var_name: np.repeat(names, len(times)),
+        'Transactions': values.ravel()
+    })
+
+def rollup_window(ci, window, b):
+    """
+    The county's last `window` minutes in `b`-minute buckets, read from the
+    rollups plus the open minute from the live counters: (df_tpm, payment
+    values, sector values), or None if the county has no data in the window.
+    """
+    import pandas as pd
+    step = b * 60
+    head = live.head if live.head is not None else int(time.time()) // 60
+    end = -(-(head + 1) * 60 // step) * step  # end of the bucket holding the open minute
+    start = end - window // b * step
+    times, counts, amounts = rollups.series(start, end, step, county=ci)
+    current = live.window(ci, 1)
+    if current is not None:
+        counts[-1] += current[1][0]
+        amounts[-1] += current[2][0]
+    if not counts.any():
+        return None
+    # per-minute averages for the charts; the last bucket is still filling up.
+    # 'txns' keeps the raw counts, so totals never extrapolate that bucket
+    minutes = np.full(len(times), float(b))
+    minutes[-1] = head - times[-1] // 60 + 1
+    txns = counts.sum(axis=(1, 2))
+    df_tpm = pd.DataFrame({'datetime': pd.to_datetime(times, unit='s'),
+                           'tpm': txns / minutes,
+                           'txns': txns,
+                           'amount': amounts.sum(axis=(1, 2))})
+    return df_tpm, counts.sum(axis=2).T / minutes, counts.sum(axis=1).T / minutes
+
+def hourly_heatmap(ci):
+    """
+    Average transactions per minute by day and hour of day (EAT) over the
+    complete hours of the last HEATMAP_DAYS days, from the hourly rollups.
+    None if the county has no history yet.
+    """
+    import pandas as pd
+    head = live.head if live.head is not None else int(time.time()) // 60
+    end = head * 60 // 3600 * 3600
+    times, counts, _ = rollups.series(end - HEATMAP_DAYS * 86400, end, 3600, county=ci)
+    totals = counts.sum(axis=(1, 2))
+    seen = np.flatnonzero(totals)
+    if len(seen) == 0:
+        return None
+    times, totals = times[seen[0]:], totals[seen[0]:]
+    local = pd.to_datetime(times + EAT_OFFSET_HOURS * 3600, unit='s')
+    return pd.DataFrame({'day': local.strftime('%a %d %b'), 'hour': local.hour, 'tpm': totals / 60})
+
+def process_transactions(transactions, county, window=60):
+    """
+    Builds the dashboard frames for the last `window` minutes.
+    'tpm' is always transactions per minute, averaged over the bucket when the
+    window needs buckets longer than a minute; 'txns' is the bucket's total.
+
+    `transactions` are added to the live counters first. A one-hour window is
+    read straight from those counters, longer ones from the rollups; counties
+    without data get simulated numbers. The heatmap shows the last
+    HEATMAP_DAYS days by hour whatever the window.
+    """
+    import pandas as pd
+    if transactions:
+        ingest_transactions(transactions, default_county=county)
+    b = bucket_minutes(window)
+    ci = COUNTY_INDEX.get(county)
+    use_live = ci is not None and b == 1 and window <= live.minutes and live.has_data(ci)
+    history = None if use_live or ci is None else rollup_window(ci, window, b)
+
+    if use_live:
+        epoch_minutes, counts, amounts = live.window(ci, window)
+        df_tpm = pd.DataFrame({'datetime': pd.to_datetime(epoch_minutes * 60, unit='s'),
+                               'tpm': counts.sum(axis=(1, 2)),
+                               'txns': counts.sum(axis=(1, 2)),
+                               'amount': amounts.sum(axis=(1, 2))})
+        payment_values = counts.sum(axis=2).T
+        sector_values = counts.sum(axis=1).T
+    elif history is not None:
+        df_tpm, payment_values, sector_values = history
     else:
-        df = pd.DataFrame(transactions)
-        df['datetime'] = pd.to_datetime(df['timestamp'])
-        df_tpm = df.groupby(pd.Grouper(key='datetime', freq='T')).size().reset_index(name='tpm')
-
-    payment_trend = pd.DataFrame({
-        'datetime': df_tpm['datetime'],
-        'Mpesa': df_tpm['tpm']*0.7,
-        'Airtel Money': df_tpm['tpm']*0.2,
-        'Bank Transfer': df_tpm['tpm']*0.1
-    }).melt(id_vars='datetime', var_name='Payment Type', value_name='Transactions')
-
-    sector_trend = []
-    for _, row in df_tpm.iterrows():
-        dist = np.random.dirichlet(np.ones(len(sectors)))*row['tpm']
-        entry = dict(zip(sectors, dist))
-        entry['datetime'] = row['datetime']
-        sector_trend.append(entry)
-    sector_trend = pd.DataFrame(sector_trend).melt(id_vars='datetime', value_vars=sectors, var_name='Sector', value_name='Transactions')
-
-    df_tpm['hour'] = df_tpm['datetime'].dt.hour
-    heatmap = df_tpm.groupby('hour')['tpm'].sum().reset_index()
-
-    top_counties = pd.DataFrame({
-        'County': counties,
-        'Transactions': np.random.randint(1000,5000,len(counties))
-    }).sort_values('Transactions', ascending=False).head(5)
+        if not transactions:
+            # aligned to the minute so consecutive refreshes share their x values
+            end = datetime.datetime.now().replace(second=0, microsecond=0)
+            minutes = pd.date_range(end=end, periods=max(1, window // b), freq=f'{b}min')
+            tpm = np.random.randint(200,1200, size=len(minutes))
+            df_tpm = pd.DataFrame({'datetime': minutes, 'tpm': tpm})
+        else:
+            if isinstance(transactions, TransactionBatch):
+                df = transactions.to_pandas(counties, payment_types, sectors)
+            else:
+                df = pd.DataFrame(transactions)
+            df['datetime'] = pd.to_datetime(df['timestamp'])
+            df_tpm = df.groupby(pd.Grouper(key='datetime', freq=f'{b}min')).size().reset_index(name='tpm')
+            if b > 1:
+                df_tpm['tpm'] = df_tpm['tpm'] / b
+        tpm = df_tpm['tpm'].to_numpy()
+        df_tpm['txns'] = tpm * b
+        df_tpm['amount'] = df_tpm['txns'] * AVG_TXN_AMOUNT
+        payment_values = PAYMENT_SHARES[:, None] * tpm
+        # one batched draw gives the same numbers as one draw per row
+        sector_values = (np.random.dirichlet(np.ones(len(sectors)), size=len(tpm)) * tpm[:, None]).T
+
+    times = df_tpm['datetime'].to_numpy()
+    payment_trend = long_frame(times, payment_types, payment_values, 'Payment Type')
+    sector_trend = long_frame(times, sectors, sector_values, 'Sector')
+
+    heatmap = hourly_heatmap(ci) if ci is not None else None
+    if heatmap is None:
+        heatmap = pd.DataFrame({'day': df_tpm['datetime'].dt.strftime('%a %d %b'),
+                                'hour': df_tpm['datetime'].dt.hour, 'tpm': df_tpm['tpm']})
+
+    top_counties = top_counties_frame('transactions')
 
     return df_tpm, payment_trend, sector_trend, heatmap, top_counties
 
+# Send only what changed since the client's last refresh (Dash Patch).
+# A full redraw happens when the county changes or the client fell behind.
+DELTA_UPDATES = os.environ.get("DASHBOARD_DELTA_UPDATES", "1") != "0"
+SERIES_FIGURES = ('tpm', 'payment', 'sector')
+BAR_FIGURES = ('top_sectors', 'heatmap')  # replaced whole on every delta
+KPI_SERIES = ('tpm', 'amount')
+
+def patch_series(patch, new_values, j, n, length):
+    """
+    Brings a client array of `n` points, whose last point is new_values[j],
+    in line with `new_values` (`length` points): refreshes that last point,
+    appends the points after it and trims the front.
+    """
+    patch[n - 1] = new_values[j]
+    if j + 1 < len(new_values):
+        patch.extend(new_values[j + 1:])
+    for _ in range(n + len(new_values) - j - 1 - length):
+        del patch[0]
+
+def dashboard_delta(snap, sync):
+    """
+    Returns Patch objects for the figures and kpi-data, or None when the
+    client needs a full redraw.
+    """
+    x = snap['figures']['tpm']['data'][0]['x']
+    try:
+        j = x.index(sync['last_x'])
+    except (KeyError, ValueError):
+        return None  # different window, or the client fell behind
+    n = sync.get('n') or 0
+    if n < 1 or len(x) - 1 - j > len(x) // 2:
+        return None
+
+    out = []
+    for name in SERIES_FIGURES:
+        patch = Patch()
+        if j == len(x) - 1 and n == len(x):
+            # same minute: only the open (last) point moves
+            for i, trace in enumerate(snap['figures'][name]['data']):
+                patch['data'][i]['y'][n - 1] = trace['y'][-1]
+        else:
+            for i, trace in enumerate(snap['figures'][name]['data']):
+                patch_series(patch['data'][i]['x'], trace['x'], j, n, len(x))
+                patch_series(patch['data'][i]['y'], trace['y'], j, n, len(x))
+        out.append(patch)
+    for name in BAR_FIGURES:
+        patch = Patch()
+        for i, trace in enumerate(snap['figures'][name]['data']):
+            for key in ('x', 'y', 'z', 'text'):
+                if key in trace:
+                    patch['data'][i][key] = trace[key]
+        out.append(patch)
+    patch = Patch()
+    for key, value in snap['kpi'].items():
+        if key in KPI_SERIES:
+            patch_series(patch[key], value, j, n, len(x))
+        else:
+            patch[key] = value
+    out.append(patch)
+    return out
+
 @app.callback(
     [Output('tpm-chart','figure'),
      Output('payment-chart','figure'),
      Output('sector-chart','figure'),
-     Output('top-counties-chart','figure'),
      Output('top-sectors-chart','figure'),
      Output('peak-hour-heatmap','figure'),
-     Output('total-txn','children'),
+     Output('kpi-data','data'),
+     Output('alert-log','children'),
+     Output('dashboard-sync','data')],
+    [Input('region-dropdown','value'),
+     Input('interval-update','n_intervals'),
+     Input('time-range','value')],
+    [State('dashboard-sync','data'),
+     State('tab-id','data')]
+)
+@metrics.timed("dash_callback_seconds", callback="update_dashboard")
+def update_dashboard(county, n, window=60, sync=None, tab=None):
+    window = window if window in RANGE_LABELS else 60
+    try:
+        snap = callback_pool.run(tab, (county, window), get_snapshot, county, window)
+    except Superseded:
+        raise PreventUpdate  # the tab has switched county since; drop this result
+    except TimeoutError:
+        raise PreventUpdate  # keep the figures the tab has; the next tick tries again
+    figs = snap['figures']
+    with stage("alerts"):
+        alert_log_display = html.Ul([html.Li(a) for a in recent_alerts()])
+    x = figs['tpm']['data'][0]['x']
+    new_sync = {'county': county, 'window': window, 'last_x': x[-1], 'n': len(x)}
+
+    if DELTA_UPDATES and sync and sync.get('county') == county and sync.get('window', 60) == window:
+        with stage("delta"):
+            delta = dashboard_delta(snap, sync)
+        if delta is not None:
+            return (*delta, alert_log_display, new_sync)
+
+    return (figs['tpm'], figs['payment'], figs['sector'], figs['top_sectors'], figs['heatmap'],
+            snap['kpi'], alert_log_display, new_sync)
+
+# Draws the KPI cards in the browser: the texts, the Spike/Stable/Drop badge and
+# four sparklines, all from the two compact series in kpi-data
+ALERT_COLORS = {SPIKE: '#ff6f58', STABLE: '#ffd658', DROP: '#58a6ff'}
+RENDER_KPIS = """
+    function(kpi) {
+        if (!kpi) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const labels = %s, colors = %s;
+        const fmt = v => Number(v).toLocaleString('en-US', {maximumFractionDigits: 0});
+        const spark = (y, color) => ({
+            data: [{y: y, type: 'scatter', mode: 'lines', line: {color: color, width: 1}, hoverinfo: 'skip'}],
+            layout: {height: 50, margin: {l: 0, r: 0, t: 0, b: 0}, showlegend: false,
+                     paper_bgcolor: 'rgba(0,0,0,0)', plot_bgcolor: 'rgba(0,0,0,0)',
+                     xaxis: {visible: false, fixedrange: true}, yaxis: {visible: false, fixedrange: true}}
+        });
+        const badge = {display: 'inline-block', padding: '2px 10px', borderRadius: '10px',
+                       border: '1px solid ' + colors[kpi.alert], color: colors[kpi.alert]};
+        return [
+            'Total Txns (' + (kpi.range || 'Last Hour') + '): ' + fmt(kpi.total_txn),
+            'Total Amount (KES): ' + fmt(kpi.total_amt),
+            'Current TPM: ' + fmt(kpi.current_tpm),
+            labels[kpi.alert],
+            badge,
+            spark(kpi.tpm, '#58ff6f'),
+            spark(kpi.amount, '#ff6f58'),
+            spark(kpi.tpm, '#ff58ff'),
+            spark(kpi.tpm, '#ffd658')
+        ];
+    }
+    """ % (json.dumps(ALERT_LABELS), json.dumps(ALERT_COLORS))
+app.clientside_callback(
+    RENDER_KPIS,
+    [Output('total-txn','children'),
      Output('total-amt','children'),
      Output('current-tpm','children'),
      Output('trend-alert','children'),
-     Output('alert-log','children')],
-    [Input('region-dropdown','value'),
+     Output('trend-alert','style'),
+     Output('total-txn-spark','figure'),
+     Output('total-amt-spark','figure'),
+     Output('current-tpm-spark','figure'),
+     Output('trend-alert-spark','figure')],
+    Input('kpi-data','data')
+)
+
+@app.callback(
+    Output('top-counties-chart','figure'),
+    [Input('rank-metric','value'),
      Input('interval-update','n_intervals')]
 )
-def update_dashboard(county, n):
-    global alert_log
-    try:
-        token = get_mpesa_oauth_token()
-        # In case you later implement a real endpoint, adapt get_recent_transactions to use token
-        transactions = []  # keep using simulated - original behavior preserved
-    except Exception:
-        transactions = []
-
-    df_tpm, payment_trend, sector_trend, heatmap, top_counties = process_transactions(transactions, county)
-
-    tpm_fig = px.line(df_tpm, x='datetime', y='tpm', title=f"{county} - Transactions per Minute", template='plotly_dark')
-    payment_fig = px.line(payment_trend, x='datetime', y='Transactions', color='Payment Type', template='plotly_dark', title=f"{county} Payment Type Trend")
-    sector_fig = px.area(sector_trend, x='datetime', y='Transactions', color='Sector', template='plotly_dark', title=f"{county} Sector Trend")
-    heat_fig = px.bar(heatmap, x='hour', y='tpm', title=f"{county} Peak Hour Heatmap", template='plotly_dark')
-    top_counties_fig = px.bar(top_counties, x='County', y='Transactions', template='plotly_dark', title="Top Counties")
-    top_sectors = sector_trend.groupby('Sector')['Transactions'].sum().sort_values(ascending=False).head(5).reset_index()
-    top_sectors_fig = px.bar(top_sectors, x='Sector', y='Transactions', text='Transactions', template='plotly_dark', title=f"Top 5 Sectors in {county}")
-    top_sectors_fig.update_traces(marker_color="#ff6f58", textposition="outside")
-
-    total_txn_val = int(df_tpm['tpm'].sum())
-    total_amt_val = int(total_txn_val * 150)
-    current_tpm_val = int(df_tpm['tpm'].iloc[-1])
-
-    avg_tpm = df_tpm['tpm'].rolling(10).mean().iloc[-1]
-    last_tpm = df_tpm['tpm'].iloc[-1]
-    diff = (last_tpm - avg_tpm) / avg_tpm * 100 if avg_tpm > 0 else 0
-    alert = "🚀 Spike!" if diff > 50 else "📉 Drop!" if diff < -50 else "✅ Stable"
-    if diff > 50 or diff < -50:
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        alert_log.append(f"{timestamp} - {county}: {alert}")
-    alert_log = alert_log[-5:]
-    alert_log_display = html.Ul([html.Li(a) for a in alert_log])
-
-    def sparkline(data, color):
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(y=data, mode='lines', line=dict(color=color, width=1)))
-        fig.update_layout(template='plotly_dark', margin=dict(l=0,r=0,t=0,b=0), height=50,
-                          xaxis=dict(visible=False), yaxis=dict(visible=False))
-        return dcc.Graph(figure=fig, style={'height':'50px'})
-
-    return (tpm_fig, payment_fig, sector_fig, top_counties_fig, top_sectors_fig, heat_fig,
-            html.Div([f"Total Txns (Last Hour): {total_txn_val:,}", sparkline(df_tpm['tpm'], '#58ff6f')]),
-            html.Div([f"Total Amount (KES): {total_amt_val:,}", sparkline(df_tpm['tpm'] * 150, '#ff6f58')]),
-            html.Div([f"Current TPM: {current_tpm_val:,}", sparkline(df_tpm['tpm'], '#ff58ff')]),
-            html.Div([alert, sparkline(df_tpm['tpm'], '#ffd658')]),
-            alert_log_display)
+@metrics.timed("dash_callback_seconds", callback="update_top_counties")
+def update_top_counties(metric, n):
+    return top_counties_figure(metric or 'transactions')
+
+# ----------------------------
+# Dashboard snapshots: computed once per county and tick, shared by all viewers
+# ----------------------------
+SNAPSHOT_TICK_SECONDS = 5  # same as the interval-update period
+# Set to a directory to share snapshots between gunicorn workers on the host
+SNAPSHOT_CACHE_DIR = os.environ.get("SNAPSHOT_CACHE_DIR")
+snapshot_cache = SnapshotCache(max_entries=256, directory=SNAPSHOT_CACHE_DIR)
+
+def stage(name):
+    return metrics.timer("dashboard_stage_seconds", stage=name)
+
+# Where dashboard updates run: "inline" (request thread, the default), "thread"
+# (abandoned when the tab switches county, at the cost of a dispatcher thread
+# per callback) or "process" (also builds figures in DASHBOARD_EXECUTOR_WORKERS
+# forked processes, off the worker's GIL). With "thread" or "process", an update
+# taking longer than DASHBOARD_EXECUTOR_TIMEOUT seconds is dropped and the tab
+# keeps its figures until the next tick.
+DASHBOARD_EXECUTOR = os.environ.get("DASHBOARD_EXECUTOR", "inline")
+callback_pool = CallbackPool(DASHBOARD_EXECUTOR, workers=int(os.environ.get("DASHBOARD_EXECUTOR_WORKERS", "2")),
+                             preload=("figures", "plotly.express"),
+                             timeout=float(os.environ.get("DASHBOARD_EXECUTOR_TIMEOUT", "30")))
+
+def county_version(county):
+    # derived from the data, so every worker holding it computes the same
+    # version and can reuse the others' snapshots from SNAPSHOT_CACHE_DIR
+    ci = COUNTY_INDEX.get(county)
+    fingerprint = live.fingerprint(ci) if ci is not None else None
+    return "%d:%d" % fingerprint if fingerprint else "0"
+
+def snapshot_version(county, window=60):
+    # what a snapshot is built from: the county's live window, the minute (the
+    # x axis of a simulated series moves with it) and, for longer windows, the
+    # newest minute in the rollups; a snapshot is reused until one changes
+    version = "%s@%d" % (county_version(county), int(time.time()) // 60)
+    if window != 60:
+        version += "+%s" % rollups.last_minute()
+    return version
+
+def build_snapshot(county, window=60):
+    """
+    Computes every figure and KPI of the dashboard for `county` over the last
+    `window` minutes. Returns them as one JSON string, the form kept in
+    snapshot_cache.
+    """
+    # transactions reach the live counters through ingest_batch (POST /ingest,
+    # ingest.py, the firehose), never from the dashboard callback
+    with stage("process_transactions"):
+        df_tpm, payment_trend, sector_trend, heatmap, top_counties = process_transactions([], county, window)
+
+    ci = COUNTY_INDEX.get(county)
+    if ci is not None and live.has_data(ci):
+        # the streaming detector has already judged the last closed minute
+        alert = detector.state(ci)['status']
+    else:
+        # simulated series: same rule on its last 10 points, not logged
+        avg_tpm = df_tpm['tpm'].iloc[-10:].mean()
+        last_tpm = df_tpm['tpm'].iloc[-1]
+        diff = (last_tpm - avg_tpm) / avg_tpm * 100 if avg_tpm > 0 else 0
+        alert = SPIKE if diff > 50 else DROP if diff < -50 else STABLE
+
+    payload, timings = callback_pool.call(render_snapshot, county, df_tpm, payment_trend, sector_trend, heatmap, alert,
+                                          RANGE_LABELS.get(window, f"Last {window} min"))
+    for name, seconds in timings:
+        metrics.observe("dashboard_stage_seconds", seconds, stage=name)
+    return payload
+
+def warm_up():
+    """
+    Imports pandas and plotly.express, builds the static pages and renders one
+    simulated dashboard and the county ranking (not cached), so plotly's
+    templates are loaded too. gunicorn.conf.py calls it in the master before
+    the workers fork.
+    """
+    for pathname in ('/', '/ai', *PAGES):
+        static_page(pathname)
+    df_tpm, payment_trend, sector_trend, heatmap, _ = process_transactions([], counties[0])
+    render_snapshot(counties[0], df_tpm, payment_trend, sector_trend, heatmap, STABLE)
+    top_counties_figure()
+
+def get_snapshot(county, window=60):
+    bucket = int(time.time() // SNAPSHOT_TICK_SECONDS)
+    key = county if window == 60 else f"{county}@{window}"
+    with stage("snapshot"):
+        payload = snapshot_cache.get_or_build(key, bucket, snapshot_version(county, window),
+                                              lambda: build_snapshot(county, window))
+    with stage("snapshot_decode"):
+        return json.loads(payload)
+
+@server.route('/cache_stats')
+def cache_stats():
+    return jsonify({"snapshots": snapshot_cache.stats(), "oauth_token": token_cache.stats(),
+                    "executor": callback_pool.stats(), "rollups": rollups.stats(),
+                    "state_file": state_file.stats(),
+                    "ingest": ingestor.stats(), "journal": journal.stats() if journal else None,
+                    "cube": cube.stats(), "firehose": firehose_feed.stats() if firehose_feed else None,
+                    "users": user_store.stats()})
+
+def component_counters():
+    # counts kept by the components themselves, exported as Prometheus counters
+    for endpoint, s in daraja_client.stats().items():
+        yield "daraja_requests_total", {"endpoint": endpoint}, s["calls"]
+        yield "daraja_errors_total", {"endpoint": endpoint}, s["errors"]
+        yield "daraja_retries_total", {"endpoint": endpoint}, s["retries"]
+    t = token_cache.stats()
+    for result in ("hits", "misses", "errors"):
+        yield "mpesa_token_cache_total", {"result": result}, t[result]
+    s = snapshot_cache.stats()
+    for result in ("hits", "misses"):
+        yield "snapshot_cache_total", {"result": result}, s[result]
+    p = callback_pool.stats()
+    yield "dashboard_requests_superseded_total", {}, p["superseded"]
+    yield "dashboard_requests_cancelled_total", {}, p["cancelled"]
+    yield "dashboard_requests_timed_out_total", {}, p["timed_out"]
+    # rows count in the worker they were posted to, the one that appends them
+    # to the journal, so the workers' counts add up to the rows received
+    yield "ingest_rows_total", {"result": "accepted"}, ingestor.accepted
+    for reason, n in ingestor.normalizer.rejected.items():
+        yield "ingest_rows_rejected_total", {"reason": reason}, n
+
+def component_gauges():
+    # every worker applies the same journal and firehose rows to its own copy of
+    # the live window (restored from the same state file), so these are per
+    # worker and the workers should agree, not add up
+    yield "live_events", {}, live.events
+    yield "live_events_dropped", {}, live.dropped
+
+metrics.add_collector(component_counters)
+metrics.add_collector(component_gauges, kind="gauge")
+metrics.describe("live_events", "gauge", "Transactions applied to this worker's live window.")
+metrics.describe("live_events_dropped", "gauge", "Transactions too old for this worker's live window.")
+
+@server.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ----------------------------
+# Push mode: server-sent events instead of per-tab interval polling
+# ----------------------------
+# DASHBOARD_PUSH=1 disables interval-update; each tab opens /stream and gets one
+# update per closed minute. Streams hold a worker thread each, so serve with e.g.
+#   gunicorn -k gthread --threads 200 denis:server
+PUSH_MODE = os.environ.get("DASHBOARD_PUSH", "0") == "1"
+
+def push_payload(channel):
+    """
+    The update sent to every tab watching (county, ranking metric, window),
+    built once per publish from the shared snapshot.
+    """
+    county, metric, window = channel
+    snap = get_snapshot(county, window)
+    return to_json_plotly({
+        'figures': snap['figures'],
+        'kpi': snap['kpi'],
+        'top_counties': top_counties_figure(metric),
+        'alerts': recent_alerts(),
+    })
+
+push_hub = PushHub(push_payload)
+live.on_minute_close.append(push_hub.notify)
+
+@server.route('/stream')
+def stream():
+    # /stream?county=Nairobi&metric=transactions&window=60
+    county = flask_request.args.get('county', 'Nairobi')
+    metric = flask_request.args.get('metric', 'transactions')
+    window = flask_request.args.get('window', '60')
+    window = int(window) if window.isdigit() else None
+    if county not in COUNTY_INDEX or metric not in RANK_LABELS or window not in RANGE_LABELS:
+        return jsonify({"error": "unknown county, metric or window"}), 400
+    return Response(push_hub.subscribe((county, metric, window)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@server.route('/stream_stats')
+def stream_stats():
+    return jsonify(push_hub.stats())
+
+# Opens (or re-opens, when the county, metric or window changes) the tab's event stream
+# and applies each update to the figures, kpi-data and alert log.
+app.clientside_callback(
+    """
+    function(county, metric, minutes, config) {
+        if (!config) {
+            return window.dash_clientside.no_update;
+        }
+        if (window.dashboardStream) {
+            window.dashboardStream.close();
+        }
+        const url = config.url + '?county=' + encodeURIComponent(county) +
+                    '&metric=' + encodeURIComponent(metric) + '&window=' + minutes;
+        const source = new EventSource(url);
+        source.onmessage = function(event) {
+            if (!document.getElementById('tpm-chart')) {
+                source.close();  // left the dashboard page
+                return;
+            }
+            const m = JSON.parse(event.data);
+            const set = window.dash_clientside.set_props;
+            const graphs = {'tpm-chart': 'tpm', 'payment-chart': 'payment', 'sector-chart': 'sector',
+                            'top-sectors-chart': 'top_sectors', 'peak-hour-heatmap': 'heatmap'};
+            for (const id in graphs) {
+                set(id, {figure: m.figures[graphs[id]]});
+            }
+            set('top-counties-chart', {figure: m.top_counties});
+            set('kpi-data', {data: m.kpi});  // RENDER_KPIS draws the cards
+            set('alert-log', {children: {
+                type: 'Ul', namespace: 'dash_html_components',
+                props: {children: m.alerts.map(a => ({type: 'Li', namespace: 'dash_html_components',
+                                                     props: {children: a}}))}}});
+        };
+        window.dashboardStream = source;
+        return {county: county, metric: metric, window: minutes};
+    }
+    """,
+    Output('push-status','data'),
+    [Input('region-dropdown','value'),
+     Input('rank-metric','value'),
+     Input('time-range','value')],
+    [State('push-config','data')]
+)
 
 # ----------------------------
 # AI assistant callbacks (preserved + ai-only converter)
@@ -521,20 +1310,11 @@ def update_dashboard(county, n):
     [State('user-question','value'),
      State('region-dropdown','value')]
 )
+@metrics.timed("dash_callback_seconds", callback="ai_assistant_on_dashboard")
 def ai_assistant_on_dashboard(n, q, county):
     if not n or not q:
         return ""
-    avg_tpm = np.random.randint(500,3000)
-    total_amount = np.random.randint(1_000_000,20_000_000)
-    last_tpm = np.random.randint(500,3000)
-    ql = q.lower()
-    if 'average' in ql:
-        return f"Average transactions per minute in {county}: {avg_tpm:,}."
-    if 'total' in ql:
-        return f"Total amount processed in {county} today: KES {total_amount:,}."
-    if 'current' in ql or 'latest' in ql:
-        return f"Current transactions per minute in {county}: {last_tpm:,}."
-    return "Try asking about average, total, or current transactions."
+    return assistant.answer(q, county)
 
 @app.callback(
     Output('ai-only-answer','children'),
@@ -542,6 +1322,7 @@ def ai_assistant_on_dashboard(n, q, county):
     State('user-question-ai-only','value'),
     State('registered-user','data')
 )
+@metrics.timed("dash_callback_seconds", callback="ai_only_convert")
 def ai_only_convert(n, text, user_data):
     if not n or not text:
         return ""
@@ -0,0 +1,185 @@
+# donations.py - durable background queue for STK push donations
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Job lifecycle:
+#   queued -> sending -> pending (waiting for the M-Pesa callback) -> completed | cancelled
+#                     -> failed (the STK push itself was rejected)
+#                     -> unknown (the worker stopped mid-send; never re-sent, see recover())
+FINAL_STATUSES = ("completed", "cancelled", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS donations (
+    id TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    merchant_request_id TEXT,
+    checkout_request_id TEXT,
+    result_code INTEGER,
+    result_desc TEXT,
+    receipt TEXT,
+    response TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS donations_status ON donations(status);
+CREATE INDEX IF NOT EXISTS donations_checkout ON donations(checkout_request_id);
+"""
+
+
+class DonationQueue:
+    """
+    Runs STK pushes on a small thread pool so Dash callbacks return at once.
+
+    Jobs live in SQLite, so a job queued by one worker survives that worker
+    restarting: `recover()` re-submits anything still queued. A job stuck in
+    "sending" for longer than `stale_after` seconds may already have reached
+    Safaricom, so it becomes "unknown" instead of being sent again (the donor
+    would get a second prompt). Callbacks are matched on the checkout request
+    id only, so an "unknown" job stays unknown. Every worker may run
+    `recover()`; a job is claimed with a conditional UPDATE, so only one worker
+    ever sends it.
+
+    `send(phone, amount)` must return a dict shaped like the result of
+    `lipa_na_mpesa_stk_push`.
+    """
+
+    def __init__(self, path, send, workers=4, stale_after=120):
+        self.path = path
+        self.send = send
+        self.workers = workers
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # SQLite connections must not cross a fork (gunicorn --preload)
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _submit(self, job_id):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="stk-push")
+            self._executor.submit(self._run, job_id)
+
+    def submit(self, phone, amount):
+        """
+        Queues an STK push and returns its job id.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT INTO donations (id, phone, amount, status, created_at, updated_at) "
+                       "VALUES (?, ?, ?, 'queued', ?, ?)", (job_id, phone, int(amount), now, now))
+        self._submit(job_id)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as db:
+            db.execute(f"UPDATE donations SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id):
+        with self._connect() as db:
+            claimed = db.execute("UPDATE donations SET status = 'sending', attempts = attempts + 1, "
+                                 "updated_at = ? WHERE id = ? AND status = 'queued'",
+                                 (time.time(), job_id)).rowcount
+            row = db.execute("SELECT phone, amount FROM donations WHERE id = ?", (job_id,)).fetchone()
+        if not claimed or row is None:
+            return
+        try:
+            res = self.send(row["phone"], row["amount"])
+        except Exception as e:
+            res = {"success": False, "error": str(e)}
+        if not res.get("success"):
+            error = res.get("error")
+            self._update(job_id, status="failed",
+                         error=error if isinstance(error, str) else json.dumps(error))
+            return
+        resp = res.get("response", {})
+        self._update(job_id, status="pending",
+                     merchant_request_id=resp.get("MerchantRequestID"),
+                     checkout_request_id=resp.get("CheckoutRequestID"),
+                     response=json.dumps(resp))
+
+    def record_callback(self, body):
+        """
+        Stores the result Safaricom posts to CALLBACK_URL.
+        Returns the job id it belonged to, or None if it matched no job.
+        """
+        try:
+            cb = body["Body"]["stkCallback"]
+            checkout_id = cb["CheckoutRequestID"]
+            result_code = int(cb.get("ResultCode", -1))
+        except (KeyError, TypeError, ValueError):
+            return None
+        items = (cb.get("CallbackMetadata") or {}).get("Item") or []
+        meta = {i.get("Name"): i.get("Value") for i in items if isinstance(i, dict)}
+        with self._connect() as db:
+            row = db.execute("SELECT id FROM donations WHERE checkout_request_id = ?",
+                             (checkout_id,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE donations SET status = ?, result_code = ?, result_desc = ?, receipt = ?, "
+                       "updated_at = ? WHERE id = ?",
+                       ("completed" if result_code == 0 else "cancelled", result_code,
+                        cb.get("ResultDesc"), meta.get("MpesaReceiptNumber"), time.time(), row["id"]))
+        return row["id"]
+
+    def status(self, job_id):
+        """
+        Returns the job as a dict, or None if the id is unknown.
+        """
+        if not job_id:
+            return None
+        row = self._connect().execute("SELECT * FROM donations WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recover(self):
+        """
+        Re-submits queued jobs left behind by a worker that stopped, and marks
+        stale "sending" jobs "unknown" rather than sending them twice. Returns
+        how many were re-submitted.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE donations SET status = 'unknown', updated_at = ? "
+                       "WHERE status = 'sending' AND updated_at < ?", (now, now - self.stale_after))
+            ids = [r["id"] for r in db.execute("SELECT id FROM donations WHERE status = 'queued' "
+                                               "ORDER BY created_at")]
+        for job_id in ids:
+            self._submit(job_id)
+        return len(ids)
+
+    def shutdown(self, wait=True):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,165 @@
+# executor.py - runs heavy callback work off the request thread, with per-tab cancellation
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+KINDS = ("inline", "thread", "process")
+
+
+class Superseded(Exception):
+    """
+    A newer request from the same tab asked for something else; drop this one.
+    """
+
+
+class _Ticket:
+    __slots__ = ("key", "future", "superseded", "done")
+
+    def __init__(self, key):
+        self.key = key
+        self.future = None
+        self.superseded = False
+        self.done = threading.Event()
+
+    def supersede(self):
+        self.superseded = True
+        self.done.set()
+        if self.future is not None:
+            self.future.cancel()  # only succeeds if it has not started yet
+
+
+class CallbackPool:
+    """
+    Execution backend for the heavy parts of Dash callbacks.
+
+    kind="inline" runs everything in the request thread, as before.
+    kind="thread" runs requests on a pool of `dispatchers` threads, so a
+    request can be abandoned while its work finishes in the background.
+    kind="process" does the same, and call() also sends the CPU-heavy function
+    to a pool of `workers` processes, so figure building no longer holds the
+    gunicorn worker's GIL while other requests wait. Functions passed to call()
+    must then be module-level functions of a module in `preload`, and their
+    arguments picklable.
+
+    run(tab, key, ...) remembers what each tab (browser page) last asked for.
+    When a newer request of the same tab arrives with a different key (the
+    tab switched county), the older one raises Superseded right away; its
+    work is cancelled if it had not started, and otherwise runs to completion
+    in the background without being returned. Pools are created on first use,
+    i.e. in the gunicorn worker, not in the master.
+
+    With `timeout` set, run() and call() of the thread and process kinds
+    raise TimeoutError after that many seconds instead of holding the request
+    until a stuck build or worker process finishes.
+    """
+
+    def __init__(self, kind="inline", workers=2, dispatchers=32, preload=("figures",), timeout=None):
+        if kind not in KINDS:
+            raise ValueError(f"executor kind must be one of {', '.join(KINDS)}")
+        self.kind = kind
+        self.workers = workers
+        self.dispatchers = dispatchers
+        self.preload = preload
+        self.timeout = timeout
+        self.superseded = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self._tabs = {}
+        self._lock = threading.Lock()
+        self._threads = None
+        self._processes = None
+
+    def _dispatch_pool(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.dispatchers,
+                                                   thread_name_prefix="callback")
+            return self._threads
+
+    def _process_pool(self):
+        with self._lock:
+            if self._processes is None:
+                # forkserver, not fork: forking a threaded gunicorn worker can copy
+                # a lock held by another thread and hang the child. The server
+                # imports `preload` once and forks the pool's children from it.
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload(list(self.preload))
+                self._processes = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            return self._processes
+
+    def call(self, fn, *args):
+        """
+        Runs fn(*args) where the heavy work belongs (a worker process for
+        kind="process", else the current thread) and returns its result.
+        """
+        if self.kind != "process":
+            return fn(*args)
+        future = None
+        try:
+            future = self._process_pool().submit(fn, *args)
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except BrokenProcessPool:
+            # a child died (e.g. OOM-killed); start a fresh pool next time
+            with self._lock:
+                self._processes = None
+            return fn(*args)
+
+    def run(self, tab, key, fn, *args):
+        """
+        Runs fn(*args) for one request of `tab` asking for `key`. Raises
+        Superseded if the tab sends a request for another key before this
+        one finishes, and TimeoutError if it does not finish in `timeout`.
+        """
+        if self.kind == "inline" or tab is None:
+            return fn(*args)
+        ticket = _Ticket(key)
+        with self._lock:
+            tickets = self._tabs.setdefault(tab, [])
+            stale = [t for t in tickets if t.key != key]
+            tickets[:] = [t for t in tickets if t.key == key] + [ticket]
+        for t in stale:
+            t.supersede()
+
+        future = self._dispatch_pool().submit(fn, *args)
+        ticket.future = future
+        future.add_done_callback(lambda f: ticket.done.set())
+        if ticket.superseded:
+            future.cancel()  # superseded before the future was attached
+        finished = ticket.done.wait(self.timeout)
+
+        with self._lock:
+            tickets = self._tabs.get(tab)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._tabs[tab]
+            if ticket.superseded:
+                self.superseded += 1
+                if future.cancelled():
+                    self.cancelled += 1
+            elif not finished:
+                self.timed_out += 1
+        if ticket.superseded:
+            raise Superseded(key)
+        if not finished:
+            future.cancel()
+            raise TimeoutError(f"{key} did not finish in {self.timeout} s")
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {"kind": self.kind, "in_flight": sum(len(t) for t in self._tabs.values()),
+                    "superseded": self.superseded, "cancelled": self.cancelled, "timed_out": self.timed_out}
+
+    def shutdown(self):
+        with self._lock:
+            pools, self._threads, self._processes = (self._threads, self._processes), None, None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,202 @@
+# fake_daraja.py - local stand-in for the Safaricom sandbox
+#
+# Implements the endpoints the dashboard talks to, so latency and throughput can
+# be measured offline:
+#   GET  /oauth/v1/generate               -> access token
+#   POST /mpesa/stkpush/v1/processrequest -> STK push accepted, callback sent later
+#   POST /mpesa_callback                  -> callback sink (GET lists received callbacks)
+#
+# Run it and point the dashboard at it:
+#   python fake_daraja.py --port 8089 --latency 150
+#   MPESA_BASE_URL=http://127.0.0.1:8089 python denis.py
+import json
+import time
+import uuid
+import random
+import argparse
+import datetime
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDarajaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0, fail_rate=0.0, callback_delay=2.0, token_ttl=3599,
+                 fail_status=503, retry_after=None):
+        super().__init__(address, FakeDarajaHandler)
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status  # status of the failed calls
+        self.retry_after = retry_after  # Retry-After seconds sent with them, if any
+        self.callback_delay = callback_delay
+        self.token_ttl = token_ttl
+        self.tokens = set()
+        self.callbacks = []
+        self.counts = {"oauth": 0, "stkpush": 0, "callback": 0, "failed": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return None
+
+    def _simulate_network(self):
+        srv = self.server
+        if srv.latency_ms:
+            time.sleep(srv.latency_ms / 1000.0)
+        if srv.fail_rate and random.random() < srv.fail_rate:
+            srv.count("failed")
+            headers = [("Retry-After", str(srv.retry_after))] if srv.retry_after is not None else []
+            self._send_json(srv.fail_status, {"errorCode": f"{srv.fail_status}.001.01",
+                                              "errorMessage": "Service Unavailable"}, headers)
+            return False
+        return True
+
+    def do_GET(self):
+        srv = self.server
+        if self.path.startswith("/oauth/v1/generate"):
+            if not self._simulate_network():
+                return
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                self._send_json(400, {"errorCode": "400.008.01", "errorMessage": "Invalid Authentication passed"})
+                return
+            token = uuid.uuid4().hex
+            with srv.lock:
+                srv.tokens.add(token)
+            srv.count("oauth")
+            self._send_json(200, {"access_token": token, "expires_in": str(srv.token_ttl)})
+        elif self.path.startswith("/mpesa_callback"):
+            with srv.lock:
+                callbacks = list(srv.callbacks)
+            self._send_json(200, callbacks)
+        else:
+            self._send_json(404, {"errorMessage": "Not Found"})
+
+    def do_POST(self):
+        srv = self.server
+        body = self._read_json()
+        if self.path.startswith("/mpesa/stkpush/v1/processrequest"):
+            if not self._simulate_network():
+                return
+            token = self.headers.get("Authorization", "")[len("Bearer "):]
+            with srv.lock:
+                valid = token in srv.tokens
+            if not valid:
+                self._send_json(401, {"errorCode": "404.001.04", "errorMessage": "Invalid Access Token"})
+                return
+            if not body or not body.get("PhoneNumber") or not body.get("Amount"):
+                self._send_json(400, {"errorCode": "400.002.02", "errorMessage": "Bad Request"})
+                return
+            srv.count("stkpush")
+            merchant_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+            checkout_id = "ws_CO_" + datetime.datetime.now().strftime("%d%m%Y%H%M%S") + uuid.uuid4().hex[:6]
+            self._send_json(200, {
+                "MerchantRequestID": merchant_id,
+                "CheckoutRequestID": checkout_id,
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing"
+            })
+            if body.get("CallBackURL"):
+                t = threading.Timer(srv.callback_delay, send_callback,
+                                    args=(body["CallBackURL"], merchant_id, checkout_id, body))
+                t.daemon = True
+                t.start()
+        elif self.path.startswith("/mpesa_callback"):
+            with srv.lock:
+                srv.callbacks.append(body)
+            srv.count("callback")
+            self._send_json(200, {"ResultCode": 0, "ResultDesc": "Accepted"})
+        else:
+            self._send_json(404, {"errorMessage": "Not Found"})
+
+
+def callback_body(merchant_id, checkout_id, request_body, result_code=0):
+    """
+    Builds the stkCallback body Safaricom posts to CallBackURL.
+    """
+    callback = {
+        "MerchantRequestID": merchant_id,
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully." if result_code == 0
+                      else "Request cancelled by user",
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": request_body.get("Amount")},
+            {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+            {"Name": "TransactionDate", "Value": int(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))},
+            {"Name": "PhoneNumber", "Value": int(request_body.get("PhoneNumber"))},
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+
+def send_callback(url, merchant_id, checkout_id, request_body):
+    data = json.dumps(callback_body(merchant_id, checkout_id, request_body)).encode()
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        urllib.request.urlopen(req, timeout=5).close()
+    except Exception:
+        pass
+
+
+def serve(host="127.0.0.1", port=0, **options):
+    """
+    Starts the fake server on a background thread and returns it.
+    Use `server.base_url` as MPESA_BASE_URL and `server.shutdown()` to stop it.
+    """
+    server = FakeDarajaServer((host, port), **options)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local fake of the Daraja sandbox")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0, help="added latency per API call, in ms")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--callback-delay", type=float, default=2.0, help="seconds before the STK callback is sent")
+    args = parser.parse_args()
+    server = FakeDarajaServer((args.host, args.port), latency_ms=args.latency, fail_rate=args.fail_rate,
+                              fail_status=args.fail_status, callback_delay=args.callback_delay)
+    print(f"Fake Daraja listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,97 @@
+# figures.py - builds the dashboard figures of a snapshot from its data frames
+import time
+import base64
+import threading
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+# Nothing here touches the app's state, so render_snapshot can run in a worker
+# process that only imports this module.
+
+# plotly express reads the shared template objects in a way that is not
+# thread-safe ("ValueError: Invalid value" under concurrent renders). Rendering
+# is pure CPU under the GIL, so serializing it costs no throughput.
+_render_lock = threading.Lock()
+
+
+class _Stages:
+    # records (stage, seconds) pairs; returned to the caller, which may be in another process
+    def __init__(self):
+        self.timings = []
+
+    def __call__(self, name):
+        self._name = name
+        return self
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings.append((self._name, time.perf_counter() - self._start))
+        return False
+
+
+def series_figure(fig):
+    """
+    Figure as a dict whose trace x/y are plain JSON lists rather than plotly's
+    base64 typed arrays, so delta updates can extend and trim them.
+    """
+    d = fig.to_plotly_json()
+    for trace in d['data']:
+        for key in ('x', 'y'):
+            if key in trace and trace[key] is not None:
+                values = trace[key]
+                if isinstance(values, dict) and 'bdata' in values:
+                    values = np.frombuffer(base64.b64decode(values['bdata']), dtype=values['dtype'])
+                values = np.asarray(values)
+                if values.dtype.kind == 'M':
+                    values = np.datetime_as_string(values, unit='s')
+                trace[key] = values.tolist()
+    return d
+
+
+def render_snapshot(county, df_tpm, payment_trend, sector_trend, heatmap, alert, range_label="Last Hour"):
+    """
+    Builds every figure and KPI of a county's dashboard from the frames of
+    process_transactions. `alert` is an alerts status (SPIKE, STABLE, DROP).
+    Returns (snapshot JSON string, [(stage, seconds)]).
+    """
+    with _render_lock:
+        return _render(county, df_tpm, payment_trend, sector_trend, heatmap, alert, range_label)
+
+
+def _render(county, df_tpm, payment_trend, sector_trend, heatmap, alert, range_label):
+    import plotly.express as px  # with pandas, most of this module's import time
+    stage = _Stages()
+    with stage("figure_tpm"):
+        tpm_fig = series_figure(px.line(df_tpm, x='datetime', y='tpm', title=f"{county} - Transactions per Minute", template='plotly_dark'))
+    with stage("figure_payment"):
+        payment_fig = series_figure(px.line(payment_trend, x='datetime', y='Transactions', color='Payment Type', template='plotly_dark', title=f"{county} Payment Type Trend"))
+    with stage("figure_sector"):
+        sector_fig = series_figure(px.area(sector_trend, x='datetime', y='Transactions', color='Sector', template='plotly_dark', title=f"{county} Sector Trend"))
+    with stage("figure_heatmap"):
+        heat_fig = px.density_heatmap(heatmap, x='hour', y='day', z='tpm', histfunc='avg', template='plotly_dark',
+                                      title=f"{county} Peak Hour Heatmap (avg TPM)",
+                                      labels={'hour': 'Hour of day', 'day': '', 'tpm': 'TPM'})
+        heat_fig.update_traces(xbins=dict(start=-0.5, end=23.5, size=1))
+    with stage("figure_top_sectors"):
+        top_sectors = sector_trend.groupby('Sector')['Transactions'].sum().sort_values(ascending=False).head(5).reset_index()
+        top_sectors_fig = px.bar(top_sectors, x='Sector', y='Transactions', text='Transactions', template='plotly_dark', title=f"Top 5 Sectors in {county}")
+        top_sectors_fig.update_traces(marker_color="#ff6f58", textposition="outside")
+
+    total_txn_val = int(round(df_tpm['txns'].sum()))
+    total_amt_val = int(df_tpm['amount'].sum())
+    current_tpm_val = int(df_tpm['tpm'].iloc[-1])
+
+    with stage("serialize"):
+        payload = to_json_plotly({
+            'county': county,
+            'figures': {'tpm': tpm_fig, 'payment': payment_fig, 'sector': sector_fig,
+                        'top_sectors': top_sectors_fig, 'heatmap': heat_fig},
+            # the cards and their sparklines are drawn in the browser from these
+            'kpi': {'total_txn': total_txn_val, 'total_amt': total_amt_val,
+                    'current_tpm': current_tpm_val, 'alert': int(alert), 'range': range_label,
+                    'tpm': df_tpm['tpm'].round(2).tolist(), 'amount': df_tpm['amount'].astype('int64').tolist()}
+        })
+    return payload, stage.timings
@@ -0,0 +1,325 @@
+# firehose.py - seedable synthetic transaction stream for capacity testing
+#
+#   python firehose.py --rate 20000 --hours 24 --out day.txb     # write a day for replay
+#   python firehose.py --rate 1000000 --seconds 10               # generator throughput
+import os
+import time
+import threading
+
+import numpy as np
+
+from columnar import TransactionBatch, write_batches
+
+# 2019 census population in millions, used as county weights. The dashboard's
+# list names some counties by their main town (Eldoret for Uasin Gishu) and
+# lists Thika and Malindi on their own; those get the town's population.
+COUNTY_POPULATION = {
+    "Nairobi": 4.40, "Mombasa": 1.21, "Kisumu": 1.16, "Nakuru": 2.16, "Eldoret": 1.16, "Thika": 0.28,
+    "Malindi": 0.33, "Meru": 1.55, "Machakos": 1.42, "Kakamega": 1.87, "Nyeri": 0.76, "Murang'a": 1.06,
+    "Embu": 0.61, "Kericho": 0.90, "Bomet": 0.88, "Narok": 1.16, "Baringo": 0.67, "Laikipia": 0.52,
+    "Bungoma": 1.67, "Busia": 0.89, "Siaya": 0.99, "Homa Bay": 1.13, "Migori": 1.12, "Kisii": 1.27,
+    "Nyamira": 0.61, "Garissa": 0.84, "Wajir": 0.78, "Mandera": 0.87, "Marsabit": 0.46, "Isiolo": 0.27,
+    "Kitui": 1.14, "Makueni": 0.99, "Taita Taveta": 0.34, "Kilifi": 1.45, "Kwale": 0.87, "Tana River": 0.32,
+    "Samburu": 0.31, "Turkana": 0.93, "West Pokot": 0.62, "Elgeyo Marakwet": 0.45, "Trans Nzoia": 0.99,
+    "Nandi": 0.89, "Vihiga": 0.59, "Tharaka Nithi": 0.39, "Lamu": 0.14, "Kajiado": 1.12, "Kiambu": 2.42,
+}
+
+SECTOR_WEIGHTS = {"Transport": 0.20, "Communication": 0.15, "Retail": 0.35, "Banking": 0.12,
+                  "Government": 0.06, "Utilities": 0.12}
+# median amount per sector in KES (log-normal around it)
+SECTOR_MEDIAN_AMOUNT = {"Transport": 80, "Communication": 60, "Retail": 150, "Banking": 1500,
+                        "Government": 800, "Utilities": 400}
+AMOUNT_SIGMA = 1.0
+MAX_AMOUNT = 150_000  # KES; the M-Pesa single-transaction limit
+
+# relative load per hour of the day, East Africa Time: quiet nights, a morning
+# ramp, a lunchtime peak and the evening commute
+DIURNAL = np.array([0.15, 0.10, 0.08, 0.07, 0.10, 0.25, 0.55, 0.85, 1.00, 1.05, 1.10, 1.20,
+                    1.30, 1.20, 1.10, 1.10, 1.20, 1.35, 1.40, 1.25, 1.00, 0.75, 0.45, 0.25])
+DIURNAL = DIURNAL / DIURNAL.mean()
+HOUR_CENTRES = np.arange(24) + 0.5  # DIURNAL[h] is the level at h:30, interpolated in between
+EAT_OFFSET = 3 * 3600
+
+
+class Event:
+    """
+    Multiplies the load of one county (or every county when `county` is None)
+    by `factor` for start <= t < end: a spike above 1, a drop below.
+    """
+    __slots__ = ("start", "end", "factor", "county")
+
+    def __init__(self, start, end, factor, county=None):
+        self.start, self.end, self.factor, self.county = start, end, factor, county
+
+    def __repr__(self):
+        return f"Event({self.start}, {self.end}, {self.factor}, county={self.county})"
+
+
+class Firehose:
+    """
+    Generates transactions as TransactionBatch columns, all draws vectorized.
+
+    The load is `rate` transactions per second on average over a day, shaped
+    by the DIURNAL curve, split across counties by `county_weights` (default:
+    population), and multiplied by the Events in `events`. Payment types
+    follow `payment_shares`; sectors follow SECTOR_WEIGHTS and set the amount
+    scale. Load, diurnal factor and events are evaluated once per batch, so
+    batches of up to a minute keep minute-level detail.
+
+    batch() draws from one numpy Generator seeded with `seed`: the same seed
+    and the same sequence of batch() calls give the same transactions.
+    seconds() draws each epoch second from its own Generator seeded with
+    (seed, second), so the same seed gives the same transactions for a second
+    however the calls split up time, in any process.
+    """
+
+    def __init__(self, counties, payment_types, sectors, rate=1000.0, seed=0,
+                 county_weights=None, payment_shares=None, events=None):
+        self.counties = list(counties)
+        self.rate = float(rate)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        if county_weights is None:
+            county_weights = [COUNTY_POPULATION.get(c, 0.5) for c in self.counties]
+        self.county_weights = _normalized(county_weights)
+        if payment_shares is None:
+            payment_shares = [0.7, 0.2, 0.1][:len(payment_types)]
+        self.payment_cdf = np.cumsum(_normalized(payment_shares))
+        self.sector_cdf = np.cumsum(_normalized([SECTOR_WEIGHTS.get(s, 0.1) for s in sectors]))
+        self.sector_log_median = np.log([SECTOR_MEDIAN_AMOUNT.get(s, 150) for s in sectors])
+        self.events = list(events or [])
+        self.generated = 0
+
+    def inject(self, start, end, factor, county=None):
+        """
+        Adds a spike (factor > 1) or drop (factor < 1) for one county name or index,
+        or for all counties.
+        """
+        if isinstance(county, str):
+            county = self.counties.index(county)
+        self.events.append(Event(start, end, factor, county))
+
+    def random_events(self, start, end, per_day=6.0, seed=None):
+        """
+        Adds seeded random spikes (x3 to x6) and drops (x0.05 to x0.3) of 5 to
+        20 minutes in random counties, `per_day` on average, between start and end.
+        """
+        rng = np.random.default_rng(seed)
+        for _ in range(rng.poisson(per_day * (end - start) / 86400)):
+            t = int(rng.uniform(start, end))
+            factor = rng.uniform(3, 6) if rng.random() < 0.5 else rng.uniform(0.05, 0.3)
+            county = int(np.searchsorted(np.cumsum(self.county_weights), rng.random()))
+            self.events.append(Event(t, t + int(rng.uniform(300, 1200)), float(factor), county))
+
+    def load(self, t):
+        """
+        Expected transactions per second for every county at epoch second `t`.
+        """
+        hour = ((t + EAT_OFFSET) % 86400) / 3600.0
+        diurnal = np.interp(hour, HOUR_CENTRES, DIURNAL, period=24)
+        lam = self.rate * diurnal * self.county_weights
+        for e in self.events:
+            if e.start <= t < e.end:
+                if e.county is None:
+                    lam = lam * e.factor
+                else:
+                    lam = lam.copy()
+                    lam[e.county] *= e.factor
+        return lam
+
+    def batch(self, start, end):
+        """
+        Transactions with start <= ts < end (epoch seconds, floats allowed),
+        sorted by time.
+        """
+        if end <= start:
+            return TransactionBatch.empty()
+        return self._draw(self.rng, start, end)
+
+    def seconds(self, start, end):
+        """
+        Transactions of the whole epoch seconds start <= t < end, sorted by
+        time, each second the same for a given seed whoever asks for it.
+        """
+        parts = [self._draw(np.random.default_rng([self.seed, t]), t, t + 1) for t in range(int(start), int(end))]
+        return TransactionBatch.concat(parts)
+
+    def _draw(self, rng, start, end):
+        lam = self.load((start + end) / 2) * (end - start)
+        n = int(rng.poisson(lam.sum()))
+
+        # whole seconds touched by the interval, weighted by their overlap with it
+        seconds = np.arange(int(np.floor(start)), int(np.ceil(end)), dtype=np.int64)
+        overlap = np.minimum(seconds + 1, end) - np.maximum(seconds, start)
+        per_second = rng.multinomial(n, overlap / overlap.sum())
+        ts = np.repeat(seconds, per_second)  # sorted without a sort
+
+        county = np.searchsorted(np.cumsum(lam / lam.sum()), rng.random(n)).astype(np.uint8)
+        payment = np.searchsorted(self.payment_cdf, rng.random(n)).astype(np.uint8)
+        sector = np.searchsorted(self.sector_cdf, rng.random(n)).astype(np.uint8)
+        amount = np.exp(self.sector_log_median[sector] + AMOUNT_SIGMA * rng.standard_normal(n))
+        amount = np.clip(amount, 1, MAX_AMOUNT).astype(np.int32)
+        self.generated += n
+        return TransactionBatch(ts, county, payment, sector, amount)
+
+    def batches(self, start, end, step=None):
+        """
+        Yields consecutive batches covering [start, end), `step` seconds each
+        (by default about a million transactions or one minute, whichever is shorter).
+        """
+        if step is None:
+            step = max(1, min(60, int(1_000_000 / max(self.rate, 1))))
+        t = start
+        while t < end:
+            yield self.batch(t, min(t + step, end))
+            t += step
+
+    def write(self, path, start, end, step=None):
+        """
+        Writes [start, end) to a .txb file (see columnar.write_batches) for
+        replay. Returns the number of transactions written.
+        """
+        return write_batches(path, self.batches(start, end, step))
+
+
+class Feed:
+    """
+    Streams a Firehose into `sink(batch)` (e.g. denis.ingest_batch) in real
+    time, one batch every `tick` seconds covering the whole seconds since the
+    last one (Firehose.seconds), on a daemon thread.
+
+    The stream starts at `origin` (default: when the Feed was created), less
+    at most `catch_up` seconds before start() (the first batch covers that
+    gap). Created in the gunicorn master with --preload, every worker shares
+    the origin and so applies exactly the same transactions, wherever its
+    own ticks fall. With `events_per_day`, each EAT day gets seeded random
+    spikes and drops (Firehose.random_events), the same in every worker; add
+    more with firehose.inject().
+
+    If generating and sinking a batch takes longer than a tick, the next batch
+    covers the longer interval, so the delivered rate is kept; `behind_s` is
+    the time the last cycle overran its tick, and `max_behind_s` the worst
+    overrun so far. A feed whose cycles keep overrunning has reached the
+    pipeline's throughput ceiling.
+    """
+
+    def __init__(self, firehose, sink, tick=1.0, origin=None, catch_up=3600, events_per_day=0.0):
+        self.firehose = firehose
+        self.sink = sink
+        self.tick = tick
+        self.origin = int(time.time() if origin is None else origin)
+        self.catch_up = catch_up
+        self.events_per_day = events_per_day
+        self._event_days = set()
+        self.batches = 0
+        self.delivered = 0
+        self.sink_seconds = 0.0
+        self.generate_seconds = 0.0
+        self.behind_s = 0.0
+        self.max_behind_s = 0.0
+        self.errors = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="firehose", daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _events(self, start, end):
+        # seeded random events for every EAT day touched by [start, end), once
+        if not self.events_per_day:
+            return
+        for day in range((start + EAT_OFFSET) // 86400, (end + EAT_OFFSET) // 86400 + 1):
+            if day not in self._event_days:
+                self._event_days.add(day)
+                self.firehose.random_events(day * 86400 - EAT_OFFSET, (day + 1) * 86400 - EAT_OFFSET,
+                                            self.events_per_day, seed=[self.firehose.seed, day])
+
+    def _run(self):
+        self.started = time.time()
+        last = max(self.origin, int(self.started) - self.catch_up)
+        while not self._stop.wait(max(0.0, self.tick - self.behind_s)):
+            now = int(time.time())
+            if now <= last:
+                continue
+            start = time.perf_counter()
+            self._events(last, now)
+            for t in range(last, now, 60):  # a minute at a time when catching up
+                t0 = time.perf_counter()
+                batch = self.firehose.seconds(t, min(t + 60, now))
+                t1 = time.perf_counter()
+                try:
+                    self.sink(batch)
+                except Exception:
+                    self.errors += 1
+                t2 = time.perf_counter()
+                self.batches += 1
+                self.delivered += len(batch)
+                self.generate_seconds += t1 - t0
+                self.sink_seconds += t2 - t1
+            last = now
+            self.behind_s = max(0.0, t2 - start - self.tick)
+            self.max_behind_s = max(self.max_behind_s, self.behind_s)
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {"target_per_s": self.firehose.rate, "delivered": self.delivered,
+                "delivered_per_s": self.delivered / elapsed if elapsed else 0.0,
+                "batches": self.batches, "errors": self.errors,
+                "generate_ms_per_batch": self.generate_seconds / max(1, self.batches) * 1000,
+                "sink_ms_per_batch": self.sink_seconds / max(1, self.batches) * 1000,
+                "behind_s": self.behind_s, "max_behind_s": self.max_behind_s}
+
+
+def _normalized(weights):
+    w = np.asarray(weights, dtype=float)
+    return w / w.sum()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Synthetic M-Pesa transaction generator")
+    parser.add_argument("--rate", type=float, default=10_000, help="transactions per second, daily average")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=float, help="epoch seconds (default: now minus the duration)")
+    parser.add_argument("--hours", type=float, default=0)
+    parser.add_argument("--seconds", type=float, default=0)
+    parser.add_argument("--events-per-day", type=float, default=6.0, help="random spikes and drops")
+    parser.add_argument("--out", help=".txb file to write; without it only the generation rate is measured")
+    args = parser.parse_args()
+
+    from constants import counties, payment_types, sectors
+    duration = args.hours * 3600 + args.seconds or 60
+    start = args.start if args.start is not None else int(time.time() - duration)
+    hose = Firehose(counties, payment_types, sectors, rate=args.rate, seed=args.seed)
+    hose.random_events(start, start + duration, args.events_per_day, seed=args.seed)
+    t = time.perf_counter()
+    if args.out:
+        n = hose.write(args.out, start, start + duration)
+    else:
+        n = sum(len(b) for b in hose.batches(start, start + duration))
+    elapsed = time.perf_counter() - t
+    print(f"{n:,} transactions in {elapsed:.2f} s ({n / elapsed:,.0f}/s), {len(hose.events)} events"
+          + (f", written to {args.out}" if args.out else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# gunicorn.conf.py - production settings for the dashboard
+#
+#   gunicorn -c gunicorn.conf.py denis:server
+#
+# The app is imported once in the master (preload_app): the dashboard state
+# saved by the previous run is restored there and one dashboard is rendered,
+# and the forked workers start with both, sharing the arrays copy-on-write.
+# Components that hold threads, locks or SQLite connections reset them in the
+# child through os.register_at_fork, and start their threads on first use.
+import os
+import time
+
+bind = os.environ.get("BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+preload_app = True
+
+
+def when_ready(server):
+    import denis
+    start = time.perf_counter()
+    denis.warm_up()
+    restored = denis.state_file.restored
+    server.log.info("dashboard warmed up in %.0f ms, state %s", (time.perf_counter() - start) * 1000,
+                    "restored: %s" % ", ".join(restored["parts"]) if restored else "not restored")
+
+
+def post_worker_init(worker):
+    # close minutes on time and apply rows posted to any worker and the
+    # firehose, even in a worker that gets no requests (it may be the one
+    # writing the rollups)
+    import denis
+    denis.live_clock.start()
+    if denis.journal:
+        denis.journal.follow()
+    if denis.firehose_feed:
+        denis.firehose_feed.start()
+
+
+def worker_exit(server, worker):
+    # save the worker's newest state on a graceful restart or deploy
+    import denis
+    denis.state_file.flush()
@@ -0,0 +1,487 @@
+# ingest.py - bulk transaction ingestion from export files and line streams
+#
+#   python ingest.py history.csv.gz exports/*.parquet     # backfill the rollups (server stopped)
+#
+# Files are read in chunks of a bounded number of rows, normalized to
+# TransactionBatch codes and applied by one background thread, so memory stays
+# within a budget whatever the file size and Dash callbacks only ever read the
+# aggregates.
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import collections
+
+import numpy as np
+
+from columnar import TransactionBatch, read_batches
+
+FIELDS = ("timestamp", "county", "payment_type", "sector", "amount")
+REJECT_REASONS = ("malformed", "timestamp", "county", "payment_type", "sector", "amount")
+MAX_AMOUNT = 10_000_000  # KES; larger amounts are data errors, not transactions
+
+# Spellings seen in exports for the dashboard's names (matched case-insensitively)
+ALIASES = {
+    "m-pesa": "Mpesa", "m pesa": "Mpesa", "mpesa": "Mpesa",
+    "airtel": "Airtel Money", "airtelmoney": "Airtel Money",
+    "bank": "Bank Transfer", "eft": "Bank Transfer", "rtgs": "Bank Transfer",
+    "uasin gishu": "Eldoret", "nairobi city": "Nairobi", "muranga": "Murang'a",
+    "elgeyo-marakwet": "Elgeyo Marakwet", "taita-taveta": "Taita Taveta",
+    "tharaka-nithi": "Tharaka Nithi", "homabay": "Homa Bay",
+}
+
+# Rough size of one row while a chunk is parsed: pandas object strings for the
+# text columns plus the parser's own buffers
+RAW_ROW_BYTES = 400
+COMPRESSION = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd", ".zip": "zip"}
+
+
+class Normalizer:
+    """
+    Turns raw columns (a DataFrame with some of FIELDS) into a TransactionBatch.
+
+    County, payment type and sector are matched to the dashboard's names after
+    stripping and case-folding, with ALIASES for common variants; each distinct
+    value is looked up once per chunk. Timestamps may be epoch seconds or
+    milliseconds, or date strings (naive ones are UTC). Rows with a value that
+    cannot be matched or parsed, or an amount outside 0..MAX_AMOUNT, are
+    dropped and counted in `rejected` by reason (the first failing field).
+    """
+
+    def __init__(self, counties, payment_types, sectors, aliases=ALIASES, default_county=None):
+        self.counties = list(counties)
+        self.default_county = default_county
+        self.lookups = {"county": self._lookup(counties, aliases),
+                        "payment_type": self._lookup(payment_types, aliases),
+                        "sector": self._lookup(sectors, aliases)}
+        self.limits = {"county": len(counties), "payment": len(payment_types), "sector": len(sectors)}
+        self.rejected = dict.fromkeys(REJECT_REASONS, 0)
+
+    @staticmethod
+    def _lookup(names, aliases):
+        lookup = {n.strip().casefold(): i for i, n in enumerate(names)}
+        for alias, name in aliases.items():
+            if name.strip().casefold() in lookup:
+                lookup.setdefault(alias.casefold(), lookup[name.strip().casefold()])
+        return lookup
+
+    @staticmethod
+    def _codes(values, lookup):
+        import pandas as pd
+        codes, uniques = pd.factorize(values)
+        mapped = np.array([lookup.get(str(u).strip().casefold(), -1) for u in uniques] + [-1], dtype=np.int64)
+        return mapped[codes]  # factorize marks missing values -1, which picks the trailing -1
+
+    @staticmethod
+    def _epoch(values):
+        import pandas as pd
+        if np.issubdtype(values.dtype, np.number):
+            numbers = values.astype(np.float64)
+            ok = ~np.isnan(numbers)
+            return np.where(numbers > 1e11, numbers // 1000, np.where(ok, numbers, 0)).astype(np.int64), ok
+        if np.issubdtype(values.dtype, np.datetime64):
+            epoch = pd.Series(pd.to_datetime(values, utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+            return epoch.fillna(0).to_numpy(dtype=np.int64), epoch.notna().to_numpy()
+        # text: exports repeat each second many times, so parse the distinct values only
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Series(uniques, dtype=object)
+        numbers = pd.to_numeric(uniques, errors="coerce").to_numpy(dtype=np.float64)
+        is_number = ~np.isnan(numbers)
+        parsed = pd.to_datetime(uniques.where(~is_number), utc=True, errors="coerce", format="ISO8601")
+        retry = (parsed.isna() & ~is_number).to_numpy()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(uniques[retry], utc=True, errors="coerce", format="mixed")
+        epoch = ((parsed - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+        epoch = np.where(is_number, np.where(numbers > 1e11, numbers // 1000, numbers), epoch)
+        epoch = np.append(epoch, np.nan)  # factorize marks missing values -1
+        epoch = epoch[codes]
+        ok = ~np.isnan(epoch)
+        return np.where(ok, epoch, 0).astype(np.int64), ok
+
+    def batch(self, frame):
+        import pandas as pd
+        n = len(frame)
+        valid = np.ones(n, dtype=bool)
+
+        def check(reason, ok):
+            bad = valid & ~ok
+            self.rejected[reason] += int(bad.sum())
+            valid[:] &= ok
+
+        if "timestamp" in frame:
+            ts, ok = self._epoch(frame["timestamp"].to_numpy())
+        else:
+            ts, ok = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool)
+        check("timestamp", ok)
+        columns = {}
+        for field in ("county", "payment_type", "sector"):
+            if field in frame:
+                values = frame[field].to_numpy()
+                if field == "county" and self.default_county is not None:
+                    values = pd.Series(values).fillna(self.default_county).to_numpy()
+            else:
+                values = np.full(n, self.default_county if field == "county" else None, dtype=object)
+            columns[field] = self._codes(values, self.lookups[field])
+            check(field, columns[field] >= 0)
+        amount = pd.to_numeric(frame["amount"], errors="coerce").to_numpy(dtype=np.float64) \
+            if "amount" in frame else np.zeros(n)
+        check("amount", (amount >= 0) & (amount <= MAX_AMOUNT))  # NaN fails both
+        return TransactionBatch(ts[valid], columns["county"][valid], columns["payment_type"][valid],
+                                columns["sector"][valid], np.round(amount[valid]), rejected=int(n - valid.sum()))
+
+    def check_codes(self, batch):
+        """
+        Drops rows of an already-coded batch (a .txb file) whose codes are out of range.
+        """
+        ok = ((batch.county < self.limits["county"]) & (batch.payment < self.limits["payment"])
+              & (batch.sector < self.limits["sector"]) & (batch.amount >= 0))
+        if ok.all():
+            return batch
+        self.rejected["malformed"] += int((~ok).sum())
+        return TransactionBatch(batch.ts[ok], batch.county[ok], batch.payment[ok], batch.sector[ok],
+                                batch.amount[ok], rejected=int((~ok).sum()))
+
+
+# ----------------------------
+# Readers: each yields DataFrames of at most chunk_rows raw rows (.txb files
+# are already coded and go through columnar.read_batches)
+# ----------------------------
+def read_csv(f, chunk_rows, compression=None):
+    import pandas as pd
+    text = {"timestamp": str, "county": str, "payment_type": str, "sector": str}
+    yield from pd.read_csv(f, chunksize=chunk_rows, usecols=lambda c: c in FIELDS, dtype=text,
+                           compression=compression, on_bad_lines="skip")
+
+
+def read_parquet(f, chunk_rows):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("reading Parquet needs pyarrow (pip install pyarrow)") from None
+    parquet = pq.ParquetFile(f)
+    columns = [c for c in FIELDS if c in parquet.schema_arrow.names]
+    for record_batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield record_batch.to_pandas()
+
+
+def read_lines(f, chunk_rows, max_delay=None, malformed=None):
+    """
+    Chunks of JSON objects, one per line, from a file or a stream (text or
+    bytes). With `max_delay`, a chunk is also yielded once its first line is
+    that many seconds old (checked as lines arrive), so a slow stream is not
+    held back until chunk_rows lines came in. Lines that are not JSON objects
+    are counted in malformed["malformed"].
+    """
+    import pandas as pd
+    rows, first = [], None
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            if malformed is not None:
+                malformed["malformed"] += 1
+            continue
+        rows.append(row)
+        if first is None:
+            first = time.monotonic()
+        if len(rows) >= chunk_rows or (max_delay is not None and time.monotonic() - first >= max_delay):
+            yield pd.DataFrame.from_records(rows)
+            rows, first = [], None
+    if rows:
+        yield pd.DataFrame.from_records(rows)
+
+
+def file_format(path):
+    """
+    (format, compression) from a file name, e.g. "day.jsonl.gz" -> ("jsonl", "gzip").
+    """
+    base, ext = os.path.splitext(path.lower())
+    compression = COMPRESSION.get(ext)
+    if compression:
+        ext = os.path.splitext(base)[1]
+    formats = {".csv": "csv", ".txt": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl",
+               ".parquet": "parquet", ".pq": "parquet", ".txb": "txb"}
+    if ext not in formats:
+        raise ValueError(f"unknown transaction file type: {path}")
+    return formats[ext], compression
+
+
+def _open_text(f, compression):
+    if compression in (None, "infer"):
+        return f
+    import gzip, bz2, lzma
+    opener = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}.get(compression)
+    if opener is None:
+        raise ValueError(f"{compression} is only supported for CSV files")
+    return opener(f)
+
+
+class Ingestor:
+    """
+    Applies transactions to `sink(batch)` (denis.ingest_batch, or the
+    journal.Journal that feeds it in every worker) on one background thread,
+    fed through a queue of at most `queue_size` normalized batches. Producers
+    block while the queue is full, so a fast reader cannot outrun aggregation
+    and memory stays bounded.
+
+    - submit(path) reads a file on its own thread (CSV, JSONL, Parquet or .txb,
+      optionally compressed) and returns immediately.
+    - ingest_file(path) does the same on the caller's thread.
+    - ingest_stream(f, fmt) reads a line-delimited JSON or CSV stream (an HTTP
+      request body, a pipe) on the caller's thread.
+
+    Chunks are sized so that about two raw chunks fit in `memory_budget`
+    bytes. A batch covering more than `max_span` seconds (history) is applied
+    in time slices of that length, so the live counters' lock is released
+    between them and dashboard reads are not held up for a whole chunk.
+    History should arrive in time order: the live counters keep one
+    window, so rows more than that older than the newest one seen are dropped
+    (counted by RollingWindow.dropped), and minutes reach the rollups as they
+    close. stats() reports rows per second overall and over the last
+    `rate_window` seconds, and each source's progress.
+    """
+
+    def __init__(self, sink, normalizer, memory_budget=256 << 20, queue_size=4, rate_window=10.0,
+                 max_span=900):
+        self.sink = sink
+        self.max_span = max_span
+        self.normalizer = normalizer
+        self.queue_size = queue_size
+        self.chunk_rows = max(1000, memory_budget // (2 * RAW_ROW_BYTES))
+        self.rate_window = rate_window
+        self.rows = 0
+        self.accepted = 0
+        self.batches = 0
+        self.errors = 0
+        self.sink_seconds = 0.0
+        self.max_sink_ms = 0.0
+        self.started = None
+        self.sources = {}
+        self._samples = collections.deque(maxlen=256)  # (time, rows applied so far)
+        self._setup()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._setup)
+
+    def _setup(self):
+        # queue, lock and threads belong to one process; a forked child starts its own
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self.started = self.started or time.time()
+                    self._thread = threading.Thread(target=self._run, name="ingest", daemon=True)
+                    self._thread.start()
+
+    def put(self, batch):
+        """
+        Queues a TransactionBatch, blocking while the queue is full.
+        """
+        self._start()
+        with self._lock:
+            self._pending += 1
+        self._queue.put(batch)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            for part in self._slices(batch):
+                start = time.perf_counter()
+                try:
+                    accepted = self.sink(part)
+                except Exception:
+                    accepted = 0
+                    self.errors += 1
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.rows += len(part)
+                    self.accepted += accepted
+                    self.batches += 1
+                    self.sink_seconds += elapsed
+                    self.max_sink_ms = max(self.max_sink_ms, elapsed * 1000)
+                    self._samples.append((time.time(), self.rows))
+            with self._lock:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.notify_all()
+
+    def _slices(self, batch):
+        if len(batch) == 0 or int(batch.ts.max()) - int(batch.ts.min()) <= self.max_span:
+            return [batch]
+        batch = batch.sorted()
+        edges = np.arange(int(batch.ts[0]) + self.max_span, int(batch.ts[-1]) + 1, self.max_span)
+        cuts = [0, *np.searchsorted(batch.ts, edges).tolist(), len(batch)]
+        return [batch[i:j] for i, j in zip(cuts, cuts[1:]) if j > i]
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued batch has been applied.
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def chunks(self, path):
+        fmt, compression = file_format(path)
+        if fmt == "txb":
+            read = 0
+            for batch in read_batches(path):
+                read += 8 + batch.nbytes
+                yield self.normalizer.check_codes(batch), read
+            return
+        with open(path, "rb") as raw:
+            if fmt == "csv":
+                reader = read_csv(raw, self.chunk_rows, compression)
+            elif fmt == "parquet":
+                reader = read_parquet(raw, self.chunk_rows)
+            else:
+                reader = read_lines(_open_text(raw, compression), self.chunk_rows, malformed=self.normalizer.rejected)
+            for frame in reader:
+                yield self.normalizer.batch(frame), raw.tell()
+
+    def ingest_file(self, path):
+        """
+        Reads and queues every row of `path`. Returns the source's progress dict.
+        """
+        source = self.sources[path] = {"format": file_format(path)[0], "bytes": os.path.getsize(path),
+                                       "read": 0, "rows": 0, "done": False, "error": None,
+                                       "started": time.time()}
+        try:
+            for batch, position in self.chunks(path):
+                source["rows"] += len(batch) + batch.rejected
+                source["read"] = position
+                self.put(batch)
+        except Exception as e:
+            source["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            source["done"] = True
+            source["seconds"] = time.time() - source["started"]
+        return source
+
+    def submit(self, path):
+        def run():
+            try:
+                self.ingest_file(path)
+            except Exception:
+                self.errors += 1
+        threading.Thread(target=run, name=f"ingest-{os.path.basename(path)}", daemon=True).start()
+
+    def ingest_stream(self, f, fmt="jsonl", max_delay=1.0):
+        """
+        Reads a line-delimited stream until it ends, queueing a chunk every
+        chunk_rows rows or `max_delay` seconds. Returns (rows, rejected).
+        """
+        reader = read_csv(f, self.chunk_rows) if fmt == "csv" else \
+            read_lines(f, self.chunk_rows, max_delay=max_delay, malformed=self.normalizer.rejected)
+        before = self.normalizer.rejected["malformed"]
+        rows = rejected = 0
+        for frame in reader:
+            batch = self.normalizer.batch(frame)
+            rows += len(frame)
+            rejected += batch.rejected
+            self.put(batch)
+        malformed = self.normalizer.rejected["malformed"] - before
+        return rows + malformed, rejected + malformed
+
+    def rate(self):
+        """
+        Rows applied per second over the last `rate_window` seconds.
+        """
+        if not self.started:
+            return 0.0
+        with self._lock:
+            samples = list(self._samples)
+            rows = self.rows
+        now = time.time()
+        cutoff = now - self.rate_window
+        before = 0
+        for t, r in samples:
+            if t >= cutoff:
+                break
+            before = r
+        return (rows - before) / max(min(self.rate_window, now - self.started), 1e-3)
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {"rows": self.rows, "accepted": self.accepted, "rejected": dict(self.normalizer.rejected),
+                "batches": self.batches, "errors": self.errors, "queued": self._queue.qsize(),
+                "chunk_rows": self.chunk_rows, "rows_per_s": self.rate(),
+                "rows_per_s_overall": self.rows / elapsed if elapsed else 0.0,
+                "sink_ms_per_batch": self.sink_seconds / max(1, self.batches) * 1000,
+                "max_sink_ms": self.max_sink_ms, "sources": self.sources}
+
+
+def main():
+    # only the ingest pipeline and the rollup store: importing denis would
+    # start the app (databases, queued STK pushes, saved state)
+    import argparse
+    import resource
+    from aggregator import RollingWindow
+    from constants import counties, payment_types, sectors
+    from rollups import RollupStore
+
+    parser = argparse.ArgumentParser(description="Backfill transaction files into the dashboard's "
+                                                 "minute/hour/day rollups")
+    parser.add_argument("paths", nargs="+", help="CSV, JSONL, Parquet or .txb files, in time order")
+    parser.add_argument("--memory-mb", type=int, default=int(os.environ.get("INGEST_MEMORY_MB", "256")),
+                        help="default: INGEST_MEMORY_MB or 256")
+    parser.add_argument("--rollup-dir", default=os.environ.get("ROLLUP_DIR", "rollups"),
+                        help="default: ROLLUP_DIR or rollups")
+    args = parser.parse_args()
+
+    rollups = RollupStore(args.rollup_dir, len(counties), len(payment_types), len(sectors))
+    if not rollups.acquire():
+        # the running server writes the rollups; history older than its newest
+        # minute could not be appended anyway
+        sys.exit(f"another process (the dashboard server?) holds {args.rollup_dir}/writer.lock; "
+                 "stop it before backfilling, or send recent transactions to POST /ingest")
+    # the rollups are append-only: minutes up to the newest one on disk are
+    # ignored, so rows in them are counted and the run fails
+    on_disk = rollups.last_minute()
+    behind = [0]
+    # minutes close in order through a window, as in the server, and go to disk
+    live = RollingWindow(len(counties), len(payment_types), len(sectors))
+    live.on_minute_close.append(rollups.add_minute)
+
+    def sink(b):
+        if on_disk is not None:
+            behind[0] += int((b.ts < on_disk + 60).sum())
+        return live.add_batch(b.ts, b.county, b.payment, b.sector, b.amount)
+
+    ingestor = Ingestor(sink, Normalizer(counties, payment_types, sectors), memory_budget=args.memory_mb << 20)
+
+    start = time.perf_counter()
+    for path in args.paths:
+        ingestor.ingest_file(path)
+        ingestor.join()
+        s = ingestor.stats()
+        print(f"{path}: {ingestor.sources[path]['rows']:,} rows, {s['rows_per_s_overall']:,.0f} rows/s so far",
+              file=sys.stderr)
+    live.advance(time.time())  # close the last minute of history
+    rollups.close()
+    s = ingestor.stats()
+    print(json.dumps({"seconds": time.perf_counter() - start, "rows": s["rows"], "accepted": s["accepted"],
+                      "rejected": s["rejected"], "dropped_out_of_order": live.dropped,
+                      "rows_per_s": s["rows_per_s_overall"], "max_sink_ms": s["max_sink_ms"],
+                      "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      "rollup_rows_written": rollups.written, "rollup_minutes_late": rollups.late,
+                      "rows_before_rollups": behind[0]}, indent=2))
+    if behind[0]:
+        stamp = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(on_disk))
+        sys.exit(f"{behind[0]:,} rows fall in or before {stamp}, the newest minute already in "
+                 f"{args.rollup_dir}, and were not written; backfill into an empty --rollup-dir")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# journal.py - transaction batches shared by every worker through append-only files
+import os
+import time
+import fcntl
+import threading
+
+import numpy as np
+
+from columnar import TransactionBatch, COLUMNS
+
+SEGMENT_SECONDS = 3600
+ROW_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+
+class Journal:
+    """
+    An append-only log of TransactionBatches that every process following it
+    applies, so rows posted to one gunicorn worker reach the live counters,
+    stats cube and alert detector of all of them, and the rollups through
+    whichever worker writes those.
+
+    append(batch) adds one record (the batch's length as int64, then its
+    columns, as in a .txb file) with a single write under an exclusive lock
+    on `append.lock`, so records of several processes never interleave.
+    follow() starts a thread that reads the complete records after this
+    process's position every `poll` seconds, at once after an append by the
+    same process, and passes each to `sink(batch)` in journal order.
+
+    The journal is a directory of segments named by the epoch hour they were
+    started in; segments older than `retention` seconds are removed when a new
+    one starts. Following starts where the journal ended when the Journal was
+    created: under gunicorn --preload that is the master's import, so every
+    worker, including one forked later to replace another, applies what was
+    appended since the master restored its state, and nothing before.
+    """
+
+    def __init__(self, directory, sink, poll=0.5, retention=86400):
+        self.directory = directory
+        self.sink = sink
+        self.poll = poll
+        self.retention = retention
+        self.appended = 0  # records appended by this process
+        self.applied = 0   # records passed to the sink by this process
+        self.rows = 0
+        self.errors = 0
+        self.lost = 0      # segments removed before this process read them to the end
+        os.makedirs(directory, exist_ok=True)
+        self.position = self._end()  # (segment, byte offset) of the next record to apply
+        self._setup()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._setup)
+
+    def _setup(self):
+        # the follower thread belongs to one process; a forked child keeps the
+        # position (its state matches it) and starts its own
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment}.txj")
+
+    def _segments(self):
+        found = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".txj" and stem.isdigit():
+                found.append(int(stem))
+        return sorted(found)
+
+    def _end(self):
+        segments = self._segments()
+        if not segments:
+            return None, 0
+        try:
+            return segments[-1], os.path.getsize(self._path(segments[-1]))
+        except OSError:
+            return segments[-1], 0
+
+    # ----------------------------
+    # Writing
+    # ----------------------------
+    def append(self, batch):
+        """
+        Adds a TransactionBatch for every follower. Returns its length, so it
+        can stand in for denis.ingest_batch as an Ingestor sink.
+        """
+        n = len(batch)
+        if n == 0:
+            return 0
+        record = np.array([n], dtype=np.int64).tobytes() + b"".join(
+            np.ascontiguousarray(getattr(batch, name), dtype=dtype).tobytes() for name, dtype in COLUMNS)
+        with open(os.path.join(self.directory, "append.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # the segment is chosen under the lock, so once a newer one exists
+            # nothing is appended to the older ones and followers can move on
+            segments = self._segments()
+            segment = int(time.time()) // SEGMENT_SECONDS
+            if segments and segments[-1] >= segment:
+                segment = segments[-1]
+            else:
+                self._expire(segments, segment)
+            fd = os.open(self._path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                view = memoryview(record)
+                try:
+                    while view:
+                        view = view[os.write(fd, view):]
+                except OSError:
+                    os.ftruncate(fd, size)  # leave no torn record for followers to stop at
+                    raise
+            finally:
+                os.close(fd)
+        self.appended += 1
+        self._wake.set()
+        return n
+
+    def _expire(self, segments, segment):
+        for old in segments:
+            if (old + 1) * SEGMENT_SECONDS <= segment * SEGMENT_SECONDS - self.retention:
+                try:
+                    os.remove(self._path(old))
+                except OSError:
+                    pass
+
+    # ----------------------------
+    # Following
+    # ----------------------------
+    def follow(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="ingest-journal", daemon=True)
+                    self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            try:
+                self.catch_up()
+            except OSError:
+                self.errors += 1
+
+    def catch_up(self):
+        """
+        Passes every complete record after this process's position to the
+        sink (the follower thread's work; callable directly when not following).
+        """
+        segments = self._segments()
+        segment, offset = self.position
+        while True:
+            if segment in segments:
+                for batch, offset in self._records(segment, offset):
+                    try:
+                        self.sink(batch)
+                    except Exception:
+                        self.errors += 1
+                    self.position = (segment, offset)
+                    self.applied += 1
+                    self.rows += len(batch)
+            # segments listed before reading this one to its end: a newer one
+            # existing then means this one was complete
+            newer = [s for s in segments if segment is None or s > segment]
+            if not newer:
+                return
+            if segment is not None and segment not in segments:
+                self.lost += 1
+            segment, offset = newer[0], 0
+            self.position = (segment, 0)
+
+    def _records(self, segment, offset):
+        # (batch, offset after it) for each complete record from `offset` on;
+        # a record still being written ends the segment for now
+        try:
+            f = open(self._path(segment), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return
+                n = int(np.frombuffer(header, dtype=np.int64)[0])
+                body = f.read(n * ROW_BYTES)
+                if len(body) < n * ROW_BYTES:
+                    return
+                columns, start = [], 0
+                for _, dtype in COLUMNS:
+                    columns.append(np.frombuffer(body, dtype=dtype, count=n, offset=start))
+                    start += n * np.dtype(dtype).itemsize
+                offset += 8 + len(body)
+                yield TransactionBatch(*columns), offset
+
+    def stats(self):
+        segments = self._segments()
+        size = 0
+        for segment in segments:
+            try:
+                size += os.path.getsize(self._path(segment))
+            except OSError:
+                pass
+        return {"following": self._thread is not None, "appended": self.appended, "applied": self.applied,
+                "rows": self.rows, "errors": self.errors, "lost": self.lost,
+                "segments": len(segments), "bytes": size}
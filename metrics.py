@@ -0,0 +1,404 @@
+# metrics.py - counters and latency histograms in Prometheus format, and a slow-request profiler
+import os
+import re
+import sys
+import json
+import glob
+import time
+import fcntl
+import threading
+import functools
+from collections import Counter
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._observe(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Counters and latency histograms of one process, rendered in the Prometheus
+    text format.
+
+    With `directory` set, every process writes its values to
+    `<directory>/metrics-<pid>.json` every `flush_every` seconds and before a
+    scrape, and render() adds up the files of all live processes, so whichever
+    gunicorn worker answers /metrics reports the whole server. The file of a
+    process that exited is added into `metrics-archive.json` and removed, so
+    counters keep counting across worker restarts and the directory does not
+    grow with them.
+
+    Collectors added with add_collector() are called at flush and render time
+    and return (name, labels, value) counter samples, for components that keep
+    their own counts (e.g. TokenCache.stats()). A collector added with
+    kind="gauge" returns values that are not this process's share of a total
+    (e.g. state every worker holds a copy of): they are exported per process
+    with a `worker` label instead of added up, and dropped when it exits.
+    """
+
+    def __init__(self, directory=None, buckets=DEFAULT_BUCKETS, flush_every=5.0):
+        self.directory = directory
+        self.buckets = tuple(buckets)
+        self.flush_every = flush_every
+        self._help = {}
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., count above, sum]
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # a forked worker starts from zero; the parent's values are in its own file
+        self._lock = threading.Lock()
+        self._counters, self._histograms = {}, {}
+        self._flusher = None
+
+    def describe(self, name, kind, text):
+        """
+        Sets the # TYPE (counter, gauge or histogram) and # HELP lines of a metric.
+        """
+        self._help[name] = (kind, text)
+
+    def add_collector(self, fn, kind="counter"):
+        self._collectors.append((fn, kind))
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._ensure_flusher()
+
+    def observe(self, name, seconds, **labels):
+        self._observe(name, tuple(sorted(labels.items())), seconds)
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        i = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            i += 1
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            h[i] += 1
+            h[-1] += seconds
+        self._ensure_flusher()
+
+    def timer(self, name, **labels):
+        """
+        Context manager that records the time spent in its block.
+        """
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    def timed(self, name, **labels):
+        """
+        Decorator recording the duration of every call of the function.
+        """
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # ----------------------------
+    # Export
+    # ----------------------------
+    def _ensure_flusher(self):
+        if self.directory and self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_every)
+            self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            counters = [[n, list(l), v] for (n, l), v in self._counters.items()]
+            histograms = [[n, list(l), list(h)] for (n, l), h in self._histograms.items()]
+        gauges = []
+        for collect, kind in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    if kind == "gauge":
+                        gauges.append([name, sorted(dict(labels, worker=str(os.getpid())).items()), value])
+                    else:
+                        counters.append([name, sorted(labels.items()), value])
+            except Exception:
+                pass
+        return {"buckets": list(self.buckets), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._snapshot(), f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _load_all(self):
+        if not self.directory:
+            return [self._snapshot()]
+        self.flush()
+        archive = os.path.join(self.directory, "metrics-archive.json")
+        snapshots, dead = [], []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            if path == archive:
+                continue
+            try:
+                pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                dead.append(path)
+                continue
+            except PermissionError:
+                pass  # alive, owned by another user
+            snap = _read(path)
+            if snap is not None:
+                snapshots.append(snap)
+        if dead:
+            self._archive(archive, dead)
+        snap = _read(archive)
+        if snap is not None:
+            snapshots.append(snap)
+        return snapshots
+
+    def _archive(self, archive, dead):
+        # adds the files of exited processes into the archive and removes them;
+        # the lock keeps two scrapes from adding the same file twice
+        with open(archive + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                dead = [path for path in dead if os.path.exists(path)]
+                snapshots = [s for s in map(_read, [archive] + dead) if s is not None]
+                counters, histograms, _ = self._combine(snapshots)  # an exited worker's gauges go with it
+                merged = {"buckets": list(self.buckets),
+                          "counters": [[n, list(l), v] for (n, l), v in counters.items()],
+                          "histograms": [[n, list(l), h] for (n, l), h in histograms.items()]}
+                tmp = f"{archive}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(merged, f)
+                os.replace(tmp, archive)
+                for path in dead:
+                    os.remove(path)
+            except OSError:
+                pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _combine(self, snapshots):
+        # sums snapshots with this instance's buckets:
+        # ({(name, labels): value}, {(name, labels): histogram}, {(name, labels): gauge value})
+        counters, histograms, gauges = {}, {}, {}
+        for snap in snapshots:
+            if snap["buckets"] != list(self.buckets):
+                continue
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, h in snap["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, v in enumerate(h):
+                    total[i] += v
+            for name, labels, value in snap.get("gauges", ()):
+                gauges[(name, tuple(map(tuple, labels)))] = value
+        return counters, histograms, gauges
+
+    def render(self):
+        """
+        All metrics of all processes in the Prometheus text exposition format.
+        """
+        counters, histograms, gauges = self._combine(self._load_all())
+
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({k[0] for k in values}):
+                self._header(lines, name, kind)
+                for (n, labels), value in sorted(values.items()):
+                    if n == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for name in sorted({k[0] for k in histograms}):
+            self._header(lines, name, "histogram")
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, h):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                cumulative += h[len(self.buckets)]
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(h[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        kind, text = self._help.get(name, (kind, None))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    def escape(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ----------------------------
+# Slow-request sampling profiler (opt-in)
+# ----------------------------
+class SlowRequestProfiler:
+    """
+    Samples the stack of every in-flight request every `interval` seconds.
+    Requests slower than `threshold` seconds get their samples written to
+    `directory` as collapsed stacks ("frame;frame;frame count" per line, the
+    input of flamegraph.pl and speedscope); samples of faster requests are
+    dropped. At most `keep` profiles are kept, oldest removed first.
+
+    The sampler thread only wakes while requests are in flight, and costs
+    nothing unless the profiler is created and installed.
+    """
+
+    def __init__(self, threshold, directory, interval=0.005, keep=200):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.written = 0
+        self._active = {}  # thread id -> Counter of stacks
+        self._lock = threading.Lock()
+        self._busy = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _sample_loop(self):
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for tid, stacks in self._active.items():
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+
+    def begin(self):
+        tid = threading.get_ident()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="slow-profiler", daemon=True)
+                self._thread.start()
+            self._active[tid] = Counter()
+            self._busy.set()
+        return tid, time.perf_counter()
+
+    def end(self, token, name):
+        """
+        Stops sampling the request started with `token`. Returns the profile
+        path if it was slow enough to be written, else None.
+        """
+        tid, start = token
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stacks = self._active.pop(tid, None)
+            if not self._active:
+                self._busy.clear()
+        if stacks is None or elapsed < self.threshold or not stacks:
+            return None
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")[:80]
+        path = os.path.join(self.directory, f"slow-{int(time.time() * 1000)}-{os.getpid()}-"
+                                            f"{int(elapsed * 1000)}ms-{safe}.folded")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError:
+            return None
+        self.written += 1
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.directory, "slow-*.folded")))
+        for path in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def install(self, flask_app):
+        """
+        Profiles every request of a Flask app. Dash callback requests are
+        named after their output, e.g. "..tpm-chart.figure...".
+        """
+        from flask import g, request
+
+        @flask_app.before_request
+        def _begin_profile():
+            g._slow_profile = self.begin()
+
+        @flask_app.teardown_request
+        def _end_profile(exc):
+            token = g.pop("_slow_profile", None)
+            if token is None:
+                return
+            name = request.path
+            if request.path.endswith("_dash-update-component"):
+                body = request.get_json(silent=True) or {}
+                name = str(body.get("output", name))
+            self.end(token, name)
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
@@ -0,0 +1,144 @@
+# push.py - server-sent events: one computed dashboard update per channel, fanned out
+import time
+import threading
+
+
+class _Channel:
+    __slots__ = ("cond", "seq", "payload", "subscribers")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.payload = None
+        self.subscribers = 0
+
+
+class PushHub:
+    """
+    Fans out dashboard updates to subscribed clients over server-sent events.
+
+    A channel is any hashable key (the dashboard uses (county, metric)). When a
+    minute closes, or at the latest on every wall-clock minute boundary, the
+    publisher thread calls build(channel) -> str once for each channel that has
+    subscribers and hands the same string to all of them. An idle subscriber is
+    a thread blocked on its channel's condition, woken only by a publish or by
+    the `heartbeat` keep-alive that detects dropped connections. A new
+    subscriber gets the channel's current payload at once (built on the spot
+    for the first subscriber of a channel) instead of waiting for the next
+    publish.
+
+    The publisher thread is started by the first subscriber, so it is created
+    in the process (gunicorn worker) that serves the streams. Every stream holds
+    a worker thread: run gunicorn with a threaded or async worker class.
+    """
+
+    def __init__(self, build, heartbeat=15.0):
+        self.build = build
+        self.heartbeat = heartbeat
+        self.published = 0
+        self.skipped = 0  # builds identical to the last payload, not sent
+        self.errors = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _join(self, channel):
+        with self._lock:
+            ch = self._channels.get(channel)
+            if ch is None:
+                ch = self._channels[channel] = _Channel()
+            ch.subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="push-publisher", daemon=True)
+                self._thread.start()
+            return ch
+
+    def _leave(self, channel):
+        with self._lock:
+            ch = self._channels[channel]
+            ch.subscribers -= 1
+            if ch.subscribers == 0:
+                del self._channels[channel]
+
+    def subscribe(self, channel):
+        """
+        Generator of SSE frames for one client: the channel's current update,
+        every update published to `channel` after that, and a comment line
+        every `heartbeat` seconds without one.
+        """
+        ch = self._join(channel)
+        try:
+            with ch.cond:
+                seq, payload = ch.seq, ch.payload
+            yield "retry: 5000\n\n"
+            if payload is None:
+                self.publish_one(channel)
+                with ch.cond:
+                    seq, payload = ch.seq, ch.payload
+            if payload is not None:
+                yield f"id: {seq}\ndata: {payload}\n\n"
+            while True:
+                with ch.cond:
+                    if ch.seq == seq:
+                        ch.cond.wait(self.heartbeat)
+                    payload = None
+                    if ch.seq != seq:
+                        seq, payload = ch.seq, ch.payload
+                if payload is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"id: {seq}\ndata: {payload}\n\n"
+        finally:
+            self._leave(channel)
+
+    def publish(self, channel, payload):
+        """
+        Sends `payload` (one line, e.g. JSON) to the subscribers of `channel`.
+        """
+        with self._lock:
+            ch = self._channels.get(channel)
+        if ch is None:
+            return False
+        with ch.cond:
+            if payload == ch.payload:
+                self.skipped += 1
+                return False
+            ch.seq += 1
+            ch.payload = payload
+            ch.cond.notify_all()
+        self.published += 1
+        return True
+
+    def notify(self, *args):
+        """
+        Asks the publisher to refresh every channel now. Safe to call from any
+        thread, and usable directly as a RollingWindow.on_minute_close callback.
+        """
+        self._wake.set()
+
+    def publish_one(self, channel):
+        try:
+            payload = self.build(channel)
+        except Exception:
+            self.errors += 1
+            return False
+        return self.publish(channel, payload)
+
+    def publish_all(self):
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            self.publish_one(channel)
+
+    def _run(self):
+        while True:
+            self._wake.wait(60 - time.time() % 60)
+            self._wake.clear()
+            self.publish_all()
+
+    def stats(self):
+        with self._lock:
+            return {"channels": len(self._channels),
+                    "subscribers": sum(ch.subscribers for ch in self._channels.values()),
+                    "published": self.published, "skipped": self.skipped, "errors": self.errors}
@@ -0,0 +1,323 @@
+# rollups.py - minute/hour/day transaction rollups in append-only memory-mapped files
+import os
+import fcntl
+import threading
+
+import numpy as np
+
+# name, bucket seconds, segment seconds (one set of files per segment),
+# default retention in seconds (None keeps everything)
+RESOLUTIONS = (
+    ("minute", 60, 86400, 2 * 86400),
+    ("hour", 3600, 30 * 86400, 120 * 86400),
+    ("day", 86400, 365 * 86400, None),
+)
+COUNT_DTYPE = np.int32
+AMOUNT_DTYPE = np.int64
+TIME_DTYPE = np.int64  # epoch seconds of the bucket start
+
+
+class _Resolution:
+    __slots__ = ("name", "seconds", "segment", "retention", "directory", "last", "open_bucket",
+                 "open_counts", "open_amounts")
+
+    def __init__(self, root, name, seconds, segment, retention):
+        self.name, self.seconds, self.segment, self.retention = name, seconds, segment, retention
+        self.directory = os.path.join(root, name)
+        self.last = None         # newest bucket on disk
+        self.open_bucket = None  # bucket being summed up (hour and day only)
+        self.open_counts = None
+        self.open_amounts = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def paths(self, segment):
+        base = os.path.join(self.directory, str(segment))
+        return base + ".time", base + ".counts", base + ".amounts"
+
+    def segments(self):
+        found = set()
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".time" and stem.isdigit():
+                found.add(int(stem))
+        return sorted(found)
+
+
+class RollupStore:
+    """
+    Transaction counts and amounts per county, payment type and sector, rolled
+    up at minute, hour and day resolution and kept on disk.
+
+    Every resolution is a directory of segments (a day of minutes, 30 days of
+    hours, a year of days). A segment is three append-only column files: bucket
+    start times (int64), counts and amounts (one (counties, payments, sectors)
+    block per bucket). Reads memory-map only the segments a range touches, so a
+    90-day chart reads 90 day rows instead of 130,000 minutes, and segments
+    past their retention are removed whole.
+
+    add_minute(minute, counts, amounts) has the signature of
+    RollingWindow.on_minute_close. It appends the minute (all-zero minutes are
+    skipped, reads fill them in) and sums it into the open hour and day, which
+    are appended once the next one starts. Reads add the minutes of the open
+    hour/day from the minute files, so any process sees them.
+
+    Only one process writes: the first to take an exclusive lock on
+    `writer.lock` in the directory. Other processes (gunicorn workers) read
+    and retry the lock on each minute, taking over if the writer exits. A new
+    writer rebuilds the open hour and day from the minute files, and a row
+    whose columns were only partly written (a crash mid-append) is cut off.
+    """
+
+    def __init__(self, directory, n_counties, n_payments, n_sectors, retention=None):
+        self.directory = directory
+        self.shape = (n_counties, n_payments, n_sectors)
+        self.cells = n_counties * n_payments * n_sectors
+        retention = retention or {}
+        os.makedirs(directory, exist_ok=True)
+        self.resolutions = [_Resolution(directory, name, seconds, segment, retention.get(name, keep))
+                            for name, seconds, segment, keep in RESOLUTIONS]
+        self.by_name = {r.name: r for r in self.resolutions}
+        self.written = 0  # rows appended, all resolutions
+        self.late = 0     # minutes older than the newest one on disk, ignored
+        self._lock = threading.Lock()
+        self._lock_file = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the writer lock belongs to the parent; a forked child competes for it anew
+        self._lock = threading.Lock()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # ----------------------------
+    # Writing
+    # ----------------------------
+    @property
+    def is_writer(self):
+        return self._lock_file is not None
+
+    def acquire(self):
+        """
+        Takes the writer lock now rather than at the first add_minute().
+        Returns False if another process holds it.
+        """
+        with self._lock:
+            return self._acquire()
+
+    def _acquire(self):
+        # caller holds self._lock
+        if self._lock_file is not None:
+            return True
+        f = open(os.path.join(self.directory, "writer.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        self._recover()
+        return True
+
+    def _recover(self):
+        for res in self.resolutions:
+            res.last = None
+            for segment in reversed(res.segments()):
+                times = self._repair(res, segment)
+                if len(times):
+                    res.last = int(times[-1])
+                    break
+        minute = self.by_name["minute"].last
+        for res in self.resolutions[1:]:
+            res.open_bucket = res.open_counts = res.open_amounts = None
+            if minute is None:
+                continue
+            bucket = minute - minute % res.seconds
+            if res.last is not None and bucket <= res.last:
+                continue  # already appended before the restart
+            times, counts, amounts = self._rows(self.by_name["minute"], bucket, minute + 60)
+            res.open_bucket = bucket
+            res.open_counts = counts.sum(axis=0, dtype=np.int64)
+            res.open_amounts = amounts.sum(axis=0, dtype=np.int64)
+
+    def _repair(self, res, segment):
+        # cuts the columns of a segment to the rows complete in all three
+        time_path, count_path, amount_path = res.paths(segment)
+        sizes = [(time_path, TIME_DTYPE().itemsize), (count_path, COUNT_DTYPE().itemsize * self.cells),
+                 (amount_path, AMOUNT_DTYPE().itemsize * self.cells)]
+        rows = min(_size(path) // width for path, width in sizes)
+        for path, width in sizes:
+            if os.path.exists(path) and _size(path) != rows * width:
+                os.truncate(path, rows * width)
+        return self._column(time_path, TIME_DTYPE, rows)
+
+    def _append(self, res, bucket, counts, amounts):
+        # caller holds self._lock; the time column goes last, so a row only
+        # counts once all of its columns are on disk
+        if res.last is not None and bucket <= res.last:
+            return
+        time_path, count_path, amount_path = res.paths(bucket // res.segment)
+        with open(count_path, "ab") as f:
+            f.write(np.ascontiguousarray(counts, dtype=COUNT_DTYPE).tobytes())
+        with open(amount_path, "ab") as f:
+            f.write(np.ascontiguousarray(amounts, dtype=AMOUNT_DTYPE).tobytes())
+        with open(time_path, "ab") as f:
+            f.write(np.array([bucket], dtype=TIME_DTYPE).tobytes())
+        if res.last is None or bucket // res.segment != res.last // res.segment:
+            self._expire(res, bucket)
+        res.last = bucket
+        self.written += 1
+
+    def _expire(self, res, now):
+        if res.retention is None:
+            return
+        for segment in res.segments():
+            if (segment + 1) * res.segment <= now - res.retention:
+                for path in res.paths(segment):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def add_minute(self, minute, counts, amounts):
+        """
+        Records one closed minute (epoch minute, (counties, payments, sectors)
+        count and amount arrays). Does nothing in a process that is not the writer.
+        """
+        ts = int(minute) * 60
+        with self._lock:
+            if not self._acquire():
+                return False
+            minutes = self.by_name["minute"]
+            if minutes.last is not None and ts <= minutes.last:
+                self.late += 1
+                return False
+            for res in self.resolutions[1:]:
+                bucket = ts - ts % res.seconds
+                if res.open_bucket is not None and res.open_bucket != bucket:
+                    self._append(res, res.open_bucket, res.open_counts, res.open_amounts)
+                    res.open_bucket = None
+                if res.open_bucket is None:
+                    res.open_bucket = bucket
+                    res.open_counts = np.zeros(self.shape, dtype=np.int64)
+                    res.open_amounts = np.zeros(self.shape, dtype=np.int64)
+                res.open_counts += counts
+                res.open_amounts += amounts
+            if counts.any() or amounts.any():
+                self._append(minutes, ts, counts, amounts)
+            else:
+                minutes.last = ts
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    # ----------------------------
+    # Reading
+    # ----------------------------
+    def _column(self, path, dtype, rows, shape=()):
+        if rows <= 0:
+            return np.zeros((0,) + shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(rows,) + shape)
+
+    def _rows(self, res, start, end, county=None):
+        """
+        The rows of `res` with start <= time < end, in time order: (times,
+        counts, amounts), restricted to one county if given.
+        """
+        shape = self.shape if county is None else self.shape[1:]
+        parts = []
+        for segment in range(start // res.segment, (end - 1) // res.segment + 1):
+            time_path, count_path, amount_path = res.paths(segment)
+            rows = _size(time_path) // TIME_DTYPE().itemsize
+            times = self._column(time_path, TIME_DTYPE, rows)
+            i, j = np.searchsorted(times, [start, end])
+            if i == j:
+                continue
+            counts = self._column(count_path, COUNT_DTYPE, rows, self.shape)
+            amounts = self._column(amount_path, AMOUNT_DTYPE, rows, self.shape)
+            if county is None:
+                parts.append((times[i:j], counts[i:j], amounts[i:j]))
+            else:
+                parts.append((times[i:j], counts[i:j, county], amounts[i:j, county]))
+        if not parts:
+            return (np.zeros(0, dtype=TIME_DTYPE), np.zeros((0,) + shape, dtype=COUNT_DTYPE),
+                    np.zeros((0,) + shape, dtype=AMOUNT_DTYPE))
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+    def resolution_for(self, step):
+        """
+        The coarsest resolution whose buckets divide `step` seconds.
+        """
+        best = self.resolutions[0]
+        for res in self.resolutions:
+            if step % res.seconds == 0:
+                best = res
+        return best
+
+    def last_minute(self):
+        """
+        Start (epoch seconds) of the newest minute on disk, or None.
+        """
+        return self._last_bucket(self.by_name["minute"])
+
+    def series(self, start, end, step, county=None):
+        """
+        Counts and amounts in `step`-second buckets for start <= t < end (epoch
+        seconds, multiples of `step`). Returns (bucket starts, counts, amounts)
+        with counts and amounts of shape (buckets, [counties,] payments,
+        sectors); buckets without data are zeros.
+
+        Reads the coarsest resolution dividing `step`; the minutes after its
+        newest complete bucket (the open hour or day) come from the minute files.
+        """
+        res = self.resolution_for(step)
+        shape = self.shape if county is None else self.shape[1:]
+        n = (end - start) // res.seconds
+        counts = np.zeros((n,) + shape, dtype=np.int64)
+        amounts = np.zeros((n,) + shape, dtype=np.int64)
+
+        times, c, a = self._rows(res, start, end, county)
+        slots = (times - start) // res.seconds
+        counts[slots] = c
+        amounts[slots] = a
+        if res.name != "minute":
+            last = self._last_bucket(res)
+            tail = start if last is None else max(start, last + res.seconds)
+            if tail < end:
+                times, c, a = self._rows(self.by_name["minute"], tail, end, county)
+                slots = (times - start) // res.seconds
+                np.add.at(counts, slots, c)
+                np.add.at(amounts, slots, a)
+
+        group = step // res.seconds
+        if group > 1:
+            counts = counts.reshape((-1, group) + shape).sum(axis=1)
+            amounts = amounts.reshape((-1, group) + shape).sum(axis=1)
+        return np.arange(start, end, step, dtype=np.int64), counts, amounts
+
+    def _last_bucket(self, res):
+        for segment in reversed(res.segments()):
+            time_path = res.paths(segment)[0]
+            rows = _size(time_path) // TIME_DTYPE().itemsize
+            if rows:
+                return int(self._column(time_path, TIME_DTYPE, rows)[-1])
+        return None
+
+    def stats(self):
+        out = {"writer": self.is_writer, "written": self.written, "late": self.late}
+        for res in self.resolutions:
+            out[res.name] = {"segments": len(res.segments()),
+                             "bytes": sum(_size(p) for s in res.segments() for p in res.paths(s))}
+        return out
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,168 @@
+# snapshots.py - shared cache of computed dashboard snapshots
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class SnapshotCache:
+    """
+    Caches one computed dashboard snapshot (a JSON string) per county.
+
+    The in-memory tier is an LRU of at most `max_entries` snapshots. If
+    `directory` is set, snapshots are also written there (one file per county)
+    so other gunicorn workers on the host can reuse them.
+
+    Each entry remembers the version of everything it was built from. It is
+    served, whatever tick bucket the request is in, until the version changes;
+    after that an entry younger than `min_age` seconds is still served, so a
+    county receiving a steady stream is rebuilt at most once per `min_age`
+    rather than on every request. The version must mean the same in every
+    worker (e.g. derived from the data, not a per-process counter) for the disk
+    tier to be shared.
+
+    The tick bucket of each request only counts ticks, for the CPU saved per
+    tick in stats().
+
+    Concurrent misses for the same key are built once; the other callers wait
+    for that result.
+    """
+
+    def __init__(self, max_entries=256, directory=None, min_age=1.0):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.min_age = min_age
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.cpu_saved = 0.0  # CPU seconds not spent rebuilding, summed over hits
+        self.cpu_spent = 0.0
+        self.ticks = 0  # distinct buckets seen
+        self.newest_bucket = None
+        self._entries = OrderedDict()  # county -> (version, created, cpu, payload)
+        self._lock = threading.Lock()
+        self._building = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _valid(self, entry, version, now):
+        return entry[0] == version or now - entry[1] < self.min_age
+
+    def _path(self, county):
+        safe = "".join(ch if ch.isalnum() else "_" for ch in county)
+        return os.path.join(self.directory, f"{safe}.snapshot")
+
+    def _read_disk(self, county):
+        try:
+            with open(self._path(county), "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                return header["version"], header["created"], header["cpu"], f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, county, entry):
+        path = self._path(county)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        header = {"version": entry[0], "created": entry[1], "cpu": entry[2]}
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(json.dumps(header) + "\n")
+                f.write(entry[3])
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _lookup(self, key, version, now):
+        # caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is not None and self._valid(entry, version, now):
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def _new_bucket(self, bucket):
+        # caller holds self._lock
+        if self.newest_bucket is None or bucket > self.newest_bucket:
+            self.newest_bucket = bucket
+            self.ticks += 1
+
+    def _store(self, key, entry):
+        # caller holds self._lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_build(self, county, bucket, version, build):
+        """
+        Returns the snapshot JSON of `county` at `version`, calling build() -> str
+        only when no valid entry exists in memory or on disk.
+        """
+        key = county
+        while True:
+            with self._lock:
+                self._new_bucket(bucket)
+                now = time.time()
+                entry = self._lookup(key, version, now)
+                if entry is not None:
+                    self.hits += 1
+                    self.cpu_saved += entry[2]
+                    return entry[3]
+                waiter = self._building.get(key)
+                if waiter is None:
+                    waiter = self._building[key] = threading.Event()
+                    break
+            waiter.wait()
+
+        try:
+            entry = self._read_disk(county) if self.directory else None
+            if entry is not None and self._valid(entry, version, time.time()):
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self.cpu_saved += entry[2]
+                    self._store(key, entry)
+                return entry[3]
+
+            cpu_start = time.process_time()
+            payload = build()
+            cpu = time.process_time() - cpu_start
+            entry = (version, time.time(), cpu, payload)
+            with self._lock:
+                self.misses += 1
+                self.cpu_spent += cpu
+                self._store(key, entry)
+            if self.directory:
+                self._write_disk(county, entry)
+            return payload
+        finally:
+            with self._lock:
+                self._building.pop(key).set()
+
+    def invalidate(self, county):
+        """
+        Drops every cached snapshot of `county`.
+        """
+        with self._lock:
+            self._entries.pop(county, None)
+        if self.directory:
+            try:
+                os.remove(self._path(county))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            ticks = max(1, self.ticks)
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "cpu_spent_s": self.cpu_spent,
+                "cpu_saved_s": self.cpu_saved,
+                "cpu_saved_per_tick_s": self.cpu_saved / ticks,
+            }
@@ -0,0 +1,24 @@
+# conftest.py - the modules live at the repository root, next to this directory
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def denis(tmp_path_factory):
+    """
+    The app, imported once with its databases and rollups in a scratch
+    directory and no M-Pesa network access.
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    os.environ.setdefault("MPESA_BASE_URL", "http://127.0.0.1:9")
+    os.environ.setdefault("DASHBOARD_STATE_FILE", "")
+    try:
+        import denis
+        yield denis
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,109 @@
+# test_aggregator.py - RollingWindow counting, wraparound, gaps and closed minutes
+import time
+
+import numpy as np
+
+from aggregator import RollingWindow, Clock, top_k
+
+M = 28_000_000  # an epoch minute
+
+
+def window(minutes=5):
+    w = RollingWindow(3, 2, 2, minutes=minutes)
+    closed = []
+    w.on_minute_close.append(lambda minute, counts, amounts: closed.append(
+        (minute, counts.sum(axis=(1, 2)).tolist(), int(amounts.sum()))))
+    return w, closed
+
+
+def test_add_and_add_batch_count_the_same():
+    a, _ = window()
+    b, _ = window()
+    events = [(M * 60 + 5, 0, 1, 0, 10), (M * 60 + 30, 2, 0, 1, 20), ((M + 1) * 60, 0, 0, 0, 30)]
+    for e in events:
+        assert a.add(*e)
+    assert b.add_batch(*map(np.array, zip(*events))) == 3
+    for w in (a, b):
+        minutes, counts, amounts = w.window(0, 2)
+        assert minutes.tolist() == [M, M + 1]
+        assert counts.sum(axis=(1, 2)).tolist() == [1, 1]
+        assert amounts.sum(axis=(1, 2)).tolist() == [10, 30]
+        assert w.events == 3
+    assert (a.counts == b.counts).all() and (a.amounts == b.amounts).all()
+
+
+def test_wraparound_clears_reused_slots():
+    w, _ = window(minutes=5)
+    for m in range(12):
+        w.add((M + m) * 60, 0, 0, 0, m)
+    minutes, counts, amounts = w.window(0)
+    assert minutes.tolist() == list(range(M + 7, M + 12))
+    assert counts.sum(axis=(1, 2)).tolist() == [1] * 5
+    assert amounts.sum(axis=(1, 2)).tolist() == [7, 8, 9, 10, 11]
+    assert int(w.counts.sum()) == 5
+
+
+def test_events_older_than_the_window_are_dropped():
+    w, _ = window(minutes=5)
+    w.add((M + 10) * 60, 0, 0, 0)
+    assert w.add((M + 6) * 60, 1, 0, 0)      # inside the window
+    assert not w.add((M + 5) * 60, 1, 0, 0)  # one minute too old
+    assert w.add_batch([(M + 3) * 60, (M + 9) * 60], [1, 1], [0, 0], [0, 0]) == 1
+    assert w.dropped == 2
+    assert w.county_totals()[0][1].tolist() == [1, 0, 0, 1, 0]
+
+
+def test_gaps_close_as_zero_minutes_in_order():
+    w, closed = window(minutes=5)
+    w.add(M * 60, 0, 0, 0, 5)
+    w.add(M * 60 + 1, 1, 0, 0, 5)
+    w.add((M + 3) * 60, 2, 0, 0, 7)
+    assert closed == [(M, [1, 1, 0], 10), (M + 1, [0, 0, 0], 0), (M + 2, [0, 0, 0], 0)]
+    w.add_batch([(M + 4) * 60, (M + 5) * 60], [0, 0], [0, 0], [0, 0], [1, 2])
+    assert closed[3:] == [(M + 3, [0, 0, 1], 7), (M + 4, [1, 0, 0], 1)]
+
+
+def test_a_long_gap_closes_at_most_a_window_of_minutes():
+    w, closed = window(minutes=5)
+    w.add(M * 60, 0, 0, 0)
+    w.advance((M + 100) * 60)
+    assert [m for m, _, _ in closed] == [M] + list(range(M + 95, M + 100))
+    assert w.head == M + 100
+    assert int(w.counts.sum()) == 0
+
+
+def test_advance_moves_a_stale_window_to_now():
+    w, closed = window(minutes=5)
+    w.add((M + 2) * 60, 0, 0, 0)
+    w.advance((M + 2) * 60 + 59)  # same minute: nothing closes
+    assert closed == [] and w.head == M + 2
+    w.advance((M + 4) * 60)
+    assert w.head == M + 4
+    assert w.window(0, 3)[1].sum(axis=(1, 2)).tolist() == [1, 0, 0]
+    assert [m for m, _, _ in closed] == [M + 2, M + 3]
+    w.advance(M * 60)  # never backwards
+    assert w.head == M + 4
+
+
+def test_clock_advances_to_the_wall_clock_minute():
+    w, closed = window(minutes=5)
+    w.add(time.time() - 180, 0, 0, 0)
+    clock = Clock(w, interval=0.01).start()
+    deadline = time.time() + 5
+    while w.head != int(time.time()) // 60 and time.time() < deadline:
+        time.sleep(0.01)
+    clock.stop()
+    assert w.head == int(time.time()) // 60
+    assert len(closed) >= 3 and clock.ticks >= 1
+
+
+
+def test_top_k_ranks_ties_by_index():
+    assert top_k([5, 1, 9, 3], 2).tolist() == [2, 0]
+    assert top_k([2, 7, 7, 1], 3).tolist() == [1, 2, 0]
+    assert top_k([7, 5, 5], 2).tolist() == [0, 1]  # a tie across the cut
+    assert top_k([4, 6], 5).tolist() == [1, 0]
+    assert top_k([4, 6], 0).tolist() == []
+    assert top_k([], 3).tolist() == []
+    values = np.r_[np.ones(100), np.full(100, 2.0)]
+    assert top_k(values, 150).tolist() == list(range(100, 200)) + list(range(50))
@@ -0,0 +1,87 @@
+# test_alerts.py - AnomalyDetector thresholds and the shared AlertLog
+import numpy as np
+import pytest
+
+from alerts import AnomalyDetector, AlertLog, SPIKE, DROP, STABLE
+
+
+def warmed_up(n_counties=3, level=100.0, minutes=10, **options):
+    alerts = []
+    detector = AnomalyDetector(n_counties, on_alert=lambda *a: alerts.append(a), **options)
+    for minute in range(minutes):
+        detector.observe(minute, np.full(n_counties, level))
+    return detector, alerts
+
+
+def test_no_alerts_during_warmup():
+    detector, alerts = warmed_up(minutes=5)
+    detector.observe(5, [1000.0, 0.0, 100.0])
+    assert alerts == []
+    assert detector.state(0)["ready"] is False
+
+
+@pytest.mark.parametrize("value, status", [(151.0, SPIKE), (150.0, STABLE), (100.0, STABLE),
+                                           (50.0, STABLE), (49.0, DROP), (0.0, DROP)])
+def test_threshold_is_percent_of_the_mean(value, status):
+    detector, alerts = warmed_up()
+    detector.observe(10, [value, 100.0, 100.0])
+    assert detector.state(0)["status"] == status
+    assert [(a[1], a[2]) for a in alerts] == ([(0, status)] if status != STABLE else [])
+
+
+def test_alert_carries_value_baseline_and_change():
+    detector, alerts = warmed_up()
+    detector.observe(10, [300.0, 100.0, 10.0])
+    assert alerts == [(10, 0, SPIKE, 300.0, 100.0, 200.0), (10, 2, DROP, 10.0, 100.0, -90.0)]
+
+
+def test_quiet_counties_are_not_judged():
+    detector, alerts = warmed_up(level=2.0, min_mean=5.0)
+    detector.observe(10, [20.0, 0.0, 2.0])
+    assert alerts == [] and detector.state(0)["status"] == STABLE
+
+
+def test_mean_starts_at_the_first_minute():
+    detector, alerts = warmed_up(level=100.0)
+    assert detector.state(0)["mean"] == 100.0 and detector.state(0)["change"] == 0.0
+
+
+def test_minutes_already_seen_are_ignored():
+    detector, alerts = warmed_up()
+    detector.observe(9, [1000.0, 1000.0, 1000.0])
+    assert alerts == [] and detector.state(0)["last"] == 100.0
+
+
+def test_dump_and_load():
+    detector, _ = warmed_up()
+    detector.observe(10, [300.0, 100.0, 100.0])
+    copy = AnomalyDetector(3)
+    copy.load(detector.dump())
+    assert copy.state(0) == detector.state(0)
+    copy.observe(10, [0.0, 0.0, 0.0])  # restored minute is not judged again
+    assert copy.state(0)["status"] == SPIKE
+    with pytest.raises(ValueError):
+        AnomalyDetector(4).load(detector.dump())
+
+
+def test_each_alert_is_stored_once_by_all_workers(tmp_path):
+    path = str(tmp_path / "alerts.db")
+    first, second = AlertLog(path), AlertLog(path)  # two workers detecting the same minutes
+    for log in (first, second):
+        log.add(100, "Nairobi", SPIKE, 300.0, 100.0, 200.0)
+        log.add(100, "Nairobi", DROP, 10.0, 100.0, -90.0)
+        log.add(101, "Mombasa", DROP, 10.0, 100.0, -90.0)
+    rows = first.query()
+    assert [(r["minute"], r["county"], r["kind"]) for r in rows] == \
+        [(101, "Mombasa", DROP), (100, "Nairobi", DROP), (100, "Nairobi", SPIKE)]
+    assert rows[2]["change"] == 200.0
+    assert [r["minute"] for r in second.query(county="Nairobi", start=100, end=101)] == [100, 100]
+    assert second.query(start=101) == second.query(county="Mombasa")
+    assert len(second.query(limit=1)) == 1
+
+
+def test_log_is_trimmed_to_max_rows(tmp_path):
+    log = AlertLog(str(tmp_path / "alerts.db"), max_rows=5, prune_every=10)
+    for minute in range(20):
+        log.add(minute, "Nairobi", SPIKE)
+    assert [r["minute"] for r in log.query(limit=100)] == [19, 18, 17, 16, 15]
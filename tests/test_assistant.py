@@ -0,0 +1,85 @@
+# test_assistant.py - question parsing and answers from a small stats cube
+import pytest
+
+from assistant import Assistant, HELP
+from columnar import TransactionBatch
+from constants import counties, payment_types, sectors
+from cube import StatsCube
+
+HOUR = 1_700_000_000 // 3600 * 3600  # 01:00 East Africa Time
+NOW = HOUR + 30 * 60 + 30
+NAIROBI, MOMBASA, HOMA_BAY = 0, 1, counties.index("Homa Bay")
+
+
+@pytest.fixture
+def assistant():
+    cube = StatsCube(len(counties), len(payment_types), len(sectors))
+    # Nairobi: Mpesa/Transport, KES 100..400 in minutes 1, 2, 3 and 29
+    # Mombasa: Airtel Money/Retail, KES 500 twice in minutes 5 and 6
+    ts = [HOUR + m * 60 + 10 for m in (1, 2, 3, 29, 5, 6)]
+    cube.add_batch(TransactionBatch(ts, [NAIROBI] * 4 + [MOMBASA] * 2, [0] * 4 + [1] * 2, [0] * 4 + [2] * 2,
+                                    [100, 200, 300, 400, 500, 500]))
+    return Assistant(cube, counties, payment_types, sectors)
+
+
+def test_total(assistant):
+    assert assistant.answer("total in Nairobi today", now=NOW) == \
+        "Total transactions in Nairobi today: 4 worth KES 1,000."
+
+
+def test_dashboard_county_is_the_default(assistant):
+    assert assistant.answer("How many today?", county="Mombasa", now=NOW) == \
+        "Total transactions in Mombasa today: 2 worth KES 1,000."
+
+
+def test_average_per_minute_and_per_transaction(assistant):
+    # this hour so far is 31 minutes, the one in progress included
+    assert assistant.answer("average in nairobi this hour", now=NOW) == \
+        "Average in Nairobi this hour: 0 transactions per minute, KES 250 per transaction."
+
+
+def test_payment_type_and_whole_country(assistant):
+    assert assistant.answer("largest Airtel Money transaction in Kenya today", now=NOW) == \
+        "Largest Airtel Money transaction in Kenya today: KES 500."
+
+
+def test_sector(assistant):
+    assert assistant.answer("total retail in mombasa today", now=NOW) == \
+        "Total retail transactions in Mombasa today: 2 worth KES 1,000."
+
+
+def test_current_is_the_last_complete_minute(assistant):
+    assert assistant.answer("current transactions in Nairobi", now=NOW) == \
+        "Current transactions per minute in Nairobi: 1."
+
+
+def test_compare(assistant):
+    assert assistant.answer("Nairobi vs Mombasa this hour", now=NOW) == (
+        "This hour — Nairobi: 4 transactions, KES 1,000, avg KES 250; "
+        "Mombasa: 2 transactions, KES 1,000, avg KES 500. Nairobi has 2.0x the transactions of Mombasa.")
+
+
+def test_compare_needs_two_counties(assistant):
+    assert assistant.answer("compare Nairobi", now=NOW) == \
+        "Name two counties to compare, e.g. \"Nairobi vs Mombasa this hour\"."
+
+
+def test_no_metric_gets_help(assistant):
+    assert assistant.answer("hello there", now=NOW) == HELP
+
+
+def test_no_data(assistant):
+    assert assistant.answer("total in Homa Bay today", now=NOW) == "No transactions recorded in Homa Bay today."
+
+
+def test_longest_county_name_wins(assistant):
+    assert assistant._find("county", "homa bay vs nairobi") == [HOMA_BAY, NAIROBI]
+
+
+def test_time_ranges(assistant):
+    midnight = HOUR - 3600  # 00:00 EAT
+    assert assistant.time_range("in the last 15 minutes", "today", NOW) == (NOW - 900, NOW, "in the last 15 minutes")
+    assert assistant.time_range("past 1 hr", "today", NOW) == (NOW - 3600, NOW, "in the last 1 hour")
+    assert assistant.time_range("yesterday", "today", NOW) == (midnight - 86400, midnight, "yesterday")
+    assert assistant.time_range("anything", "today", NOW) == (midnight, NOW, "today")
+    assert assistant.time_range("this hour", "today", NOW) == (HOUR, NOW, "this hour")
@@ -0,0 +1,96 @@
+# test_columnar.py - TransactionBatch construction, slicing and .txb files
+import numpy as np
+import pytest
+
+from columnar import TransactionBatch, write_batches, read_batches, to_epoch
+
+COUNTIES = {"Nairobi": 0, "Mombasa": 1}
+PAYMENTS = {"M-Pesa": 0, "Card": 1}
+SECTORS = {"Retail": 0, "Transport": 1}
+
+
+def batch(ts, county=0, amount=100):
+    n = len(ts)
+    return TransactionBatch(ts, [county] * n, [0] * n, [1] * n, [amount] * n)
+
+
+def columns(b):
+    return [getattr(b, name).tolist() for name in ("ts", "county", "payment", "sector", "amount")]
+
+
+def test_from_records_codes_and_rejects():
+    records = [
+        {"timestamp": "2024-03-01T08:00:05", "county": "Mombasa", "payment_type": "Card",
+         "sector": "Retail", "amount": "250"},
+        {"timestamp": 1709280000, "payment_type": "M-Pesa", "sector": "Transport", "amount": 40},  # default county
+        {"timestamp": 1709280000, "county": "Atlantis", "payment_type": "Card", "sector": "Retail", "amount": 1},
+        {"county": "Nairobi", "payment_type": "Card", "sector": "Retail", "amount": 1},
+        {"timestamp": 1709280000, "county": "Nairobi", "payment_type": "Card", "sector": "Retail", "amount": "x"},
+    ]
+    b = TransactionBatch.from_records(records, COUNTIES, PAYMENTS, SECTORS, default_county="Nairobi")
+    assert columns(b) == [[to_epoch("2024-03-01T08:00:05"), 1709280000], [1, 0], [1, 0], [0, 1], [250, 40]]
+    assert b.rejected == 3
+    assert b.ts.dtype == np.int64 and b.county.dtype == np.uint8 and b.amount.dtype == np.int32
+    assert b.nbytes == 2 * 15
+
+
+def test_columns_must_have_the_same_length():
+    with pytest.raises(ValueError):
+        TransactionBatch([1, 2], [0], [0, 0], [0, 0], [1, 1])
+
+
+def test_concat_keeps_order_and_rejected():
+    first, second = batch([1, 2]), batch([3], county=1)
+    first.rejected, second.rejected = 2, 1
+    b = TransactionBatch.concat([first, TransactionBatch.empty(), second])
+    assert columns(b) == [[1, 2, 3], [0, 0, 1], [0, 0, 0], [1, 1, 1], [100, 100, 100]]
+    assert b.rejected == 3
+    assert len(TransactionBatch.concat([])) == 0
+
+
+def test_slices_are_views():
+    b = batch([10, 20, 30, 40, 50])
+    part = b[1:3]
+    assert columns(part)[0] == [20, 30]
+    assert np.shares_memory(part.ts, b.ts) and np.shares_memory(part.amount, b.amount)
+    assert columns(b.between(20, 40))[0] == [20, 30]
+    assert len(b.between(60, 70)) == 0
+    with pytest.raises(TypeError):
+        b[0]
+
+
+def test_sorted_is_stable():
+    b = TransactionBatch([30, 10, 30, 20], [0, 1, 2, 3], [0, 0, 0, 0], [0, 0, 0, 0], [1, 2, 3, 4])
+    assert not b.is_sorted()
+    s = b.sorted()
+    assert columns(s)[0] == [10, 20, 30, 30] and columns(s)[1] == [1, 3, 0, 2]
+    assert s.sorted() is s
+
+
+def test_batch_file_round_trip(tmp_path):
+    path = str(tmp_path / "day.txb")
+    batches = [batch([1, 2, 3]), TransactionBatch.empty(), batch([4], county=1, amount=2**31 - 1)]
+    assert write_batches(path, batches) == 4
+    read = list(read_batches(path))
+    assert [len(b) for b in read] == [3, 0, 1]
+    for original, copy in zip(batches, read):
+        assert columns(copy) == columns(original)
+
+
+def test_batch_file_errors(tmp_path):
+    path = tmp_path / "bad.txb"
+    path.write_bytes(b"CSV!")
+    with pytest.raises(ValueError):
+        list(read_batches(str(path)))
+    write_batches(str(path), [batch([1, 2, 3])])
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ValueError):
+        list(read_batches(str(path)))
+
+
+def test_to_pandas():
+    b = batch([1709280000, 1709280060], county=1)
+    df = b.to_pandas(list(COUNTIES), list(PAYMENTS), list(SECTORS))
+    assert df["county"].tolist() == ["Mombasa", "Mombasa"]
+    assert df["sector"].tolist() == ["Transport", "Transport"]
+    assert str(df["timestamp"].iloc[1]) == "2024-03-01 08:01:00"
@@ -0,0 +1,118 @@
+# test_cube.py - StatsCube range cover, queries and percentiles
+import numpy as np
+import pytest
+
+from columnar import TransactionBatch
+from cube import StatsCube, N_BINS, _percentile
+
+HOUR = 1_700_000_000 // 3600 * 3600  # not an EAT midnight
+MINUTE = 60
+
+
+def cube_with_minutes(minutes, amount=100):
+    """
+    A 2-county cube with one transaction of `amount` in county 0 at second 5
+    of each of `minutes` after HOUR.
+    """
+    cube = StatsCube(2, 1, 1)
+    ts = [HOUR + m * MINUTE + 5 for m in minutes]
+    n = len(ts)
+    cube.add_batch(TransactionBatch(ts, [0] * n, [0] * n, [0] * n, [amount] * n))
+    return cube
+
+
+def relative(cube, parts):
+    # {level name: bucket numbers counted from the bucket holding HOUR}
+    return {level.name: [b - level.bucket(HOUR) for b in buckets] for level, buckets in parts.items()}
+
+
+def test_cover_rounds_edges_out_to_whole_minutes():
+    cube = cube_with_minutes(range(151))
+    parts, covered = cube.cover(HOUR + 95 * MINUTE + 20, HOUR + 130 * MINUTE + 10)
+    assert relative(cube, parts) == {"minute": list(range(95, 131)), "hour": [], "day": []}
+    assert covered == (HOUR + 95 * MINUTE, HOUR + 131 * MINUTE)
+
+
+def test_cover_counts_the_open_bucket_whole():
+    # newest data is in minute 150: hour 2 is still filling up
+    cube = cube_with_minutes(range(151))
+    parts, covered = cube.cover(HOUR + 100 * MINUTE, HOUR + 160 * MINUTE)
+    assert relative(cube, parts) == {"minute": list(range(100, 120)), "hour": [2], "day": []}
+    assert covered == (HOUR + 100 * MINUTE, HOUR + 160 * MINUTE)
+    assert cube.query(HOUR + 100 * MINUTE, HOUR + 160 * MINUTE, 0)["count"] == 51
+
+
+def test_cover_moves_edges_older_than_the_minute_ring_to_hours():
+    # the minute ring holds minutes 91..150; both edges fall before that
+    cube = cube_with_minutes(range(151))
+    parts, covered = cube.cover(HOUR + 30 * MINUTE, HOUR + 110 * MINUTE)
+    assert relative(cube, parts) == {"minute": [], "hour": [0, 1], "day": []}
+    assert covered == (HOUR, HOUR + 120 * MINUTE)
+    assert cube.query(HOUR + 30 * MINUTE, HOUR + 110 * MINUTE, 0)["count"] == 120
+
+
+def test_cover_uses_no_minutes_when_the_range_reaches_the_newest_data():
+    cube = cube_with_minutes([0, 1, 2])
+    parts, covered = cube.cover(HOUR, HOUR + 5 * MINUTE)
+    assert relative(cube, parts) == {"minute": [], "hour": [0], "day": []}
+    assert covered == (HOUR, HOUR + 5 * MINUTE)
+
+
+def test_query_statistics():
+    cube = StatsCube(2, 2, 1)
+    ts = [HOUR + 10, HOUR + 20, HOUR + 70, HOUR + 80]
+    cube.add_batch(TransactionBatch(ts, [0, 0, 0, 1], [0, 1, 0, 0], [0, 0, 0, 0], [10, 30, 50, 1000]))
+    r = cube.query(HOUR, HOUR + 2 * MINUTE, 0)
+    assert (r["count"], r["sum"], r["min"], r["max"], r["mean"]) == (3, 90, 10, 50, 30.0)
+    r = cube.query(HOUR, HOUR + 2 * MINUTE, 0, payment=1)
+    assert (r["count"], r["sum"], r["min"], r["max"]) == (1, 30, 30, 30)
+    r = cube.query(HOUR, HOUR + 2 * MINUTE)
+    assert (r["count"], r["sum"], r["max"]) == (4, 1090, 1000)
+    r = cube.query(HOUR, HOUR + 2 * MINUTE, 1, payment=1)
+    assert (r["count"], r["min"], r["mean"], r["p50"]) == (0, None, None, None)
+
+
+def test_percentile_of_one_amount_is_exact():
+    cube = cube_with_minutes(range(10), amount=250)
+    r = cube.query(HOUR, HOUR + 10 * MINUTE, 0, percentiles=(1, 50, 99))
+    assert (r["p1"], r["p50"], r["p99"]) == (250.0, 250.0, 250.0)
+
+
+def test_percentile_interpolates_inside_the_bin():
+    hist = np.zeros(N_BINS, dtype=np.int64)
+    hist[7] = 1   # [10, 14.68) KES
+    hist[19] = 1  # [1000, 1468) KES
+    # the median is the whole first bin: its upper edge
+    assert _percentile(hist, 50, 10, 1000) == pytest.approx(10 ** (7 / 6))
+    # a quarter is half of it, geometrically
+    assert _percentile(hist, 25, 10, 1000) == pytest.approx(10 ** (13 / 12))
+    # never outside the exact min and max
+    assert _percentile(hist, 100, 10, 1000) == 1000.0
+    assert _percentile(hist, 0, 10, 1000) == 10.0
+
+
+def test_percentile_of_amounts_below_one_kes():
+    hist = np.zeros(N_BINS, dtype=np.int64)
+    hist[0] = 4
+    assert _percentile(hist, 50, 0, 0) == 0.0
+
+
+def test_dump_and_load_keep_the_newest_timestamp():
+    cube = cube_with_minutes(range(151))
+    cube.add_batch(TransactionBatch([HOUR - 1000 * 86400], [0], [0], [0], [100]))  # too old for every ring
+    state = cube.dump()
+    restored = StatsCube(2, 1, 1)
+    restored.load(state)
+    assert restored.newest_ts == cube.newest_ts
+    assert (restored.stats()["added"], restored.stats()["late"]) == (152, 1)
+    # a range ending before the newest data is not taken as open-ended
+    closed = (HOUR + 30 * MINUTE, HOUR + 110 * MINUTE)
+    assert restored.cover(*closed)[1] == cube.cover(*closed)[1] == (HOUR, HOUR + 120 * MINUTE)
+    assert restored.query(*closed, 0) == cube.query(*closed, 0)
+
+    # a state saved before newest_ts was: the end of the newest minute held
+    legacy = StatsCube(2, 1, 1)
+    legacy.load({k: v for k, v in state.items() if k not in ("newest_ts", "added", "late")})
+    assert legacy.newest_ts == HOUR + 151 * MINUTE - 1
+    (parts, covered), (expected, expected_covered) = legacy.cover(*closed), cube.cover(*closed)
+    assert (relative(legacy, parts), covered) == (relative(cube, expected), expected_covered)
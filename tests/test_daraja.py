@@ -0,0 +1,118 @@
+# test_daraja.py - Daraja client retries and the shared token cache against fake_daraja
+import os
+import time
+import threading
+
+import pytest
+
+import fake_daraja
+from daraja import DarajaClient, TokenCache
+
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def start(**options):
+        server = fake_daraja.serve(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def client(server):
+    return DarajaClient(server.base_url, "key", "secret", backoff=0, jitter=0)
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_stk_push_is_not_retried_after_a_server_error(fake, status):
+    # Safaricom may have prompted the donor already: a second POST could charge twice
+    server = fake(fail_rate=1.0, fail_status=status)
+    c = client(server)
+    assert c.stk_push("token", {"PhoneNumber": "254700000000", "Amount": 10}).status_code == status
+    assert server.counts["failed"] == 1
+    assert c.stats()["stkpush"] == {"calls": 1, "errors": 1, "retries": 0}
+
+
+def test_stk_push_is_retried_when_turned_away_with_retry_after(fake):
+    server = fake(fail_rate=1.0, fail_status=503, retry_after=0)
+    c = client(server)
+    assert c.stk_push("token", {"PhoneNumber": "254700000000", "Amount": 10}).status_code == 503
+    assert server.counts["failed"] == 4  # the first try and 3 retries
+    assert c.stats()["stkpush"]["retries"] == 3
+
+
+def test_token_request_is_retried_after_a_server_error(fake):
+    server = fake(fail_rate=1.0, fail_status=504)
+    c = client(server)
+    with pytest.raises(Exception):
+        c.fetch_token()
+    assert server.counts["failed"] == 4
+
+
+
+def test_token_file_is_shared_between_caches(fake, tmp_path):
+    server = fake()
+    path = str(tmp_path / "token.json")
+    first = TokenCache(client(server).fetch_token, path, owner=server.base_url)
+    second = TokenCache(client(server).fetch_token, path, owner=server.base_url)
+    token = first.get()
+    assert token in server.tokens
+    assert second.get() == token
+    assert server.counts["oauth"] == 1
+    assert (first.stats()["misses"], second.stats()["hits"]) == (1, 1)
+    # another owner (e.g. the sandbox) does not reuse it
+    other = TokenCache(client(server).fetch_token, path, owner="https://sandbox.safaricom.co.ke")
+    assert other.get() != token
+    assert server.counts["oauth"] == 2
+
+
+def test_token_is_refreshed_when_it_expires(fake, tmp_path):
+    server = fake(token_ttl=1)
+    cache = TokenCache(client(server).fetch_token, str(tmp_path / "token.json"), refresh_margin=0)
+    token = cache.get()
+    assert cache.get() == token
+    time.sleep(1.1)
+    assert cache.get() not in (None, token)
+    assert server.counts["oauth"] == 2
+
+
+def test_one_refresh_for_concurrent_workers(fake, tmp_path):
+    # a cache per thread, like one per gunicorn worker: only the flock is shared
+    server = fake(latency_ms=50)
+    path = str(tmp_path / "token.json")
+    caches = [TokenCache(client(server).fetch_token, path) for _ in range(8)]
+    tokens = [None] * len(caches)
+    start = threading.Barrier(len(caches))
+
+    def get(i):
+        start.wait()
+        tokens[i] = caches[i].get()
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(len(caches))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert server.counts["oauth"] == 1
+    assert tokens[0] is not None and set(tokens) == {tokens[0]}
+
+
+def test_invalidate_keeps_a_token_refreshed_by_another_worker(fake, tmp_path):
+    server = fake()
+    path = str(tmp_path / "token.json")
+    first = TokenCache(client(server).fetch_token, path)
+    second = TokenCache(client(server).fetch_token, path)
+    rejected = first.get()
+    assert second.get() == rejected
+    second.invalidate()
+    assert not os.path.exists(path)
+    refreshed = second.get()
+    first.invalidate()  # the same 401, seen later: the file holds the new token now
+    assert os.path.exists(path)
+    assert first.get() == refreshed
+    assert server.counts["oauth"] == 2
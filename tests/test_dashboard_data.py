@@ -0,0 +1,13 @@
+# test_dashboard_data.py - the frames behind the charts and KPI cards
+import pytest
+
+
+@pytest.mark.parametrize("window", [60, 1440, 10080])
+def test_simulated_amount_is_txns_times_the_average(denis, window):
+    # a county without data gets simulated counts, and amounts from them
+    df_tpm = denis.process_transactions([], "Atlantis", window)[0]
+    b = denis.bucket_minutes(window)
+    assert (window > 60) == (b > 1)
+    assert (df_tpm['txns'] == df_tpm['tpm'] * b).all()
+    assert (df_tpm['amount'] == df_tpm['txns'] * denis.AVG_TXN_AMOUNT).all()
+    assert df_tpm['amount'].sum() / df_tpm['txns'].sum() == denis.AVG_TXN_AMOUNT
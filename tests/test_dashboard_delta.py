@@ -0,0 +1,128 @@
+# test_dashboard_delta.py - delta patches rebuild exactly the figures a full update sends
+import json
+
+import numpy as np
+import pytest
+
+
+def resolve(obj, path):
+    for key in path:
+        obj = obj[key]
+    return obj
+
+
+def apply_patch(value, patch):
+    # the subset of dash-renderer's patch operations used by dashboard_delta
+    value = json.loads(json.dumps(value))
+    for op in patch.to_plotly_json()["operations"]:
+        loc, params = op["location"], op["params"]
+        if op["operation"] == "Assign":
+            if not loc:
+                value = params["value"]
+            else:
+                resolve(value, loc[:-1])[loc[-1]] = params["value"]
+        elif op["operation"] == "Extend":
+            resolve(value, loc).extend(params["value"])
+        elif op["operation"] == "Delete":
+            del resolve(value, loc[:-1])[loc[-1]]
+        else:
+            raise ValueError(op["operation"])
+    return value
+
+
+def snapshot(denis, first, length, last=0.0):
+    """
+    A dashboard snapshot of minutes first..first+length-1: two traces per
+    series figure, the bar figures and the KPI series. `last` is added to the
+    newest point of every series, as when the open minute fills up.
+    """
+    x = [f"minute {m}" for m in range(first, first + length)]
+
+    def series(k):
+        values = [float(m * k) for m in range(first, first + length)]
+        values[-1] += last
+        return values
+
+    figures = {name: {"data": [{"x": x, "y": series(i + 1)}, {"x": x, "y": series(i + 10)}], "layout": {}}
+               for i, name in enumerate(denis.SERIES_FIGURES)}
+    figures["top_sectors"] = {"data": [{"x": ["Retail", "Banking"], "y": [first + last, 2 * first],
+                                        "text": [str(first), str(2 * first)]}], "layout": {}}
+    figures["heatmap"] = {"data": [{"x": [0, 1], "y": ["Mon"], "z": [[first, last]]}], "layout": {}}
+    kpi = {"tpm": series(1), "amount": series(100), "total_txn": first * 10 + last, "alert": "stable"}
+    return {"figures": figures, "kpi": kpi}
+
+
+def outputs(denis, snap):
+    return [snap["figures"][name] for name in denis.SERIES_FIGURES + denis.BAR_FIGURES] + [snap["kpi"]]
+
+
+def patched(denis, old, new):
+    x = old["figures"]["tpm"]["data"][0]["x"]
+    delta = denis.dashboard_delta(new, {"last_x": x[-1], "n": len(x)})
+    assert delta is not None
+    return [apply_patch(value, patch) for value, patch in zip(outputs(denis, old), delta)]
+
+
+def test_same_minute_only_moves_the_last_point(denis):
+    old, new = snapshot(denis, 0, 10), snapshot(denis, 0, 10, last=2.5)
+    assert patched(denis, old, new) == outputs(denis, new)
+    delta = denis.dashboard_delta(new, {"last_x": "minute 9", "n": 10})
+    operations = delta[0].to_plotly_json()["operations"]
+    assert [(op["operation"], op["location"]) for op in operations] == \
+        [("Assign", ["data", 0, "y", 9]), ("Assign", ["data", 1, "y", 9])]
+
+
+@pytest.mark.parametrize("first, length", [(1, 10), (3, 10), (5, 10), (0, 14), (2, 12)])
+def test_new_minutes_are_appended_and_old_ones_trimmed(denis, first, length):
+    old, new = snapshot(denis, 0, 10), snapshot(denis, first, length, last=1.0)
+    assert patched(denis, old, new) == outputs(denis, new)
+
+
+@pytest.mark.parametrize("sync", [{"last_x": "minute 99", "n": 10},  # another window
+                                  {"last_x": "minute 3", "n": 10},   # more than half the window behind
+                                  {"last_x": "minute 9", "n": 0},
+                                  {"n": 10}])
+def test_full_redraw_when_the_client_cannot_be_patched(denis, sync):
+    assert denis.dashboard_delta(snapshot(denis, 0, 10), sync) is None
+    assert denis.dashboard_delta(snapshot(denis, 9, 10), sync) is None
+
+
+def test_update_dashboard_patches_match_full_figures(denis, monkeypatch):
+    # live traffic through the real callback, one snapshot per data version
+    monkeypatch.setattr(denis.snapshot_cache, "min_age", 0)
+    monkeypatch.setattr(denis, "SNAPSHOT_TICK_SECONDS", 10**9)
+    county = "Nairobi"
+    ci = denis.COUNTY_INDEX[county]
+    rng = np.random.default_rng(0)
+    clock = [1_800_000_000 - 3600]
+
+    def feed(seconds, per_tick=50):
+        n = per_tick * seconds // 5
+        ts = clock[0] + rng.integers(0, seconds, n)
+        denis.live.add_batch(np.sort(ts), np.full(n, ci), rng.integers(0, 3, n),
+                             rng.integers(0, 6, n), rng.integers(10, 2000, n))
+        clock[0] += seconds
+
+    def plain(values):
+        return json.loads(denis.to_json_plotly(list(values)))
+
+    feed(3600)  # an hour of history
+    sync = client = None
+    patches = 0
+    for tick in range(30):  # two and a half minutes of 5-second ticks
+        feed(5)
+        monkeypatch.setattr(denis, "DELTA_UPDATES", False)
+        full = denis.update_dashboard(county, tick, sync=sync)
+        monkeypatch.setattr(denis, "DELTA_UPDATES", True)
+        delta = denis.update_dashboard(county, tick, sync=sync)
+        if client is None or not isinstance(delta[0], denis.Patch):
+            client = plain(delta)
+        else:
+            patches += 1
+            client = [apply_patch(c, d) if isinstance(d, denis.Patch) else plain([d])[0]
+                      for c, d in zip(client, delta)]
+        expected = plain(full)
+        # everything but the sync store, whose value is the same object in both
+        assert client[:-1] == expected[:-1], f"tick {tick}"
+        sync = delta[-1]
+    assert patches == 29
@@ -0,0 +1,124 @@
+# test_donations.py - the STK push queue, callback matching and the callback route
+import time
+
+import pytest
+
+from donations import DonationQueue
+
+
+def accepted(checkout_id):
+    def send(phone, amount):
+        return {"success": True, "response": {"MerchantRequestID": "m-1", "CheckoutRequestID": checkout_id}}
+    return send
+
+
+def callback(checkout_id, result_code=0, phone="254700000001", amount=50):
+    cb = {"MerchantRequestID": "m-1", "CheckoutRequestID": checkout_id, "ResultCode": result_code,
+          "ResultDesc": "processed"}
+    if result_code == 0:
+        cb["CallbackMetadata"] = {"Item": [{"Name": "Amount", "Value": amount},
+                                           {"Name": "MpesaReceiptNumber", "Value": "RCP123"},
+                                           {"Name": "PhoneNumber", "Value": int(phone)}]}
+    return {"Body": {"stkCallback": cb}}
+
+
+def wait_for(queue, job_id, status):
+    deadline = time.time() + 5
+    while queue.status(job_id)["status"] != status:
+        assert time.time() < deadline, queue.status(job_id)
+        time.sleep(0.01)
+    return queue.status(job_id)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queues = []
+
+    def make(send, **options):
+        q = DonationQueue(str(tmp_path / "donations.db"), send, **options)
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q.shutdown()
+
+
+@pytest.mark.parametrize("result_code, status, receipt", [(0, "completed", "RCP123"), (1032, "cancelled", None)])
+def test_callback_settles_the_job_with_its_checkout_id(queue, result_code, status, receipt):
+    q = queue(accepted("ws_CO_1"))
+    job_id = q.submit("254700000001", 50)
+    assert wait_for(q, job_id, "pending")["checkout_request_id"] == "ws_CO_1"
+    assert q.record_callback(callback("ws_CO_1", result_code)) == job_id
+    job = q.status(job_id)
+    assert (job["status"], job["result_code"], job["receipt"]) == (status, result_code, receipt)
+
+
+def test_rejected_push_fails_the_job(queue):
+    q = queue(lambda phone, amount: {"success": False, "error": {"errorMessage": "Bad Request"}})
+    job_id = q.submit("254700000001", 50)
+    assert "Bad Request" in wait_for(q, job_id, "failed")["error"]
+
+
+@pytest.mark.parametrize("body", [{}, None, {"Body": {}}, callback("ws_CO_other")])
+def test_callback_matching_no_job_is_ignored(queue, body):
+    q = queue(accepted("ws_CO_1"))
+    job_id = q.submit("254700000001", 50)
+    wait_for(q, job_id, "pending")
+    assert q.record_callback(body) is None
+    assert q.status(job_id)["status"] == "pending"
+
+
+def test_unknown_job_is_not_settled_by_phone_and_amount(queue):
+    # a stale "sending" job becomes unknown; a callback with its phone and
+    # amount but another checkout id (anyone can post one) must not complete it
+    q = queue(accepted("ws_CO_1"), stale_after=-1)
+    job_id = q.submit("254700000001", 50)
+    wait_for(q, job_id, "pending")
+    q._update(job_id, status="sending")
+    q.recover()
+    assert q.status(job_id)["status"] == "unknown"
+    assert q.record_callback(callback("ws_CO_forged", phone="254700000001", amount=50)) is None
+    assert q.status(job_id)["status"] == "unknown"
+
+
+def test_recover_sends_jobs_left_queued_once(queue):
+    sent = []
+
+    def send(phone, amount):
+        sent.append(phone)
+        return accepted("ws_CO_1")(phone, amount)
+
+    first = queue(send)
+    job_id = first.submit("254700000001", 50)
+    wait_for(first, job_id, "pending")
+    first._update(job_id, status="queued")
+    second = queue(send)
+    assert second.recover() == 1
+    wait_for(second, job_id, "pending")
+    assert first.recover() == 0
+    assert sent == ["254700000001", "254700000001"]
+
+
+def test_callback_route_needs_the_token(denis, monkeypatch):
+    monkeypatch.setattr(denis.donation_queue, "send", accepted("ws_CO_route"))
+    job_id = denis.donation_queue.submit("254700000002", 20)
+    wait_for(denis.donation_queue, job_id, "pending")
+    client = denis.server.test_client()
+    assert client.post("/mpesa_callback", json=callback("ws_CO_route")).status_code in (404, 405)
+    assert client.post("/mpesa_callback/wrong", json=callback("ws_CO_route")).status_code == 403
+    assert denis.donation_queue.status(job_id)["status"] == "pending"
+    assert denis.build_stk_push_payload("254700000002", 20)["CallBackURL"].endswith("/" + denis.CALLBACK_TOKEN)
+    r = client.post(f"/mpesa_callback/{denis.CALLBACK_TOKEN}", json=callback("ws_CO_route"))
+    assert r.get_json()["ResultCode"] == 0
+    assert denis.donation_queue.status(job_id)["status"] == "completed"
+
+
+def test_status_polling_stops_after_the_deadline(denis, monkeypatch):
+    job = {"status": "queued", "created_at": time.time(), "response": None}
+    monkeypatch.setattr(denis.donation_queue, "status", lambda job_id: dict(job))
+    assert denis.show_donation_status({"job_id": "j"}, 1)[1] is False
+    job["created_at"] -= denis.DONATION_POLL_TIMEOUT + 1
+    assert denis.show_donation_status({"job_id": "j"}, 2)[1] is True
+    job["status"] = "unknown"
+    assert denis.show_donation_status({"job_id": "j"}, 3)[1] is True
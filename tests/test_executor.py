@@ -0,0 +1,117 @@
+# test_executor.py - CallbackPool supersession, timeouts and shutdown
+import time
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from executor import CallbackPool, Superseded
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def make(kind="thread", **options):
+        p = CallbackPool(kind, **options)
+        pools.append(p)
+        return p
+
+    yield make
+    for p in pools:
+        p.shutdown()
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        CallbackPool("greenlet")
+
+
+def test_inline_runs_in_the_calling_thread(pool):
+    p = pool("inline", timeout=0.01)
+    assert p.run("tab", "Nairobi", threading.get_ident) == threading.get_ident()
+    assert p.call(lambda: (time.sleep(0.05), "slow")[1]) == "slow"  # no timeout inline
+
+
+def test_switching_county_supersedes_the_older_request(pool):
+    p = pool(dispatchers=1)
+    release = threading.Event()
+    outcome = {}
+
+    def older():
+        try:
+            outcome["older"] = p.run("tab", "Nairobi", release.wait, 5)
+        except Superseded as e:
+            outcome["older"] = e
+
+    t = threading.Thread(target=older)
+    t.start()
+    while not p.stats()["in_flight"]:
+        time.sleep(0.001)
+    newer = threading.Thread(target=lambda: outcome.setdefault("newer", p.run("tab", "Mombasa", lambda: "Mombasa")))
+    newer.start()
+    t.join(5)
+    assert isinstance(outcome["older"], Superseded)
+    release.set()
+    newer.join(5)
+    assert outcome["newer"] == "Mombasa"
+    # the older build had started, so it finished in the background instead of being cancelled
+    assert p.stats()["superseded"] == 1 and p.stats()["cancelled"] == 0
+
+
+def test_same_key_from_the_same_tab_is_not_superseded(pool):
+    p = pool()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(p.run("tab", "Nairobi", time.sleep, 0.02)))
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert results == [None] * 3 and p.stats()["superseded"] == 0
+
+
+def test_run_times_out(pool):
+    p = pool(timeout=0.05)
+    release = threading.Event()
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        p.run("tab", "Nairobi", release.wait, 5)
+    assert time.perf_counter() - start < 1
+    release.set()
+    assert p.stats()["timed_out"] == 1 and p.stats()["in_flight"] == 0
+    assert p.run("tab", "Nairobi", lambda: "next tick") == "next tick"
+
+
+def test_process_call_times_out(pool):
+    p = pool("process", workers=1, preload=("time",), timeout=0.5)
+    assert p.call(time.sleep, 0) is None  # starts the pool
+    with pytest.raises(TimeoutError):
+        p.call(time.sleep, 3)
+    assert p.stats()["timed_out"] == 1
+
+
+def test_shutdown_cancels_queued_work_and_a_new_pool_starts(pool):
+    p = pool(dispatchers=1)
+    release = threading.Event()
+    outcome = []
+
+    def queued_request():
+        try:
+            outcome.append(p.run("b", 1, lambda: "queued"))
+        except CancelledError as e:
+            outcome.append(e)
+
+    busy = threading.Thread(target=lambda: p.run("a", 1, release.wait, 5))
+    busy.start()
+    while not p.stats()["in_flight"]:
+        time.sleep(0.001)
+    queued = threading.Thread(target=queued_request)
+    queued.start()
+    time.sleep(0.05)
+    p.shutdown()
+    release.set()
+    busy.join(5)
+    queued.join(5)
+    assert len(outcome) == 1 and isinstance(outcome[0], CancelledError)  # never ran
+    assert p.run("c", 1, lambda: "after") == "after"
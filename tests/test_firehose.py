@@ -0,0 +1,71 @@
+# test_firehose.py - per-second determinism of the synthetic stream and its events
+import time
+
+import numpy as np
+
+from constants import counties, payment_types, sectors
+from firehose import Firehose, Feed
+
+T = 1_700_000_000
+
+
+def hose(seed=1, rate=200.0):
+    return Firehose(counties, payment_types, sectors, rate=rate, seed=seed)
+
+
+def columns(batch):
+    return [getattr(batch, name).tolist() for name in ("ts", "county", "payment", "sector", "amount")]
+
+
+def test_seconds_do_not_depend_on_how_time_is_split():
+    whole = hose().seconds(T, T + 10)
+    other = hose()
+    parts = [other.seconds(T, T + 3), other.seconds(T + 3, T + 4), other.seconds(T + 4, T + 10)]
+    assert len(whole) > 0
+    assert columns(whole) == [sum(cols, []) for cols in zip(*map(columns, parts))]
+    assert columns(hose(seed=2).seconds(T, T + 10)) != columns(whole)
+
+
+def test_seconds_are_sorted_and_inside_the_range():
+    batch = hose().seconds(T, T + 5)
+    assert batch.is_sorted()
+    assert batch.ts.min() >= T and batch.ts.max() < T + 5
+
+
+def test_spike_multiplies_a_county():
+    nairobi = counties.index("Nairobi")
+    base = hose(rate=2000.0)
+    spiked = hose(rate=2000.0)
+    spiked.inject(T, T + 60, 10.0, "Nairobi")
+    before = int((base.seconds(T, T + 60).county == nairobi).sum())
+    after = int((spiked.seconds(T, T + 60).county == nairobi).sum())
+    assert 8 < after / before < 12
+
+
+def test_feed_events_are_the_same_for_every_feed():
+    a = Feed(hose(), sink=len, events_per_day=6)
+    b = Feed(hose(), sink=len, events_per_day=6)
+    a._events(T, T + 3 * 86400)
+    b._events(T + 86400, T + 86401)  # a later start adds that day's events only
+    b._events(T, T + 3 * 86400)
+    key = lambda e: (e.start, e.end, e.factor, e.county)
+    assert sorted(map(key, a.firehose.events)) == sorted(map(key, b.firehose.events))
+    assert len(a.firehose.events) > 0
+    a._events(T, T + 86400)  # days already seeded are not added twice
+    assert len(a.firehose.events) == len(b.firehose.events)
+
+
+def test_feed_applies_the_same_stream_from_its_origin():
+    # two workers' feeds, ticking at different moments
+    origin = int(time.time()) - 5
+    got = {}
+    for name, tick in (("a", 0.05), ("b", 0.13)):
+        batches = []
+        feed = Feed(hose(), sink=batches.append, tick=tick, origin=origin)
+        feed.start()
+        time.sleep(0.6)
+        feed.stop()
+        got[name] = np.concatenate([b.ts for b in batches])
+    n = min(len(got["a"]), len(got["b"]))
+    assert n > 0
+    assert got["a"][:n].tolist() == got["b"][:n].tolist()
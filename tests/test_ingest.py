@@ -0,0 +1,127 @@
+# test_ingest.py - Normalizer: name matching, timestamps and rejected rows
+import io
+import os
+import sys
+import json
+import subprocess
+
+import pandas as pd
+import pytest
+
+from columnar import TransactionBatch
+from constants import counties, payment_types, sectors
+from ingest import Normalizer, MAX_AMOUNT, read_csv, read_lines
+
+NAIROBI, ELDORET, HOMA_BAY = (counties.index(c) for c in ("Nairobi", "Eldoret", "Homa Bay"))
+MPESA, AIRTEL, BANK = range(3)
+RETAIL = sectors.index("Retail")
+TS = 1_700_000_000
+
+
+@pytest.fixture
+def normalizer():
+    return Normalizer(counties, payment_types, sectors)
+
+
+def frame(*rows):
+    return pd.DataFrame.from_records(rows, columns=["timestamp", "county", "payment_type", "sector", "amount"])
+
+
+def test_names_are_matched_with_case_spaces_and_aliases(normalizer):
+    b = normalizer.batch(frame(
+        (TS, " nairobi ", "M-Pesa", "retail", 100),
+        (TS, "Uasin Gishu", "AIRTEL", "Retail", 200),
+        (TS, "HomaBay", "rtgs", " RETAIL", 300),
+    ))
+    assert b.county.tolist() == [NAIROBI, ELDORET, HOMA_BAY]
+    assert b.payment.tolist() == [MPESA, AIRTEL, BANK]
+    assert b.sector.tolist() == [RETAIL] * 3
+    assert b.amount.tolist() == [100, 200, 300]
+    assert b.rejected == 0
+
+
+def test_timestamps(normalizer):
+    b = normalizer.batch(frame(
+        (str(TS), "Nairobi", "Mpesa", "Retail", 1),
+        (str(TS * 1000 + 999), "Nairobi", "Mpesa", "Retail", 1),  # milliseconds
+        ("2023-11-14T22:13:20Z", "Nairobi", "Mpesa", "Retail", 1),
+        ("2023-11-14 22:13:20", "Nairobi", "Mpesa", "Retail", 1),  # naive is UTC
+        ("2023-11-15T01:13:20+03:00", "Nairobi", "Mpesa", "Retail", 1),
+    ))
+    assert b.ts.tolist() == [TS] * 5
+    numeric = normalizer.batch(pd.DataFrame({"timestamp": [TS, TS * 1000], "county": ["Nairobi"] * 2,
+                                             "payment_type": ["Mpesa"] * 2, "sector": ["Retail"] * 2,
+                                             "amount": [5, 5]}))
+    assert numeric.ts.tolist() == [TS, TS]
+
+
+def test_rejected_rows_are_counted_by_first_failing_field(normalizer):
+    b = normalizer.batch(frame(
+        (TS, "Nairobi", "Mpesa", "Retail", 10.4),
+        ("not a date", "Atlantis", "Mpesa", "Retail", 1),
+        (None, "Nairobi", "Mpesa", "Retail", 1),
+        (TS, "Atlantis", "Mpesa", "Retail", 1),
+        (TS, None, "Mpesa", "Retail", 1),
+        (TS, "Nairobi", "Cheque", "Retail", 1),
+        (TS, "Nairobi", "Mpesa", "Farming", 1),
+        (TS, "Nairobi", "Mpesa", "Retail", -1),
+        (TS, "Nairobi", "Mpesa", "Retail", MAX_AMOUNT + 1),
+        (TS, "Nairobi", "Mpesa", "Retail", "ten"),
+    ))
+    assert len(b) == 1
+    assert b.amount.tolist() == [10]
+    assert b.rejected == 9
+    assert normalizer.rejected == {"malformed": 0, "timestamp": 2, "county": 2, "payment_type": 1,
+                                   "sector": 1, "amount": 3}
+
+
+def test_default_county_fills_missing_ones(normalizer):
+    normalizer = Normalizer(counties, payment_types, sectors, default_county="Eldoret")
+    b = normalizer.batch(pd.DataFrame({"timestamp": [TS, TS], "county": [None, "Nairobi"],
+                                       "payment_type": ["Mpesa"] * 2, "sector": ["Retail"] * 2, "amount": [1, 2]}))
+    assert b.county.tolist() == [ELDORET, NAIROBI]
+    b = normalizer.batch(pd.DataFrame({"timestamp": [TS], "payment_type": ["Mpesa"], "sector": ["Retail"],
+                                       "amount": [1]}))
+    assert b.county.tolist() == [ELDORET]
+
+
+def test_check_codes_drops_out_of_range_rows(normalizer):
+    batch = TransactionBatch([TS] * 3, [0, len(counties), 1], [0, 0, len(payment_types)], [0, 0, 0], [1, 2, 3])
+    b = normalizer.check_codes(batch)
+    assert b.amount.tolist() == [1]
+    assert b.rejected == 2
+    assert normalizer.rejected["malformed"] == 2
+
+
+def test_csv_and_json_lines_readers(normalizer):
+    csv = io.BytesIO(b"timestamp,county,payment_type,sector,amount,extra\n"
+                     b"1700000000,Nairobi,Mpesa,Retail,50,x\n1700000060,Kisumu,Airtel,Banking,70,y\n")
+    b = normalizer.batch(next(read_csv(csv, 10)))
+    assert (b.ts.tolist(), b.amount.tolist()) == ([TS, TS + 60], [50, 70])
+
+    malformed = {"malformed": 0}
+    lines = io.StringIO('{"timestamp": 1700000000, "county": "Nairobi", "payment_type": "Mpesa", '
+                        '"sector": "Retail", "amount": 5}\nnot json\n[1, 2]\n\n')
+    chunks = list(read_lines(lines, 10, malformed=malformed))
+    assert [len(c) for c in chunks] == [1]
+    assert malformed == {"malformed": 2}
+    assert normalizer.batch(chunks[0]).county.tolist() == [NAIROBI]
+
+
+def test_backfill_refuses_minutes_already_rolled_up(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    export = tmp_path / "day.csv"
+    export.write_text("timestamp,county,payment_type,sector,amount\n"
+                      f"{TS},Nairobi,Mpesa,Retail,50\n{TS + 60},Kisumu,Airtel,Banking,70\n")
+    run = [sys.executable, f"{root}/ingest.py", str(export), "--rollup-dir", str(tmp_path / "rollups")]
+
+    first = subprocess.run(run, capture_output=True, text=True)
+    assert first.returncode == 0, first.stderr
+    summary = json.loads(first.stdout)
+    assert (summary["accepted"], summary["rows_before_rollups"]) == (2, 0)
+
+    again = subprocess.run(run, capture_output=True, text=True)
+    assert again.returncode == 1
+    summary = json.loads(again.stdout)
+    assert (summary["accepted"], summary["rows_before_rollups"], summary["rollup_rows_written"]) == (2, 2, 0)
+    assert "were not written" in again.stderr
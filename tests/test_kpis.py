@@ -0,0 +1,59 @@
+# test_kpis.py - the compact KPI data of a snapshot and the browser code drawing the cards
+import json
+import shutil
+import subprocess
+
+import pandas as pd
+import pytest
+
+from alerts import SPIKE, DROP, STABLE
+from figures import render_snapshot
+
+
+def frames():
+    minutes = pd.date_range("2024-03-01 08:00", periods=4, freq="min")
+    df_tpm = pd.DataFrame({"datetime": minutes, "tpm": [10.0, 12.5, 7.333, 20.0],
+                           "txns": [10, 25, 22, 20], "amount": [1000, 2500, 2200, 2000]})
+    trend = pd.DataFrame({"datetime": list(minutes) * 2, "Transactions": [1, 2, 3, 4, 5, 6, 7, 8],
+                          "Payment Type": ["M-Pesa"] * 4 + ["Card"] * 4, "Sector": ["Retail"] * 4 + ["Transport"] * 4})
+    heatmap = pd.DataFrame({"hour": [8, 9], "day": ["Fri", "Fri"], "tpm": [10.0, 20.0]})
+    return df_tpm, trend, trend, heatmap
+
+
+def test_snapshot_kpi_is_compact():
+    payload, timings = render_snapshot("Nairobi", *frames(), SPIKE, "Last 6 Hours")
+    kpi = json.loads(payload)["kpi"]
+    # totals from the bucket totals, not the per-minute rate; the rate is the last bucket's
+    assert kpi == {"total_txn": 77, "total_amt": 7700, "current_tpm": 20, "alert": SPIKE, "range": "Last 6 Hours",
+                   "tpm": [10.0, 12.5, 7.33, 20.0], "amount": [1000, 2500, 2200, 2000]}
+    assert [name for name, _ in timings][-1] == "serialize"
+
+
+def run_js(source, kpi):
+    script = ("window = {dash_clientside: {PreventUpdate: 'prevent'}};\n"
+              f"const render = {source};\n"
+              f"try {{ console.log(JSON.stringify(render({json.dumps(kpi)}))); }}"
+              " catch (e) { console.log(JSON.stringify({thrown: e})); }")
+    out = subprocess.run(["node", "-e", script], capture_output=True, text=True, timeout=30, check=True)
+    return json.loads(out.stdout)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node to run the clientside callback")
+@pytest.mark.parametrize("alert", [SPIKE, STABLE, DROP])
+def test_cards_are_drawn_from_kpi_data(denis, alert):
+    kpi = {"total_txn": 1234567, "total_amt": 98765432, "current_tpm": 1500, "alert": alert,
+           "range": "Last 24 Hours", "tpm": [1.5, 2.0, 3.0], "amount": [100, 200, 300]}
+    texts = run_js(denis.RENDER_KPIS, kpi)
+    assert texts[:4] == ["Total Txns (Last 24 Hours): 1,234,567", "Total Amount (KES): 98,765,432",
+                         "Current TPM: 1,500", denis.ALERT_LABELS[alert]]
+    assert texts[4]["color"] == denis.ALERT_COLORS[alert]
+    sparks = texts[5:]
+    assert [s["data"][0]["y"] for s in sparks] == [kpi["tpm"], kpi["amount"], kpi["tpm"], kpi["tpm"]]
+    assert [s["data"][0]["line"]["color"] for s in sparks] == list(denis.KPI_CARDS.values())
+    key = next(k for k in denis.app.callback_map if "total-txn.children" in k)
+    assert len(texts) == len(denis.app.callback_map[key]["output"])  # one value per card output
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node to run the clientside callback")
+def test_no_kpi_data_draws_nothing(denis):
+    assert run_js(denis.RENDER_KPIS, None) == {"thrown": "prevent"}
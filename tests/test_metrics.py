@@ -0,0 +1,46 @@
+# test_metrics.py - adding up the metric files of several processes
+import os
+import json
+import subprocess
+import sys
+
+from metrics import Metrics
+
+
+def write_snapshot(metrics, pid, counters, gauges):
+    with open(os.path.join(metrics.directory, f"metrics-{pid}.json"), "w", encoding="utf-8") as f:
+        json.dump({"buckets": list(metrics.buckets), "histograms": [],
+                   "counters": [[n, sorted(l.items()), v] for n, l, v in counters],
+                   "gauges": [[n, sorted(dict(l, worker=str(pid)).items()), v] for n, l, v in gauges]}, f)
+
+
+def exited_pid():
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    return child.pid
+
+
+def test_counters_add_up_and_gauges_stay_per_worker(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.add_collector(lambda: [("rows_total", {}, 5)])
+    metrics.add_collector(lambda: [("events", {}, 100)], kind="gauge")
+    other, dead = os.getppid(), exited_pid()
+    write_snapshot(metrics, other, [("rows_total", {}, 3)], [("events", {}, 100)])
+    write_snapshot(metrics, dead, [("rows_total", {}, 2)], [("events", {}, 90)])
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE rows_total counter" in lines
+    assert "rows_total 10" in lines
+    assert "# TYPE events gauge" in lines
+    assert f'events{{worker="{os.getpid()}"}} 100' in lines
+    assert f'events{{worker="{other}"}} 100' in lines
+    # the exited worker's counts stay in the total, its gauge goes
+    assert not any(f'worker="{dead}"' in line for line in lines)
+    assert not os.path.exists(tmp_path / f"metrics-{dead}.json")
+    assert "rows_total 10" in metrics.render().splitlines()
+
+
+def test_without_directory_gauges_carry_this_worker():
+    metrics = Metrics()
+    metrics.add_collector(lambda: [("events", {"county": "Nairobi"}, 7)], kind="gauge")
+    assert f'events{{county="Nairobi",worker="{os.getpid()}"}} 7' in metrics.render().splitlines()
@@ -0,0 +1,61 @@
+# test_push.py - PushHub fan-out to many subscribers
+import threading
+
+from push import PushHub
+
+SUBSCRIBERS = 50
+
+
+def test_every_subscriber_gets_data_on_connect_and_every_publish():
+    version = {"n": 0}
+    built = []
+
+    def build(channel):
+        built.append(channel)
+        return f'{{"channel": "{channel}", "version": {version["n"]}}}'
+
+    hub = PushHub(build, heartbeat=0.05)
+    channels = [f"county-{i % 5}" for i in range(SUBSCRIBERS)]
+    on_connect, published = [None] * SUBSCRIBERS, [None] * SUBSCRIBERS
+    connected = threading.Barrier(SUBSCRIBERS + 1, timeout=10)
+
+    def subscriber(i):
+        frames = hub.subscribe(channels[i])
+        assert next(frames).startswith("retry:")
+        on_connect[i] = next(frames)
+        connected.wait()
+        for frame in frames:
+            if frame.startswith("id:"):
+                published[i] = frame
+                break
+        frames.close()
+
+    threads = [threading.Thread(target=subscriber, args=(i,), daemon=True) for i in range(SUBSCRIBERS)]
+    for t in threads:
+        t.start()
+    connected.wait()
+    assert hub.stats()["subscribers"] == SUBSCRIBERS
+    assert hub.stats()["channels"] == 5
+    for i, frame in enumerate(on_connect):
+        assert frame.startswith("id: ") and f'"channel": "{channels[i]}", "version": 0' in frame
+
+    version["n"] = 1
+    del built[:]
+    hub.publish_all()
+    for t in threads:
+        t.join(10)
+    assert sorted(built) == sorted(set(channels))  # one build per channel, not per subscriber
+    for i, frame in enumerate(published):
+        assert frame is not None and f'"channel": "{channels[i]}", "version": 1' in frame
+    assert hub.stats()["subscribers"] == 0
+
+
+def test_unchanged_payload_is_not_published():
+    hub = PushHub(lambda channel: "same", heartbeat=0.05)
+    frames = hub.subscribe("Nairobi")
+    next(frames)
+    assert next(frames) == "id: 1\ndata: same\n\n"
+    hub.publish_all()
+    assert next(frames) == ": keep-alive\n\n"
+    assert hub.stats()["skipped"] == 1
+    frames.close()
@@ -0,0 +1,113 @@
+# test_rollups.py - RollupStore recovery after a restart or a crash mid-append
+import os
+
+import numpy as np
+import pytest
+
+from rollups import RollupStore, COUNT_DTYPE, AMOUNT_DTYPE, TIME_DTYPE
+
+DAY = 1_700_000_000 // 86400 * 86400
+SHAPE = (2, 1, 1)
+
+
+def minute(n):
+    # n transactions of KES 10 in county 0, one in county 1
+    counts = np.array([n, 1]).reshape(SHAPE)
+    return counts, counts * 10
+
+
+def store(directory):
+    s = RollupStore(str(directory), *SHAPE)
+    assert s.acquire()
+    return s
+
+
+def write_minutes(s, minutes):
+    for m in minutes:
+        s.add_minute(DAY // 60 + m, *minute(m))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return tmp_path / "rollups"
+
+
+def test_restart_rebuilds_the_open_hour_from_minutes(directory):
+    s = store(directory)
+    write_minutes(s, range(90))  # hour 0 complete, hour 1 open at minute 89
+    s.close()
+
+    s = store(directory)
+    hour = s.by_name["hour"]
+    assert hour.last == DAY
+    assert hour.open_bucket == DAY + 3600
+    assert s.by_name["day"].open_bucket == DAY
+    assert s.by_name["minute"].last == DAY + 89 * 60
+    assert hour.open_counts[:, 0, 0].tolist() == [sum(range(60, 90)), 30]
+    assert hour.open_amounts[:, 0, 0].tolist() == [10 * sum(range(60, 90)), 300]
+
+    write_minutes(s, [120])  # closes hour 1 with the rebuilt sums
+    times, counts, _ = s.series(DAY, DAY + 3 * 3600, 3600, county=0)
+    assert counts[:, 0, 0].tolist() == [sum(range(60)), sum(range(60, 90)), 120]
+    assert s.by_name["hour"].last == DAY + 3600
+
+
+def test_restart_after_a_closed_hour_keeps_it_closed(directory):
+    s = store(directory)
+    write_minutes(s, range(61))  # minute 60 appended hour 0 and opened hour 1
+    s.close()
+
+    s = store(directory)
+    assert s.by_name["hour"].last == DAY
+    assert s.by_name["hour"].open_bucket == DAY + 3600
+    assert s.by_name["hour"].open_counts[:, 0, 0].tolist() == [60, 1]
+    assert s.add_minute(DAY // 60 + 60, *minute(60)) is False  # already on disk
+    assert s.late == 1
+
+
+def test_repair_cuts_a_partly_written_row(directory):
+    s = store(directory)
+    write_minutes(s, range(3))
+    s.close()
+    res = s.by_name["minute"]
+    time_path, count_path, amount_path = res.paths(DAY // res.segment)
+    cells = int(np.prod(SHAPE))
+    # a crash after the counts of a fourth row but before its amounts and time
+    with open(count_path, "ab") as f:
+        f.write(np.zeros(cells, dtype=COUNT_DTYPE).tobytes())
+    with open(amount_path, "ab") as f:
+        f.write(b"\0" * 5)
+
+    s = store(directory)
+    assert os.path.getsize(time_path) == 3 * TIME_DTYPE().itemsize
+    assert os.path.getsize(count_path) == 3 * cells * COUNT_DTYPE().itemsize
+    assert os.path.getsize(amount_path) == 3 * cells * AMOUNT_DTYPE().itemsize
+    assert s.by_name["minute"].last == DAY + 2 * 60
+
+    write_minutes(s, [3])
+    times, counts, amounts = s.series(DAY, DAY + 4 * 60, 60, county=0)
+    assert counts[:, 0, 0].tolist() == [0, 1, 2, 3]
+    assert amounts[:, 0, 0].tolist() == [0, 10, 20, 30]
+
+
+def test_repair_drops_a_time_without_its_columns(directory):
+    s = store(directory)
+    write_minutes(s, range(1, 3))
+    s.close()
+    res = s.by_name["minute"]
+    time_path = res.paths(DAY // res.segment)[0]
+    with open(time_path, "ab") as f:
+        f.write(np.array([DAY + 5 * 60], dtype=TIME_DTYPE).tobytes())
+
+    s = store(directory)
+    assert os.path.getsize(time_path) == 2 * TIME_DTYPE().itemsize
+    assert s.last_minute() == DAY + 2 * 60
+
+
+def test_one_writer_at_a_time(directory):
+    writer = store(directory)
+    other = RollupStore(str(directory), *SHAPE)
+    assert other.acquire() is False
+    assert other.add_minute(DAY // 60, *minute(1)) is False
+    writer.close()
+    assert other.acquire() is True
@@ -0,0 +1,88 @@
+# test_snapshots.py - SnapshotCache hits, expiry, disk tier and concurrent builds
+import time
+import threading
+
+from snapshots import SnapshotCache
+
+
+class Builder:
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return f'{{"build": {self.calls}}}'
+
+
+def test_unchanged_version_is_a_hit_in_every_bucket():
+    cache, build = SnapshotCache(min_age=0), Builder()
+    for bucket in range(5):
+        assert cache.get_or_build("Nairobi", bucket, "v1", build) == '{"build": 1}'
+    s = cache.stats()
+    assert (build.calls, s["hits"], s["misses"], s["entries"]) == (1, 4, 1, 1)
+    assert cache.ticks == 5
+
+
+def test_new_version_is_a_miss_once_min_age_passed():
+    cache, build = SnapshotCache(min_age=0.05), Builder()
+    cache.get_or_build("Nairobi", 0, "v1", build)
+    assert cache.get_or_build("Nairobi", 0, "v2", build) == '{"build": 1}'  # too young to rebuild
+    time.sleep(0.06)
+    assert cache.get_or_build("Nairobi", 1, "v2", build) == '{"build": 2}'
+    assert cache.get_or_build("Nairobi", 2, "v2", build) == '{"build": 2}'
+    assert cache.get_or_build("Mombasa", 2, "v2", build) == '{"build": 3}'
+    assert cache.stats()["misses"] == 3
+
+
+def test_lru_bound_and_invalidate():
+    cache, build = SnapshotCache(max_entries=2, min_age=0), Builder()
+    for county in ("Nairobi", "Mombasa", "Kisumu"):
+        cache.get_or_build(county, 0, "v1", build)
+    assert cache.stats()["entries"] == 2
+    cache.get_or_build("Nairobi", 0, "v1", build)  # evicted first
+    assert build.calls == 4
+    cache.invalidate("Nairobi")
+    cache.get_or_build("Nairobi", 0, "v1", build)
+    assert build.calls == 5
+
+
+def test_disk_tier_is_shared_by_version(tmp_path):
+    first, second = SnapshotCache(directory=str(tmp_path), min_age=0), SnapshotCache(directory=str(tmp_path), min_age=0)
+    build = Builder()
+    first.get_or_build("Murang'a", 0, "v1", build)
+    assert second.get_or_build("Murang'a", 7, "v1", build) == '{"build": 1}'
+    assert second.stats()["disk_hits"] == 1
+    assert second.get_or_build("Murang'a", 7, "v2", build) == '{"build": 2}'
+    assert build.calls == 2
+
+
+def test_concurrent_misses_build_once():
+    cache, build = SnapshotCache(min_age=0), Builder(delay=0.05)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_build("Nairobi", 0, "v1", build)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert build.calls == 1 and results == ['{"build": 1}'] * 8
+
+
+def test_dashboard_snapshot_is_reused_until_the_county_changes(denis, monkeypatch):
+    monkeypatch.setattr(denis, "SNAPSHOT_TICK_SECONDS", 0.001)
+    monkeypatch.setattr(denis.snapshot_cache, "min_age", 0)
+    county = "Nyeri"
+    ci = denis.COUNTY_INDEX[county]
+    if int(time.time()) % 60 > 55:
+        time.sleep(5)  # not across a minute boundary
+    denis.get_snapshot(county)
+    misses = denis.snapshot_cache.stats()["misses"]
+    time.sleep(0.01)  # a later tick bucket
+    denis.get_snapshot(county)
+    assert denis.snapshot_cache.stats()["misses"] == misses
+    head = denis.live.head if denis.live.head is not None else int(time.time()) // 60
+    denis.live.add_batch([head * 60 + 1], [ci], [0], [0], [100])
+    denis.get_snapshot(county)
+    assert denis.snapshot_cache.stats()["misses"] == misses + 1
@@ -0,0 +1,67 @@
+# test_userstore.py - SQLite user accounts and the users.json migration
+import os
+import json
+
+import pytest
+
+from userstore import UserStore, DuplicateEmail
+
+
+def user(email, name="Wanjiru"):
+    return {"full_name": name, "email": email, "password_hash": "x", "subscription": "free",
+            "registered_at": "2024-01-01T00:00:00Z"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UserStore(str(tmp_path / "users.db"))
+
+
+def test_add_and_email_exists_ignore_case(store):
+    assert not store.email_exists("a@example.com")
+    store.add(user("A@Example.com"))
+    assert store.email_exists("a@example.com")
+    assert store.get("a@EXAMPLE.com")["email"] == "A@Example.com"
+    with pytest.raises(DuplicateEmail):
+        store.add(user("a@example.COM", name="Other"))
+    assert store.count() == 1
+
+
+def test_migrate_json_counts_skipped_duplicates(store, tmp_path):
+    store.add(user("taken@example.com"))
+    path = str(tmp_path / "users.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([user("a@example.com"), user("b@example.com"), user("A@example.com", name="Again"),
+                   user("taken@example.com"), "not a user"], f)
+    assert store.migrate_json(path) == (2, 2)
+    assert store.migration == {"source": path, "imported": 2, "skipped": 2}
+    assert [u["email"] for u in store.all()] == ["taken@example.com", "a@example.com", "b@example.com"]
+    assert store.get("a@example.com")["full_name"] == "Wanjiru"  # the first entry wins
+    # the file is kept as .migrated, skipped users included, and not imported again
+    assert not os.path.exists(path) and os.path.exists(path + ".migrated")
+    assert store.migrate_json(path) == (0, 0)
+    assert store.stats() == {"users": 3, "migration": {"source": path, "imported": 2, "skipped": 2}}
+
+
+def test_migrate_json_without_a_file(store, tmp_path):
+    assert store.migrate_json(str(tmp_path / "missing.json")) == (0, 0)
+    assert store.migration is None
+
+
+def test_replace_all_is_atomic(store):
+    store.add(user("old@example.com"))
+    assert store.replace_all([user("new@example.com"), user("NEW@example.com"), user("two@example.com")]) == 2
+    assert [u["email"] for u in store.all()] == ["new@example.com", "two@example.com"]
+    with pytest.raises(AttributeError):
+        store.replace_all([user("three@example.com"), None])  # fails midway
+    assert [u["email"] for u in store.all()] == ["new@example.com", "two@example.com"]
+
+
+def test_denis_helpers(denis):
+    assert not denis.email_exists("helper@example.com")
+    denis.add_user("Achieng", "helper@example.com", "secret", "premium")
+    assert denis.email_exists("HELPER@example.com")
+    saved = denis.user_store.get("helper@example.com")
+    assert saved["password_hash"] == denis.hash_password("secret")
+    with pytest.raises(DuplicateEmail):
+        denis.add_user("Achieng", "Helper@Example.com", "other", "free")
@@ -0,0 +1,99 @@
+# test_warmstate.py - saving and restoring dashboard state across restarts
+import os
+import time
+
+import numpy as np
+
+from aggregator import RollingWindow
+from alerts import AnomalyDetector
+from warmstate import StateFile
+
+M = 28_000_000  # an epoch minute
+
+
+def filled_window(n_counties=3, minutes=5):
+    w = RollingWindow(n_counties, 2, 2, minutes=minutes)
+    w.add_batch(np.array([M * 60, M * 60 + 1, (M + 2) * 60]), np.array([0, 1, 2]),
+                np.array([0, 1, 0]), np.array([1, 0, 1]), np.array([10, 20, 30]))
+    return w
+
+
+def test_save_and_restore_every_part(tmp_path):
+    path = str(tmp_path / "state.npz")
+    window, detector = filled_window(), AnomalyDetector(3)
+    detector.observe(M, [5.0, 6.0, 7.0])
+    saved = StateFile(path, {"live": window, "detector": detector})
+    assert saved.save()
+    assert os.listdir(tmp_path) == ["state.npz"]  # written through a temporary file
+
+    copy, copy_detector = RollingWindow(3, 2, 2, minutes=5), AnomalyDetector(3)
+    state = StateFile(path, {"live": copy, "detector": copy_detector})
+    assert state.restore()
+    assert state.restored["parts"] == ["live", "detector"] and state.restored["age_s"] < 60
+    assert (copy.counts == window.counts).all() and (copy.amounts == window.amounts).all()
+    assert (copy.head, copy.events) == (M + 2, 3)
+    assert (copy.version > window.version).all()  # snapshots cached before the restore are stale
+    assert copy_detector.state(2) == detector.state(2)
+
+
+def test_mismatched_part_starts_empty_and_the_others_load(tmp_path):
+    # a state file from a build with another window length or county list
+    path = str(tmp_path / "state.npz")
+    detector = AnomalyDetector(3)
+    detector.observe(M, [5.0, 6.0, 7.0])
+    StateFile(path, {"live": filled_window(minutes=5), "detector": detector}).save()
+
+    longer, copy_detector = RollingWindow(3, 2, 2, minutes=60), AnomalyDetector(3)
+    state = StateFile(path, {"live": longer, "detector": copy_detector})
+    assert state.restore()
+    assert state.restored["parts"] == ["detector"] and state.errors == 1
+    assert longer.head is None and longer.counts.sum() == 0
+    assert copy_detector.state(0)["minute"] == M
+
+    more_counties = StateFile(path, {"live": RollingWindow(4, 2, 2, minutes=5), "detector": AnomalyDetector(4)})
+    assert not more_counties.restore()
+    assert more_counties.restored["parts"] == [] and more_counties.errors == 2
+
+
+def test_missing_part_keys_are_skipped(tmp_path):
+    path = str(tmp_path / "state.npz")
+    np.savez_compressed(path, **{"saved_at": np.array(time.time()), "live.counts": np.zeros((3, 5, 2, 2))})
+    window = RollingWindow(3, 2, 2, minutes=5)
+    state = StateFile(path, {"live": window, "cube": window})
+    assert not state.restore()
+    assert state.errors == 1 and window.head is None
+
+
+def test_unusable_files(tmp_path):
+    window = RollingWindow(3, 2, 2, minutes=5)
+    assert not StateFile(str(tmp_path / "missing.npz"), {"live": window}).restore()
+    path = tmp_path / "state.npz"
+    StateFile(str(path), {"live": filled_window()}).save()
+    data = path.read_bytes()
+    for size in (0, 100, len(data) // 2, len(data) - 10):
+        path.write_bytes(data[:size])  # cut short, e.g. by a full disk during a copy
+        state = StateFile(str(path), {"live": window})
+        assert not state.restore() and state.errors == 1
+    assert window.head is None
+
+
+def test_stale_state_is_restored_then_aged_out(tmp_path):
+    path = str(tmp_path / "state.npz")
+    StateFile(path, {"live": filled_window()}).save()
+    window = RollingWindow(3, 2, 2, minutes=5)
+    assert StateFile(path, {"live": window}).restore()
+    window.advance((M + 100) * 60)  # restarted long after the save
+    minutes, counts, _ = window.window(0)
+    assert minutes.tolist() == list(range(M + 96, M + 101)) and counts.sum() == 0
+    assert window.events == 3  # the lifetime count survives
+
+
+def test_only_a_notified_process_saves_on_exit(tmp_path):
+    path = str(tmp_path / "state.npz")
+    state = StateFile(path, {"live": filled_window()}, every=3600)
+    state.flush()  # the master: restored, never notified
+    assert not os.path.exists(path)
+    state.notify()
+    state.flush()
+    assert os.path.exists(path) and state.saves == 1
+    assert state.stats()["bytes"] == os.path.getsize(path)
@@ -0,0 +1,157 @@
+# userstore.py - SQLite-backed user accounts (replaces whole-file users.json rewrites)
+import os
+import json
+import sqlite3
+import threading
+
+USER_FIELDS = ("full_name", "email", "password_hash", "subscription", "registered_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    full_name TEXT,
+    email TEXT NOT NULL,
+    email_key TEXT NOT NULL,
+    password_hash TEXT,
+    subscription TEXT,
+    registered_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users(email_key);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+INSERT_ROW = ("INSERT OR IGNORE INTO users (full_name, email, email_key, password_hash, subscription, registered_at) "
+              "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def email_key(email):
+    # same comparison the JSON version used: case-insensitive (unicode-aware)
+    return (email or "").lower()
+
+
+class DuplicateEmail(ValueError):
+    pass
+
+
+class UserStore:
+    """
+    Users in SQLite (WAL mode) with a unique index on the lowercased email, so
+    lookups and registrations cost O(log n) and concurrent writers from several
+    gunicorn workers cannot overwrite each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.migration = None  # {"source", "imported", "skipped"} of the last migrate_json()
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # SQLite connections must not cross a fork (gunicorn --preload)
+        self._local = threading.local()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def email_exists(self, email):
+        row = self._connect().execute("SELECT 1 FROM users WHERE email_key = ?",
+                                      (email_key(email),)).fetchone()
+        return row is not None
+
+    def get(self, email):
+        row = self._connect().execute(f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE email_key = ?",
+                                      (email_key(email),)).fetchone()
+        return dict(row) if row else None
+
+    def add(self, user):
+        """
+        Inserts one user dict. Raises DuplicateEmail if the email is taken.
+        """
+        try:
+            with self._connect() as db:
+                db.execute("INSERT INTO users (full_name, email, email_key, password_hash, subscription, "
+                           "registered_at) VALUES (?, ?, ?, ?, ?, ?)", self._row(user))
+        except sqlite3.IntegrityError:
+            raise DuplicateEmail("An account with that email already exists.")
+
+    def _row(self, user):
+        return (user.get("full_name"), user.get("email") or "", email_key(user.get("email")),
+                user.get("password_hash"), user.get("subscription"), user.get("registered_at"))
+
+    def bulk_import(self, users, batch_size=10000):
+        """
+        Imports an iterable of user dicts in batched transactions, skipping emails
+        that already exist. Returns the number of users inserted.
+        """
+        db = self._connect()
+        inserted = 0
+        batch = []
+        for user in users:
+            batch.append(self._row(user))
+            if len(batch) >= batch_size:
+                inserted += self._insert_batch(db, batch)
+                batch = []
+        if batch:
+            inserted += self._insert_batch(db, batch)
+        return inserted
+
+    def _insert_batch(self, db, rows):
+        with db:
+            before = db.total_changes
+            db.executemany(INSERT_ROW, rows)
+            return db.total_changes - before
+
+    def all(self):
+        rows = self._connect().execute(f"SELECT {', '.join(USER_FIELDS)} FROM users ORDER BY id")
+        return [dict(r) for r in rows]
+
+    def replace_all(self, users):
+        """
+        Replaces every user in one transaction: if the import fails midway,
+        the previous users are kept. Of several users with the same email only
+        the first is kept; returns the number kept.
+        """
+        with self._connect() as db:
+            db.execute("DELETE FROM users")
+            before = db.total_changes
+            db.executemany(INSERT_ROW, (self._row(u) for u in users))
+            return db.total_changes - before
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def migrate_json(self, json_path):
+        """
+        One-shot import of a legacy users.json. The file is renamed to
+        `<json_path>.migrated` afterwards so it is not imported again.
+        Returns (imported, skipped): users whose email was already taken, by
+        the database or by an earlier entry of the file, are skipped (they
+        stay in the .migrated file), and both counts are kept in `migration`.
+        """
+        if not os.path.exists(json_path):
+            return 0, 0
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                users = [u for u in json.load(f) if isinstance(u, dict)]
+        except Exception:
+            return 0, 0
+        inserted = self.bulk_import(users)
+        self.migration = {"source": json_path, "imported": inserted, "skipped": len(users) - inserted}
+        try:
+            os.replace(json_path, json_path + ".migrated")
+        except OSError:
+            pass  # another worker migrated it first
+        return inserted, len(users) - inserted
+
+    def stats(self):
+        return {"users": self.count(), "migration": self.migration}
@@ -0,0 +1,116 @@
+# warmstate.py - periodic snapshots of in-memory dashboard state, restored at boot
+import os
+import time
+import threading
+
+import numpy as np
+
+
+class StateFile:
+    """
+    Saves the state of several components to one .npz file and restores it.
+
+    `parts` maps a name to an object with dump() -> {key: array} and
+    load(state). save() writes every part (arrays as `<name>.<key>`) to a
+    temporary file and renames it over `path`, so readers never see half a
+    file. restore() loads the parts found in the file and skips the others.
+
+    Saving runs on a background thread every `every` seconds. The thread is
+    started by the first notify() (e.g. from RollingWindow.on_minute_close),
+    so under gunicorn --preload it runs in the workers that receive data, not
+    in the master that restored the file before forking. flush() saves once
+    more on exit, but only in a process that has been notified: the master's
+    restored copy never overwrites the workers' newer state.
+    """
+
+    def __init__(self, path, parts, every=30.0):
+        self.path = path
+        self.parts = parts
+        self.every = every
+        self.saves = 0
+        self.errors = 0
+        self.last_save_ms = None
+        self.restored = None  # {"parts": [...], "age_s": ..., "ms": ...} after a successful restore()
+        self._lock = threading.Lock()
+        self._thread = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def save(self):
+        start = time.perf_counter()
+        arrays = {"saved_at": np.array(time.time())}
+        for name, part in self.parts.items():
+            for key, value in part.dump().items():
+                arrays[f"{name}.{key}"] = value
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp, "wb") as f:
+                    np.savez_compressed(f, **arrays)
+                os.replace(tmp, self.path)
+            except OSError:
+                self.errors += 1
+                return False
+            self.saves += 1
+            self.last_save_ms = (time.perf_counter() - start) * 1000
+        return True
+
+    def restore(self):
+        """
+        Loads the parts saved in `path`. Returns False if there is no usable file.
+        """
+        start = time.perf_counter()
+        try:
+            with np.load(self.path) as f:
+                arrays = {key: f[key] for key in f.files}
+        except FileNotFoundError:
+            return False
+        except Exception:
+            # truncated or damaged: zipfile and zlib raise a variety of errors,
+            # none of which should stop the app from starting empty
+            self.errors += 1
+            return False
+        loaded = []
+        for name, part in self.parts.items():
+            prefix = name + "."
+            state = {key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)}
+            if not state:
+                continue
+            try:
+                part.load(state)
+            except (KeyError, ValueError):
+                self.errors += 1  # saved by an incompatible version; start that part empty
+                continue
+            loaded.append(name)
+        saved_at = float(arrays["saved_at"]) if "saved_at" in arrays else None
+        self.restored = {"parts": loaded, "age_s": None if saved_at is None else time.time() - saved_at,
+                         "ms": (time.perf_counter() - start) * 1000}
+        return bool(loaded)
+
+    def notify(self, *args):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="state-saver", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.every)
+            try:
+                self.save()
+            except Exception:
+                self.errors += 1
+
+    def flush(self):
+        if self._thread is not None:
+            self.save()
+
+    def stats(self):
+        return {"path": self.path, "saves": self.saves, "errors": self.errors,
+                "last_save_ms": self.last_save_ms, "restored": self.restored,
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}